@@ -0,0 +1,238 @@
+""" Read-only data for the atlas Bokeh app, loaded once per server process.
+
+bokeh serve runs atlas.py again for every new browser session, but this module is imported only once per process, so
+the graph_names table, the graph array, the glyph coordinates and the AtlasCube are shared by all sessions.
+Each session only builds its own figure, widgets and ColumnDataSource.
+"""
+import logging
+import pandas
+import numpy
+import os
+import pickle
+from collections import OrderedDict
+from bokeh.palettes import viridis
+
+data_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+filename = os.path.join(data_folder, 'atlas.h5')
+with open(os.path.join(data_folder, 'ccplus_codes.p'), 'rb') as foo:
+    cc_plus_codes = pickle.load(foo)
+df = pandas.read_hdf(filename, 'graph_names')
+df = df[~df['gname'].str.contains('^U', regex=True)]
+_color_map = viridis(34)
+logger = logging.getLogger(__name__)
+
+
+def points_on_a_circle(n, radius=1, centre=(0, 0), rotation=0):
+    """ List of uniformly distributed (x, y) coordinates on the circumference of a circle.
+
+    Parameters
+    ----------
+    n : int
+        Number of points to return.
+    radius : float
+    centre : tuple or list or numpy.array
+    rotation : float
+        Angle in degrees by which all points will be rotated.
+        rotation = 0 means that the line from the centre to the first point is parallel to the x-axis.
+        rotation > 0 => anti-clockwise rotation
+
+    Returns
+    -------
+    points : list(2-tuples)
+        (x, y) coordinates of uniformly distributed points on the circumference of the circle
+    """
+    rotation = numpy.deg2rad(rotation)
+    thetas = [numpy.divide(i * numpy.pi * 2, n) + rotation for i in range(n)]
+    points = [(radius * numpy.cos(theta) + centre[0], radius *
+               numpy.sin(theta) + centre[1]) for theta in thetas]
+    return points
+
+
+def graph_list_to_array(graph_list, nrows=None, ncols=None):
+    ngraphs = len(graph_list)
+    if (nrows is None) and (ncols is None):
+        nrows = int(numpy.floor(numpy.sqrt(len(graph_list))))
+        ncols = int(numpy.ceil(len(graph_list) / float(nrows)))
+    elif nrows is None:
+        if ngraphs % ncols == 0:
+            nrows = ngraphs / ncols
+        else:
+            nrows = int(numpy.floor(ngraphs / ncols)) + 1
+    elif ncols is None:
+        if ngraphs % nrows == 0:
+            ncols = ngraphs / nrows
+        else:
+            ncols = int(numpy.floor(ngraphs / nrows)) + 1
+    size_diff = nrows * ncols - len(graph_list)
+    if size_diff < 0:
+        # defaults to square array
+        nrows = int(numpy.floor(numpy.sqrt(len(graph_list))))
+        ncols = int(numpy.ceil(len(graph_list) / float(nrows)))
+    # Fill in square array with None
+    graph_array = graph_list + [None] * size_diff
+    graph_array = numpy.reshape(graph_array, (ncols, nrows))
+    return graph_array
+
+
+graph_list_pickle = os.path.join(data_folder, 'graph_list.p')
+with open(graph_list_pickle, 'rb') as foo:
+    graph_list = pickle.load(foo)
+graph_array = graph_list_to_array(graph_list=graph_list)
+
+
+def graph_glyph_arrays(graph_array, radius=0.4):
+    """ Positions of the graphs in graph_array and the coordinates of their nodes and edges, as whole arrays.
+
+    Parameters
+    ----------
+    graph_array : numpy.array
+        Array of networkx.Graph objects, or None for empty cells, from graph_list_to_array.
+    radius : float
+        Radius of the circle on which the nodes of each graph are placed.
+
+    Returns
+    -------
+    graphs : list(networkx.Graph)
+        The graphs in graph_array, in numpy.ndenumerate order.
+    positions : numpy.array
+        (x, y) of each graph in graph_array, shape (ngraphs, 2).
+    node_xys : numpy.array
+        (x, y) of every node, shape (nnodes, 2).
+    edge_xys : numpy.array
+        (x, y) of both ends of every edge, shape (nedges, 2, 2).
+    """
+    flat = graph_array.ravel()
+    occupied = numpy.flatnonzero([bool(g) for g in flat])
+    graphs = [flat[i] for i in occupied]
+    positions = numpy.column_stack(numpy.unravel_index(occupied, graph_array.shape))
+    sizes = numpy.array([g.number_of_nodes() for g in graphs], dtype=int)
+    # templates[n, :n] are the points of an n-node circle centred on the origin.
+    templates = numpy.zeros((sizes.max() + 1, sizes.max(), 2))
+    for n in range(1, sizes.max() + 1):
+        templates[n, :n] = points_on_a_circle(n=n, radius=radius)
+    offsets = numpy.concatenate([[0], numpy.cumsum(sizes)])
+    node_graph = numpy.repeat(numpy.arange(len(graphs)), sizes)
+    node_xys = templates[sizes[node_graph], numpy.arange(offsets[-1]) - offsets[node_graph]] + positions[node_graph]
+    edge_lists = [numpy.array(g.edges(), dtype=int).reshape(-1, 2) for g in graphs]
+    edge_graph = numpy.repeat(numpy.arange(len(graphs)), [len(x) for x in edge_lists])
+    edges = numpy.concatenate(edge_lists)
+    # Nodes are expected to be numbered 0 to n - 1; edges to any other node are left out.
+    valid = numpy.all(edges < sizes[edge_graph][:, numpy.newaxis], axis=1)
+    for k in numpy.unique(edge_graph[~valid]):
+        logger.warning('Graph %s has edges to nodes outside 0 to n - 1; they are not drawn.', graphs[k].name)
+    edge_xys = node_xys[edges[valid] + offsets[edge_graph[valid]][:, numpy.newaxis]]
+    return graphs, positions, node_xys, edge_xys
+
+
+graphs, graph_positions, node_xys, edge_xys = graph_glyph_arrays(graph_array=graph_array)
+
+
+# Upper bounds of the colour bins for counts above 20. Counts up to 20 each have their own colour.
+_count_bins = numpy.array([20, 30, 40, 50, 60, 70, 80, 90, 100, 150, 200, 300, 500])
+
+
+def get_box_colors(counts):
+    """ Colour of the rectangle of each graph from its count: white for 0, darker for higher counts.
+
+    Parameters
+    ----------
+    counts : numpy.array
+
+    Returns
+    -------
+    colors : numpy.array
+        Hex colour string for each count.
+    """
+    counts = numpy.asarray(counts)
+    bins = numpy.digitize(counts, _count_bins, right=True)
+    c = numpy.where(bins == 0, counts, 20 + bins)
+    colors = numpy.array(_color_map)[len(_color_map) - numpy.clip(c, 1, len(_color_map) - 1)]
+    return numpy.where(counts > 0, colors, '#ffffff')
+
+
+class AtlasCube:
+    """ Graph counts and PDB codes for every (scut, kcut, code set) combination, precomputed for update_data.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        graph_names table, with columns scut, kcut, pdb and gname.
+    graph_names : list(str)
+        Names of the graphs drawn in the atlas, in the order of their rectangles.
+    code_sets : OrderedDict
+        Name of each option of code_select -> collection of PDB codes to keep, or None to keep all codes.
+
+    Notes
+    -----
+    counts[i, j, k, n] is the number of rows of df with the i-th scut, the j-th kcut and a PDB code in the k-th code
+    set whose gname is graph_names[n]. totals[i, j, k] counts those rows for all graphs, including graphs that are
+    not drawn. The ColumnDataSource columns that depend only on these numbers are built once per combination, so a
+    change of the sliders is a dictionary lookup.
+    """
+    def __init__(self, df, graph_names, code_sets):
+        self.scuts = sorted(float(x) for x in df['scut'].unique())
+        self.kcuts = sorted(int(x) for x in df['kcut'].unique())
+        self.code_sets = list(code_sets.keys())
+        self.graph_names = graph_names
+        shape = (len(self.scuts), len(self.kcuts), len(self.code_sets), len(graph_names))
+        self.counts = numpy.zeros(shape, dtype=int)
+        self.totals = numpy.zeros(shape[:3], dtype=int)
+        self.pdbs = {}
+        graph_index = {name: n for n, name in enumerate(graph_names)}
+        for k, codes in enumerate(code_sets.values()):
+            code_df = df if codes is None else df[df['pdb'].isin(codes)]
+            for (s, kc), total in code_df.groupby(['scut', 'kcut']).size().iteritems():
+                self.totals[self._position(s, kc) + (k,)] = total
+            code_df = code_df[code_df['gname'].isin(list(graph_index))]
+            for (s, kc, gname), pdbs in code_df.groupby(['scut', 'kcut', 'gname'])['pdb']:
+                i, j = self._position(s, kc)
+                n = graph_index[gname]
+                self.counts[i, j, k, n] = len(pdbs)
+                self.pdbs[(i, j, k, n)] = sorted(set(pdbs))
+        self.columns = {}
+        for i, j, k in numpy.ndindex(*shape[:3]):
+            self.columns[(self.scuts[i], self.kcuts[j], self.code_sets[k])] = self._build_columns(i, j, k)
+
+    def __repr__(self):
+        return '<AtlasCube(shape={})>'.format(self.counts.shape)
+
+    def _position(self, s, k):
+        return self.scuts.index(float(s)), self.kcuts.index(int(k))
+
+    def _build_columns(self, i, j, k):
+        counts = self.counts[i, j, k]
+        total = self.totals[i, j, k]
+        rel_freqs = counts / total if total else numpy.zeros(len(counts))
+        return dict(
+            counts=counts,
+            rel_freqs=rel_freqs.tolist(),
+            percents=['{0:.2f}'.format(x * 100) for x in rel_freqs],
+            r_colors=get_box_colors(counts).tolist(),
+            pdbs=[self.pdbs.get((i, j, k, n), []) for n in range(len(counts))]
+        )
+
+    def get_columns(self, scut, kcut, code_set):
+        """ counts (numpy.array), rel_freqs, percents, r_colors and pdbs for one combination of the widgets """
+        key = (float(scut), int(kcut), code_set)
+        if key not in self.columns:
+            self.columns[key] = dict(
+                counts=numpy.zeros(len(self.graph_names), dtype=int),
+                rel_freqs=[0] * len(self.graph_names),
+                percents=['0.00'] * len(self.graph_names),
+                r_colors=['#ffffff'] * len(self.graph_names),
+                pdbs=[[] for _ in self.graph_names]
+            )
+        return self.columns[key]
+
+
+# Names and positions of the graphs in graph_array, in the order in which their rectangles are drawn.
+cell_names = [g.name for g in graphs]
+cell_xs = graph_positions[:, 0].tolist()
+cell_ys = graph_positions[:, 1].tolist()
+cube = AtlasCube(df=df, graph_names=cell_names, code_sets=OrderedDict([("CC+", cc_plus_codes), ("All", None)]))
+
+# Plain-list copies of the glyph coordinates, as passed to Bokeh.
+node_xs = node_xys[:, 0].tolist()
+node_ys = node_xys[:, 1].tolist()
+edge_xs = edge_xys[:, :, 0].tolist()
+edge_ys = edge_xys[:, :, 1].tolist()
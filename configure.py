@@ -44,6 +44,10 @@ def install_for_circleci(settings_path):
             "production": "/home/ubuntu/isocket/web/isocket/data/unknown_graphs.p",
             "testing": "/home/ubuntu/isocket/web/unit_tests/unknown_graphs_tests.p"
         },
+        "atlas_artifact": {
+            "production": "/home/ubuntu/isocket/web/isocket/data/atlas_graphs.bin",
+            "testing": "/home/ubuntu/isocket/web/unit_tests/atlas_graphs_tests.bin"
+        },
         "structural_database": {"path": "."}
         }
     with open(str(settings_path), 'w') as outf:
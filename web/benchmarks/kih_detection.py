@@ -0,0 +1,110 @@
+""" Time taken to find the KIHs of synthetic assemblies of increasing size, with and without the KD-tree search.
+
+Usage
+-----
+    python benchmarks/kih_detection.py
+    python benchmarks/kih_detection.py --sizes 64,256,1024,4096,16384 --max-pairwise 1024
+    python benchmarks/kih_detection.py --long-every 8 --long-length 400
+
+Each assembly is a layer of parallel ideal helices on a hexagonal lattice, stacked in several tiers along the helix
+axis, so that all of its helices form a single cluster (as in fibres and capsids) and the pairwise comparison made by
+KnobGroup looks at every pair of helices. The KIHs are found from side-chain centres and helix end points directly
+(isocket.kih.helix_kihs), so neither parsing nor DSSP is timed. Where both are run, the KD-tree search is checked to
+give exactly the KIHs of the pairwise comparison.
+
+Each size is run with helices of one length, and with mixed lengths: every long_every-th helix of the top tier is
+long_length residues long, reaching far above the assembly. The KD-tree search of helix clusters must not widen its
+search for every helix to the length of the longest one. Run from the web folder.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from isocket.kih import helix_kihs
+
+_rise = 1.51
+_turn = numpy.radians(100.0)
+
+
+def ideal_helix(n_residues, axis_origin, phase, ca_radius=2.3, centre_radius=4.0):
+    """ CA positions and side-chain centres of an ideal alpha helix along the z axis """
+    angles = phase + _turn * numpy.arange(n_residues)
+    z = axis_origin[2] + _rise * numpy.arange(n_residues)
+
+    def ring(radius):
+        return numpy.stack([axis_origin[0] + radius * numpy.cos(angles), axis_origin[1] + radius * numpy.sin(angles),
+                            z], axis=1)
+    return ring(ca_radius), ring(centre_radius)
+
+
+def synthetic_assembly(n_helices, helix_length=28, spacing=9.5, tiers=4, noise=0.3, long_every=0, long_length=280,
+                       seed=0):
+    """ Side-chain centres and end CA positions of n_helices helices (see module docstring).
+    If long_every, every long_every-th helix of the top tier has long_length residues.
+
+    Returns
+    -------
+    centres: list(numpy.ndarray)
+    ends: numpy.ndarray
+    """
+    rng = numpy.random.RandomState(seed)
+    per_tier = int(numpy.ceil(n_helices / tiers))
+    side = int(numpy.ceil(numpy.sqrt(per_tier)))
+    centres, ends = [], []
+    for h in range(n_helices):
+        tier, k = divmod(h, per_tier)
+        row, column = divmod(k, side)
+        origin = numpy.array([spacing * (column + 0.5 * (row % 2)), spacing * row * numpy.sqrt(3) / 2,
+                              tier * (helix_length * _rise + 6.0)])
+        long_helix = long_every and tier == tiers - 1 and k % long_every == 0
+        ca, sc = ideal_helix(long_length if long_helix else helix_length, origin, phase=rng.uniform(0, 2 * numpy.pi))
+        sc = sc + rng.normal(scale=noise, size=sc.shape)
+        centres.append(sc)
+        ends.append([ca[0], ca[-1]])
+    return centres, numpy.array(ends)
+
+
+def time_kihs(centres, ends, cutoff, spatial_index, repeats):
+    """ Best wall time in s of finding the KIHs, and the KIHs """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        kihs = helix_kihs(centres, ends=ends, cutoff=cutoff, spatial_index=spatial_index).kihs()
+        times.append(time.perf_counter() - start)
+    return min(times), kihs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='16,64,256,1024,4096', help='comma separated numbers of helices')
+    parser.add_argument('--max-pairwise', type=int, default=1024,
+                        help='largest assembly the pairwise comparison is run on')
+    parser.add_argument('--cutoff', type=float, default=9.0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--long-every', type=int, default=16, help='spacing of the long helices of mixed assemblies')
+    parser.add_argument('--long-length', type=int, default=280, help='residues of the long helices')
+    args = parser.parse_args()
+    print('{0:>8} {1:>8} {2:>9} {3:>9} {4:>12} {5:>12} {6:>8}'.format('helices', 'lengths', 'residues', 'kihs',
+                                                                     'pairwise s', 'kd-tree s', 'same'))
+    cases = [(int(x), lengths) for x in args.sizes.split(',') for lengths in ['uniform', 'mixed']]
+    for n, lengths in cases:
+        long_every = args.long_every if lengths == 'mixed' else 0
+        centres, ends = synthetic_assembly(n, long_every=long_every, long_length=args.long_length)
+        kd_time, kihs = time_kihs(centres, ends, cutoff=args.cutoff, spatial_index=True, repeats=args.repeats)
+        if n <= args.max_pairwise:
+            pairwise_time, pairwise = time_kihs(centres, ends, cutoff=args.cutoff, spatial_index=False,
+                                                repeats=args.repeats)
+            pairwise_time, same = '{:.3f}'.format(pairwise_time), str(kihs == pairwise)
+        else:
+            pairwise_time, same = '-', '-'
+        print('{0:>8} {1:>8} {2:>9} {3:>9} {4:>12} {5:>12.3f} {6:>8}'.format(
+            n, lengths, sum(len(x) for x in centres), len(kihs), pairwise_time, kd_time, same))
+    return
+
+
+if __name__ == '__main__':
+    main()
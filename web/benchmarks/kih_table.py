@@ -0,0 +1,156 @@
+""" Memory of the KIHs of a structure, and time taken by get_knob_graphs to find their components at every cutoff,
+as a KnobGroup MultiDiGraph filtered at each cutoff and as a KIHEdgeTable swept by CutoffSweep.
+
+Usage
+-----
+    python benchmarks/kih_table.py
+    python benchmarks/kih_table.py --sizes 16,256,1024 --files unit_tests/testing_files/1ek9.pdb
+
+Each synthetic structure has the given number of helices, each with KIHs into a few neighbouring helices, with random
+max_kh_distances between 6 and 9 Angstroms. The MultiDiGraph has one edge per KIH, carrying an object with a
+max_kh_distance attribute (as KnobGroup.graph carries a KnobIntoHole). For each of the cutoffs of get_knob_graphs
+(scut 7.0 to 9.0 by 0.5, kcut 0 to 3) it is filtered as by KnobGroup.filter_graph, converted by the list.index lookup
+graph_to_plain_graph used before KIHEdgeTable, and split into connected components. CutoffSweep gives the same
+components from the table, which is checked. Memory is the size of the allocations made building each representation
+from the same list of KIHs, measured with tracemalloc.
+
+With --files, StructureHandler.get_knob_graphs (without naming the graphs) is also timed on each structure file, read
+with coordinates=True, along with the time taken by its CutoffSweep. This needs isambard, for DSSP.
+Run from the web folder.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import networkx
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from isocket.cutoff_sweep import CutoffSweep
+from isocket.kih_table import KIHEdgeTable
+
+_scuts = [7.0, 7.5, 8.0, 8.5, 9.0]
+_kcuts = list(range(4))
+
+
+class KIH:
+    """ Stand-in for the KnobIntoHole carried by each edge of KnobGroup.graph """
+    def __init__(self, max_kh_distance):
+        self.max_kh_distance = max_kh_distance
+
+
+def synthetic_kihs(n_helices, neighbours=4, kihs_per_pair=6, seed=0):
+    """ (knob helix, hole helix, max_kh_distance) of the KIHs of each helix into its neighbours """
+    rng = numpy.random.RandomState(seed)
+    kihs = []
+    for h in range(n_helices):
+        for k in range(1, neighbours + 1):
+            if h + k < n_helices:
+                for e1, e2 in [(h, h + k), (h + k, h)]:
+                    kihs.extend((e1, e2, float(d)) for d in rng.uniform(6.0, 9.0, size=rng.randint(1, kihs_per_pair)))
+    return kihs
+
+
+def build_graph(kihs):
+    g = networkx.MultiDiGraph()
+    g.add_edges_from((e1, e2, {'kih': KIH(d)}) for e1, e2, d in kihs)
+    return g
+
+
+def filter_graph(g, cutoff, min_kihs):
+    """ As KnobGroup.filter_graph """
+    edge_list = [e for e in g.edges(keys=True, data=True) if e[3]['kih'].max_kh_distance <= cutoff]
+    if min_kihs > 0:
+        c = Counter([(e[0], e[1]) for e in edge_list])
+        node_list = set(list(itertools.chain.from_iterable([k for k, v in c.items() if v > min_kihs])))
+        edge_list = [e for e in edge_list if (e[0] in node_list) and (e[1] in node_list)]
+    return networkx.MultiDiGraph(edge_list)
+
+
+def index_plain_graph(g):
+    """ graph_to_plain_graph as it was before KIHEdgeTable, looking up each edge end with list.index """
+    h = networkx.Graph()
+    h.add_nodes_from(range(len(g.nodes())))
+    edges = [(g.nodes().index(e1), g.nodes().index(e2)) for e1, e2 in g.edges()]
+    h.add_edges_from(edges)
+    h.graph['name'] = None
+    return h
+
+
+def graph_plain_graphs(g):
+    """ Components at each cutoff of get_knob_graphs, filtering the MultiDiGraph g once per cutoff """
+    ccs = {}
+    for scut, kcut in itertools.product(_scuts, _kcuts):
+        h = index_plain_graph(filter_graph(g, cutoff=scut, min_kihs=kcut))
+        ccs[(scut, kcut)] = sorted(networkx.connected_component_subgraphs(h),
+                                   key=lambda x: (-x.number_of_nodes(), min(x.nodes())))
+    return ccs
+
+
+def components(plain_graphs):
+    return {k: [(sorted(x.nodes()), sorted(tuple(sorted(e)) for e in x.edges())) for x in v]
+            for k, v in plain_graphs.items()}
+
+
+def allocated(build, kihs):
+    """ Bytes allocated (and still held) by build(kihs), and its result """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(kihs)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, result
+
+
+def best_time(f, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def time_files(filenames, repeats):
+    from isocket.structure_handler import StructureHandler
+    print('{0:>12} {1:>8} {2:>17} {3:>11}'.format('file', 'kihs', 'get_knob_graphs s', 'sweep s'))
+    for filename in filenames:
+        sh = StructureHandler.from_file(filename=filename, coordinates=True)
+        total_time, _ = best_time(lambda: sh.get_knob_graphs(name_graphs=False), repeats)
+        table = sh.get_kih_table(cutoff=max(_scuts))
+        sweep_time, _ = best_time(lambda: CutoffSweep(table=table).plain_graphs(scuts=_scuts, kcuts=_kcuts), repeats)
+        print('{0:>12} {1:>8} {2:>17.4f} {3:>11.4f}'.format(os.path.basename(filename), len(table), total_time,
+                                                            sweep_time))
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='16,64,256,1024', help='comma separated numbers of helices')
+    parser.add_argument('--files', nargs='*', default=[], help='structure files to run get_knob_graphs on')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    print('{0:>8} {1:>8} {2:>11} {3:>11} {4:>11} {5:>11} {6:>6}'.format('helices', 'kihs', 'graph KiB', 'table KiB',
+                                                                      'graph s', 'table s', 'same'))
+    for n in [int(x) for x in args.sizes.split(',')]:
+        # in the order of KnobGroup.graph.edges(), as find_kihs gives them, so that both number the nodes the same.
+        kihs = KIHEdgeTable.from_kihs(synthetic_kihs(n)).graph_edge_order().kihs()
+        graph_bytes, g = allocated(build_graph, kihs)
+        table_bytes, table = allocated(KIHEdgeTable.from_kihs, kihs)
+        graph_time, expected = best_time(lambda: graph_plain_graphs(g), args.repeats)
+        table_time, observed = best_time(
+            lambda: CutoffSweep(table=table).plain_graphs(scuts=_scuts, kcuts=_kcuts), args.repeats)
+        same = components(observed) == components(expected)
+        print('{0:>8} {1:>8} {2:>11.1f} {3:>11.1f} {4:>11.4f} {5:>11.4f} {6:>6}'.format(
+            n, len(kihs), graph_bytes / 1024, table_bytes / 1024, graph_time, table_time, str(same)))
+    if args.files:
+        time_files(args.files, repeats=args.repeats)
+    return
+
+
+if __name__ == '__main__':
+    main()
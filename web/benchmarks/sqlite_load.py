@@ -0,0 +1,130 @@
+""" Concurrent reader/writer load test of an SQLite graph database, with and without the SQLite profile.
+
+Usage
+-----
+    python benchmarks/sqlite_load.py --readers 4 --seconds 20
+
+For each setting, a new database is filled with synthetic graphs (see graph_queries.fill_database). Then one writer
+process adds structures in batches, as update_db does, while reader processes repeatedly run the per-code graph query
+and graph frequency queries made by the web app. Reported are the reads and writes completed per second, and the number that failed with
+"database is locked". Run from the web folder.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+import sqlalchemy
+from sqlalchemy import exc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.graph_queries import fill_database
+from config import sqlite_profile
+from isocket.database_management.engine_profiles import configure_engine
+from isocket.database_management.models import GraphDB, PdbDB, PdbeDB, CutoffDB, AtlasDB
+from isocket.database_management.queries import graph_counts
+
+
+def make_engine(url, pragmas):
+    engine = sqlalchemy.create_engine(url, poolclass=sqlalchemy.pool.NullPool)
+    return configure_engine(engine, dict(SQLITE_PRAGMAS=pragmas))
+
+
+def reader(url, pragmas, n_codes, stop_time, results):
+    engine = make_engine(url, pragmas)
+    graph, pdbe, pdb, atlas, cutoff = (GraphDB.__table__, PdbeDB.__table__, PdbDB.__table__, AtlasDB.__table__,
+                                       CutoffDB.__table__)
+    q = sqlalchemy.select([pdbe.c.mmol, cutoff.c.scut, cutoff.c.kcut, graph.c.connected_component,
+                           atlas.c.name]).select_from(
+        pdb.join(pdbe, pdbe.c.pdb_id == pdb.c.id).join(graph, graph.c.pdbe_id == pdbe.c.id).join(
+            cutoff, graph.c.cutoff_id == cutoff.c.id).join(atlas, graph.c.atlas_id == atlas.c.id))
+    rng = numpy.random.RandomState(os.getpid())
+    done, failed = 0, 0
+    while time.time() < stop_time:
+        # one frequency query (a long read of a whole cutoff) for every ten per-code queries.
+        if done % 10:
+            code = '{:04x}'.format(rng.randint(n_codes))
+            read = q.where(pdb.c.pdb == code)
+        else:
+            read = graph_counts(cutoff_id=rng.randint(1, 21), preferred=True)
+        try:
+            with engine.connect() as conn:
+                conn.execute(read).fetchall()
+            done += 1
+        except exc.OperationalError:
+            failed += 1
+    results.put(('read', done, failed))
+
+
+def writer(url, pragmas, stop_time, batch_size, results):
+    """ Add new structures of 60 graphs each (one pdbe, 3 graphs at each of 20 cutoffs), batch_size per transaction """
+    engine = make_engine(url, pragmas)
+    with engine.connect() as conn:
+        next_pdb_id = conn.execute(sqlalchemy.select([sqlalchemy.func.max(PdbDB.id)])).scalar() + 1
+        next_pdbe_id = conn.execute(sqlalchemy.select([sqlalchemy.func.max(PdbeDB.id)])).scalar() + 1
+    done, failed = 0, 0
+    while time.time() < stop_time:
+        # SQLite does not enforce the length of the pdb column, so new codes cannot clash with the synthetic ones.
+        pdb_rows = [dict(id=next_pdb_id + i, pdb='w{}'.format(next_pdb_id + i)) for i in range(batch_size)]
+        pdbe_rows = [dict(id=next_pdbe_id + i, pdb_id=next_pdb_id + i, mmol=1, preferred=True)
+                     for i in range(batch_size)]
+        graph_rows = [dict(pdbe_id=x['id'], cutoff_id=c, atlas_id=1 + cc, connected_component=cc)
+                      for x in pdbe_rows for c in range(1, 21) for cc in range(3)]
+        try:
+            with engine.begin() as conn:
+                conn.execute(PdbDB.__table__.insert(), pdb_rows)
+                conn.execute(PdbeDB.__table__.insert(), pdbe_rows)
+                conn.execute(GraphDB.__table__.insert(), graph_rows)
+            done += 1
+            next_pdb_id += batch_size
+            next_pdbe_id += batch_size
+        except exc.OperationalError:
+            failed += 1
+    results.put(('write', done, failed))
+
+
+def run(label, pragmas, n_graphs, readers, seconds, batch_size):
+    folder = tempfile.mkdtemp()
+    url = 'sqlite:///{}'.format(os.path.join(folder, 'load.db'))
+    engine = make_engine(url, pragmas)
+    fill_database(engine, n_graphs=n_graphs)
+    with engine.connect() as conn:
+        n_codes = conn.execute(sqlalchemy.select([sqlalchemy.func.count(PdbDB.id)])).scalar()
+    results = multiprocessing.Queue()
+    stop_time = time.time() + seconds
+    processes = [multiprocessing.Process(target=reader, args=(url, pragmas, n_codes, stop_time, results))
+                 for _ in range(readers)]
+    processes.append(multiprocessing.Process(target=writer, args=(url, pragmas, stop_time, batch_size, results)))
+    for p in processes:
+        p.start()
+    totals = {'read': [0, 0], 'write': [0, 0]}
+    for _ in processes:
+        kind, done, failed = results.get()
+        totals[kind][0] += done
+        totals[kind][1] += failed
+    for p in processes:
+        p.join()
+    print('{0}: {1:.0f} reads/s ({2} locked), {3:.1f} write batches/s ({4} locked)'.format(
+        label, totals['read'][0] / seconds, totals['read'][1], totals['write'][0] / seconds, totals['write'][1]))
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--graphs', type=int, default=200000, help='approximate number of graph rows to start with')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--batch-size', type=int, default=50, help='structures added per write transaction')
+    args = parser.parse_args()
+    run('default', pragmas={}, n_graphs=args.graphs, readers=args.readers, seconds=args.seconds,
+        batch_size=args.batch_size)
+    run('sqlite_profile', pragmas=sqlite_profile, n_graphs=args.graphs, readers=args.readers, seconds=args.seconds,
+        batch_size=args.batch_size)
+    return
+
+
+if __name__ == '__main__':
+    main()
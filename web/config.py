@@ -1,6 +1,11 @@
 import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# SQLite pragmas for databases that the web app reads while batch updates write to them: with WAL journalling readers
+# are not blocked by the writer, synchronous=NORMAL only syncs at checkpoints, reads are served from a memory map,
+# and connections wait (in ms) for the writer's lock instead of failing with "database is locked".
+sqlite_profile = dict(journal_mode='WAL', synchronous='NORMAL', mmap_size=268435456, busy_timeout=30000)
+
 
 class BaseConfig(object):
     DEBUG = False
@@ -17,6 +22,34 @@ class BaseConfig(object):
     UPLOADED_STRUCTURES_ALLOW = ('pdb', 'mmol', 'cif', 'mmcif')
     ASSETS_DEBUG = DEBUG
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Engine and pool profile (see isocket.database_management.engine_profiles). Pool sizes only apply to server
+    # databases: file SQLite databases use a new connection per session, in-memory ones a single shared connection.
+    SQLALCHEMY_POOL_SIZE = None
+    SQLALCHEMY_MAX_OVERFLOW = None
+    SQLALCHEMY_POOL_TIMEOUT = None
+    SQLALCHEMY_POOL_RECYCLE = None
+    SQLALCHEMY_PRE_PING = False
+    SQLITE_PRAGMAS = {}
+    # Number of uploaded structures whose KIHs are kept in memory, and the cutoff at which they are found.
+    KIH_CACHE_SIZE = 128
+    KIH_CACHE_CUTOFF = 9.0
+    # Background analysis of uploaded structures: number of jobs run at once (by all web processes), seconds before a
+    # job is stopped, seconds before a job that has not started fails and an ended job is forgotten, and where the
+    # queue and the state of each job are kept.
+    STRUCTURE_JOB_WORKERS = 2
+    STRUCTURE_JOB_TIMEOUT = 300
+    STRUCTURE_JOB_EXPIRY = 3600
+    STRUCTURE_JOB_FOLDER = os.path.join(TEMP_FOLDER, 'jobs')
+    # Graph frequency API: page size and code list limits, responses cached per process, and seconds for which
+    # clients may reuse a response before revalidating it with its ETag.
+    API_MAX_PER_PAGE = 500
+    API_MAX_CODES = 2000
+    API_CACHE_SIZE = 1024
+    API_CACHE_MAX_AGE = 60
+    # Progress of database updates run with manage.py update_codes (see database_management.run_journal).
+    UPDATE_JOURNAL = os.path.join(TEMP_FOLDER, 'update_journal.db')
+    # Names of atlas graphs found by database updates, kept between runs (see isocket.name_cache).
+    NAME_CACHE_FILE = os.path.join(TEMP_FOLDER, 'name_cache.p')
 
 
 class DevelopmentConfig(BaseConfig):
@@ -24,6 +57,7 @@ class DevelopmentConfig(BaseConfig):
     TESTING = False
     database_filepath = os.path.join(basedir, 'isocket', 'data', 'atlas.db')
     SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(database_filepath)
+    SQLITE_PRAGMAS = sqlite_profile
 
 
 class TestingConfig(BaseConfig):
@@ -31,11 +65,26 @@ class TestingConfig(BaseConfig):
     TESTING = True
     database_filepath = os.path.join(basedir, 'unit_tests', 'tests.db')
     SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(database_filepath)
+    SQLITE_PRAGMAS = sqlite_profile
+
+
+class ProductionConfig(BaseConfig):
+    # A server database (e.g. MySQL), shared by the web workers and the update jobs.
+    SQLALCHEMY_DATABASE_URI = os.getenv('ISOCKET_DATABASE_URI', BaseConfig.SQLALCHEMY_DATABASE_URI)
+    # SQLite engines (the fallback if ISOCKET_DATABASE_URI is unset) use pools that reject size options.
+    if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        SQLALCHEMY_POOL_SIZE = 10
+        SQLALCHEMY_MAX_OVERFLOW = 20
+        SQLALCHEMY_POOL_TIMEOUT = 30
+        # below MySQL's default wait_timeout of 8 hours, after which the server closes idle connections.
+        SQLALCHEMY_POOL_RECYCLE = 3600
+    SQLALCHEMY_PRE_PING = True
 
 
 config = {
     "development": "config.DevelopmentConfig",
     "testing": "config.TestingConfig",
+    "production": "config.ProductionConfig",
     "default": "config.DevelopmentConfig"
 }
 
@@ -1,7 +1,17 @@
+import hashlib
+import json
+from collections import OrderedDict
+
 from bokeh.embed import autoload_server
-from flask import render_template
+from flask import render_template, request, jsonify, current_app, make_response
 
 from isocket.atlas import atlas_bp
+from isocket.extensions import db
+from isocket.database_management.populate_models import dimension_cache
+from isocket.database_management.queries import data_version, graph_frequencies
+
+# Responses of the graph frequency API, keyed by their ETag. Least recently used are evicted first.
+_api_responses = OrderedDict()
 
 
 @atlas_bp.route('/atlas')
@@ -9,3 +19,61 @@ def atlas():
     script = autoload_server(model=None, url='http://localhost:5006/atlas')
     return render_template('atlas.html', title='AtlasCC', bokeh_script=script)
 
+
+def _api_error(message, status):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+@atlas_bp.route('/api/graphs', defaults={'name': None})
+@atlas_bp.route('/api/graphs/<name>')
+def graph_frequencies_api(name):
+    """ JSON counts of the graphs, and of the distinct PDB codes, with each atlas graph (or only the named one).
+
+    Query arguments: scut (default 7.0), kcut (default 2), preferred ('true' or 'false', default both), codes
+    (comma-separated PDB codes, default all), page (default 1) and per_page (default 50).
+    Responses carry an ETag that changes when the database does, so clients can revalidate with If-None-Match.
+    """
+    scut = request.args.get('scut', 7.0, type=float)
+    kcut = request.args.get('kcut', 2, type=int)
+    preferred = {'true': True, 'false': False}.get(request.args.get('preferred', '').lower())
+    codes = request.args.get('codes')
+    if codes is not None:
+        codes = sorted(set(x.strip().lower() for x in codes.split(',') if x.strip()))
+        if len(codes) > current_app.config['API_MAX_CODES']:
+            return _api_error('At most {} codes can be given.'.format(current_app.config['API_MAX_CODES']), 400)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), current_app.config['API_MAX_PER_PAGE'])
+    parameters = dict(name=name, scut=scut, kcut=kcut, preferred=preferred, codes=codes, page=page,
+                      per_page=per_page)
+    session = db.session
+    etag = hashlib.sha1(json.dumps([data_version(session), parameters], sort_keys=True).encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    elif etag in _api_responses:
+        _api_responses.move_to_end(etag)
+        response = make_response(_api_responses[etag])
+        response.mimetype = 'application/json'
+    else:
+        try:
+            cutoff_id = dimension_cache.cutoff_id(session, scut=scut, kcut=kcut)
+        except KeyError:
+            return _api_error('No cutoff with scut={0} and kcut={1}.'.format(scut, kcut), 404)
+        try:
+            total, frequencies = graph_frequencies(session, cutoff_id=cutoff_id, preferred=preferred, codes=codes,
+                                                   name=name, page=page, per_page=per_page)
+        except ValueError as e:
+            return _api_error(str(e), 400)
+        if name is not None and not total:
+            return _api_error('Graph {} not found at this cutoff.'.format(name), 404)
+        body = json.dumps(dict(parameters, total=total, graphs=frequencies))
+        _api_responses[etag] = body
+        while len(_api_responses) > current_app.config['API_CACHE_SIZE']:
+            _api_responses.popitem(last=False)
+        response = make_response(body)
+        response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['API_CACHE_MAX_AGE']
+    return response
@@ -0,0 +1,220 @@
+""" Precompiled, memory-mapped store of the graphs used to name knob graphs.
+
+The atlas, cyclic, path and unknown graphs are written once (see build_atlas_artifact) into a single binary file
+holding their names, isomorphism invariants and adjacency as CSR arrays.
+AtlasArtifact opens that file with mmap, so processes on the same host share its pages, and networkx graphs are only
+built for the entries that are actually used.
+
+File layout
+-----------
+magic (8 bytes) | version (uint32) | header length (uint32) | JSON header | padding | arrays
+The JSON header holds the names, the build parameters and the dtype/shape/offset of each array.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import networkx
+import numpy
+
+from isocket.graph_theory import AtlasHandler, AtlasIndex, graph_invariants
+from isocket_settings import global_settings
+
+MAGIC = b'ISKATLAS'
+VERSION = 1
+GROUPS = ('atlas', 'cyclic', 'path', 'unknown')
+_preamble = struct.Struct('<8sII')
+_alignment = 8
+
+
+def file_signature(filename):
+    """ [size, mtime] of filename, or None if it does not exist. Used to tell whether the unknown graphs are stale. """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def build_atlas_artifact(filename, mode='production', max_cyclics=100, max_paths=100):
+    """ Compile the atlas, cyclic, path and unknown graphs into an artifact at filename.
+
+    Parameters
+    ----------
+    filename: str
+        Path of the artifact. An existing artifact is replaced atomically.
+    mode: str
+        Allowed values: 'production' or 'testing'. Selects the unknown graphs pickle.
+    max_cyclics: int
+    max_paths: int
+        Largest cyclic and path graphs to include.
+
+    Returns
+    -------
+    None
+    """
+    atlas_handler = AtlasHandler(mode=mode)
+    grouped = [('atlas', atlas_handler.atlas_graphs),
+               ('cyclic', atlas_handler.cyclic_graphs(max_nodes=max_cyclics)),
+               ('path', atlas_handler.path_graphs(max_nodes=max_paths)),
+               ('unknown', atlas_handler.unknown_graphs)]
+    names, groups, nodes, edges, wl_hashes = [], [], [], [], []
+    indptr, indices = [0], []
+    for group, graph_list in grouped:
+        for g in graph_list:
+            node_index = {n: i for i, n in enumerate(g.nodes())}
+            for n in g.nodes():
+                neighbours = sorted(node_index[m] for m in g.adj[n])
+                indices += neighbours
+                indptr.append(indptr[-1] + len(neighbours))
+            n_nodes, n_edges, _, wl_hash = graph_invariants(g)
+            names.append(g.name)
+            groups.append(GROUPS.index(group))
+            nodes.append(n_nodes)
+            edges.append(n_edges)
+            wl_hashes.append(wl_hash)
+    node_offsets = numpy.concatenate([[0], numpy.cumsum(nodes)])
+    arrays = [('group', numpy.array(groups, dtype='<u1')),
+              ('nodes', numpy.array(nodes, dtype='<i4')),
+              ('edges', numpy.array(edges, dtype='<i4')),
+              ('wl_hash', numpy.array(wl_hashes, dtype='S32')),
+              ('node_offsets', numpy.array(node_offsets, dtype='<i8')),
+              ('indptr', numpy.array(indptr, dtype='<i8')),
+              ('indices', numpy.array(indices, dtype='<i4'))]
+    header = dict(names=names, max_cyclics=max_cyclics, max_paths=max_paths,
+                  unknown_graphs=file_signature(global_settings["unknown_graphs"][mode]), arrays={})
+    offset = 0
+    for key, array in arrays:
+        header['arrays'][key] = dict(dtype=array.dtype.str, shape=array.shape, offset=offset)
+        offset += _padded(array.nbytes)
+    header_bytes = json.dumps(header).encode()
+    data_start = _padded(_preamble.size + len(header_bytes))
+    directory = os.path.dirname(os.path.abspath(filename))
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as foo:
+        foo.write(_preamble.pack(MAGIC, VERSION, len(header_bytes)))
+        foo.write(header_bytes)
+        foo.write(b'\0' * (data_start - _preamble.size - len(header_bytes)))
+        for _, array in arrays:
+            foo.write(array.tobytes())
+            foo.write(b'\0' * (_padded(array.nbytes) - array.nbytes))
+    os.replace(foo.name, filename)
+    return
+
+
+def _padded(n):
+    return -(-n // _alignment) * _alignment
+
+
+class AtlasArtifact:
+    """ Read-only, memory-mapped view of an atlas artifact.
+
+    Parameters
+    ----------
+    filename: str
+        Path to an artifact written by build_atlas_artifact.
+
+    Raises
+    ------
+    ValueError
+        If the file is not an atlas artifact, or was written by a different version of this module.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as foo:
+            self._mmap = mmap.mmap(foo.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _preamble.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not an atlas artifact.'.format(filename))
+        if version != VERSION:
+            raise ValueError('Atlas artifact {0} has version {1}, expected {2}.'.format(filename, version, VERSION))
+        self.header = json.loads(self._mmap[_preamble.size:_preamble.size + header_length].decode())
+        data_start = _padded(_preamble.size + header_length)
+        self.arrays = {}
+        for key, spec in self.header['arrays'].items():
+            dtype = numpy.dtype(spec['dtype'])
+            count = int(numpy.prod(spec['shape']))
+            self.arrays[key] = numpy.frombuffer(self._mmap, dtype=dtype, count=count,
+                                                offset=data_start + spec['offset']).reshape(spec['shape'])
+        self.names = self.header['names']
+        self._graphs = {}
+
+    def __repr__(self):
+        return '<AtlasArtifact(filename={0}, graphs={1})>'.format(self.filename, len(self))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        """ networkx.Graph for entry i, built on first access. """
+        if i not in self._graphs:
+            node_offset = int(self.arrays['node_offsets'][i])
+            n_nodes = int(self.arrays['nodes'][i])
+            indptr = self.arrays['indptr']
+            indices = self.arrays['indices']
+            g = networkx.Graph()
+            g.add_nodes_from(range(n_nodes))
+            for u in range(n_nodes):
+                start, stop = indptr[node_offset + u], indptr[node_offset + u + 1]
+                g.add_edges_from((u, int(v)) for v in indices[start:stop] if u < v)
+            g.name = self.names[i]
+            self._graphs[i] = g
+        return self._graphs[i]
+
+    def invariants(self, i):
+        """ graph_invariants of entry i, read from the arrays without building the graph. """
+        node_offset = int(self.arrays['node_offsets'][i])
+        n_nodes = int(self.arrays['nodes'][i])
+        degrees = numpy.diff(self.arrays['indptr'][node_offset:node_offset + n_nodes + 1])
+        degrees = tuple(int(x) for x in sorted(degrees, reverse=True))
+        return n_nodes, int(self.arrays['edges'][i]), degrees, self.arrays['wl_hash'][i].decode()
+
+    def select(self, atlas=True, cyclics=True, paths=False, unknowns=False, max_cyclics=100, max_paths=100):
+        """ Indices of the entries in the same order as AtlasHandler.get_graph_list(**same arguments).
+
+        Raises
+        ------
+        ValueError
+            If more cyclic or path graphs are requested than the artifact was built with.
+        """
+        if (cyclics and max_cyclics > self.header['max_cyclics']) or (paths and max_paths > self.header['max_paths']):
+            raise ValueError('Atlas artifact {} does not contain enough cyclic or path graphs.'.format(self.filename))
+        group = self.arrays['group']
+        nodes = self.arrays['nodes']
+        masks = []
+        if atlas:
+            masks.append(group == GROUPS.index('atlas'))
+        if cyclics:
+            masks.append((group == GROUPS.index('cyclic')) & (nodes <= max_cyclics))
+        if paths:
+            masks.append((group == GROUPS.index('path')) & (nodes <= max_paths))
+        if unknowns:
+            masks.append(group == GROUPS.index('unknown'))
+        # groups are stored contiguously in get_graph_list order, so concatenating them preserves that order.
+        return [int(i) for mask in masks for i in numpy.flatnonzero(mask)]
+
+    def unknowns_current(self, mode):
+        """ True if the unknown graphs pickle has not changed since the artifact was built. """
+        return file_signature(global_settings["unknown_graphs"][mode]) == self.header['unknown_graphs']
+
+    def get_graph_index(self, **kwargs):
+        """ AtlasIndex over the entries selected by kwargs (see select). Graphs are only built when probed. """
+        selection = self.select(**kwargs)
+        return AtlasIndex(ArtifactGraphList(self, selection), invariants=[self.invariants(i) for i in selection])
+
+
+class ArtifactGraphList:
+    """ Sequence of the graphs at the given indices of an AtlasArtifact, built lazily. """
+    def __init__(self, artifact, indices):
+        self.artifact = artifact
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.artifact[self.indices[i]]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
@@ -0,0 +1,276 @@
+""" Coordinate-only structures: the atoms of a PDB or mmCIF file read straight into NumPy arrays.
+
+Finding KIHs only needs the helices of a structure, and the positions of their side chains and CA atoms. Building an
+AMPAL assembly (convert_pdb_to_ampal, convert_cif_to_ampal) creates Python objects for every atom, residue and chain,
+most of which are never used. A CoordinateStructure instead keeps the atoms in a structured array (see ATOM_DTYPE),
+with residues as runs of consecutive atoms, and is used by isocket.kih in place of KnobGroup.
+
+What is read, to match the AMPAL assembly that KnobGroup works on:
+    only ATOM records (HETATM records are ligands in AMPAL, so never part of a helix);
+    only the first model, as StructureHandler.get_knob_group uses the first state of multi-model structures;
+    for atoms with alternate locations, only the first location given for their residue.
+"""
+import gzip
+import shlex
+
+import numpy
+from isambard.external_programs.dssp import run_dssp, extract_all_ss_dssp
+
+ATOM_DTYPE = numpy.dtype([('chain', 'U4'), ('resnum', 'i4'), ('icode', 'U1'), ('resname', 'U3'), ('name', 'U4'),
+                          ('altloc', 'U1'), ('element', 'U2'), ('xyz', 'f8', (3,))])
+BACKBONE = ['N', 'CA', 'C', 'O']
+
+# (field, first column, last column + 1) of the fixed-width PDB ATOM record.
+_pdb_columns = [('name', 12, 16), ('altloc', 16, 17), ('resname', 17, 20), ('chain', 21, 22), ('resnum', 22, 26),
+                ('icode', 26, 27), ('x', 30, 38), ('y', 38, 46), ('z', 46, 54), ('element', 76, 78)]
+# ATOM_DTYPE field and the mmCIF atom_site items it is read from, in order of preference.
+_cif_items = [('name', ['auth_atom_id', 'label_atom_id']), ('altloc', ['label_alt_id']),
+              ('resname', ['auth_comp_id', 'label_comp_id']), ('chain', ['auth_asym_id', 'label_asym_id']),
+              ('resnum', ['auth_seq_id', 'label_seq_id']), ('icode', ['pdbx_PDB_ins_code']), ('x', ['Cartn_x']),
+              ('y', ['Cartn_y']), ('z', ['Cartn_z']), ('element', ['type_symbol'])]
+
+
+def _atom_array(fields):
+    """ ATOM_DTYPE array from a dict of equal length arrays of each field (x, y and z separately) """
+    atoms = numpy.empty(len(fields['x']), dtype=ATOM_DTYPE)
+    for name in ATOM_DTYPE.names:
+        if name != 'xyz':
+            atoms[name] = fields[name]
+    atoms['xyz'] = numpy.stack([fields[x].astype(float) for x in 'xyz'], axis=1)
+    return atoms
+
+
+def parse_pdb_atoms(text):
+    """ ATOM_DTYPE array of the ATOM records of the first model in PDB format text.
+
+    Notes
+    -----
+    The fixed-width records are sliced as a 2D array of characters, so each field is read for all atoms at once.
+    """
+    end = text.find('\nENDMDL')
+    if end != -1:
+        text = text[:end]
+    lines = [x for x in text.splitlines() if x.startswith('ATOM  ')]
+    chars = numpy.array([x.ljust(80)[:80].encode('ascii', 'replace') for x in lines], dtype='S80')
+    chars = chars.view('S1').reshape(len(lines), 80)
+    fields = {}
+    for name, start, stop in _pdb_columns:
+        column = numpy.ascontiguousarray(chars[:, start:stop]).view('S{}'.format(stop - start)).ravel()
+        fields[name] = numpy.char.strip(column.astype('U'))
+    fields['resnum'] = fields['resnum'].astype(int) if len(lines) else numpy.array([], dtype=int)
+    return _first_locations(_atom_array(fields))
+
+
+def cif_atom_site(text):
+    """ {item: list of values} of the atom_site loop of mmCIF text, without the '_atom_site.' prefix. """
+    lines = text.splitlines()
+    items = []
+    i = 0
+    while i < len(lines):
+        if lines[i].startswith('_atom_site.') and (i > 0) and (lines[i - 1].strip() == 'loop_'):
+            while i < len(lines) and lines[i].startswith('_atom_site.'):
+                items.append(lines[i].split()[0][len('_atom_site.'):])
+                i += 1
+            break
+        i += 1
+    tokens = []
+    while i < len(lines) and not lines[i].startswith(('#', 'loop_', '_', 'data_')):
+        line = lines[i]
+        # quoted values (e.g. atom names of nucleotides such as "O5'") are rare, so only then is shlex needed.
+        tokens.extend(shlex.split(line) if ('"' in line or "'" in line) else line.split())
+        i += 1
+    if not items:
+        return {}
+    values = numpy.array(tokens, dtype='U').reshape(-1, len(items))
+    return {item: values[:, j] for j, item in enumerate(items)}
+
+
+def parse_cif_atoms(text):
+    """ ATOM_DTYPE array of the ATOM records of the first model in mmCIF text. """
+    site = cif_atom_site(text)
+    if not site:
+        return numpy.empty(0, dtype=ATOM_DTYPE)
+    keep = site['group_PDB'] == 'ATOM'
+    if 'pdbx_PDB_model_num' in site:
+        models = site['pdbx_PDB_model_num']
+        keep &= models == models[0]
+    fields = {}
+    for name, items in _cif_items:
+        item = next((x for x in items if x in site), None)
+        if item is None:
+            fields[name] = numpy.full(numpy.count_nonzero(keep), '', dtype='U1')
+            continue
+        column = site[item][keep]
+        # '.' and '?' are mmCIF for inapplicable and unknown values.
+        fields[name] = numpy.where((column == '.') | (column == '?'), '', column)
+    fields['resnum'] = fields['resnum'].astype(int)
+    return _first_locations(_atom_array(fields))
+
+
+def _residue_index(atoms):
+    """ Index of the residue of each atom, where a residue is a run of atoms with the same chain, resnum and
+    insertion code. """
+    changed = numpy.zeros(len(atoms), dtype=bool)
+    for name in ['chain', 'resnum', 'icode']:
+        changed[1:] |= atoms[name][1:] != atoms[name][:-1]
+    return numpy.cumsum(changed)
+
+
+def _first_locations(atoms):
+    """ atoms without those at alternate locations other than the first given for their residue """
+    alternate = atoms['altloc'] != ''
+    if not alternate.any():
+        return atoms
+    first = {}
+    keep = ~alternate
+    for i, r, altloc in zip(numpy.flatnonzero(alternate), _residue_index(atoms)[alternate],
+                            atoms['altloc'][alternate]):
+        keep[i] = first.setdefault(r, altloc) == altloc
+    return atoms[keep]
+
+
+class CoordinateStructure:
+    """ Atoms of a structure as NumPy arrays, grouped into residues and chains.
+
+    Parameters
+    ----------
+    atoms: numpy.ndarray
+        ATOM_DTYPE array, in file order.
+    id: str
+        Identifier of the structure, e.g. its PDB code.
+
+    Notes
+    -----
+    Residue properties are arrays with one row per residue, in file order. The secondary structure of each residue
+    is only known once tag_secondary_structure has been run (which helices does).
+    """
+    def __init__(self, atoms, id=''):
+        self.atoms = atoms
+        self.id = id
+        self.residue_index = _residue_index(atoms)
+        self.residue_starts = numpy.flatnonzero(numpy.diff(numpy.append(-1, self.residue_index)))
+        self.secondary_structure = None
+
+    def __repr__(self):
+        return '<CoordinateStructure(id={0}, chains={1}, residues={2}, atoms={3})>'.format(
+            self.id, len(self.chain_starts), len(self), len(self.atoms))
+
+    def __len__(self):
+        return len(self.residue_starts)
+
+    @classmethod
+    def from_text(cls, text, cif=False, code=''):
+        """ Instantiate from mmCIF (cif=True) or PDB format text """
+        atoms = parse_cif_atoms(text) if cif else parse_pdb_atoms(text)
+        return cls(atoms=atoms, id=code)
+
+    @classmethod
+    def from_file(cls, filename, cif=False, code=''):
+        """ Instantiate from an mmCIF (cif=True) or PDB format file, which may be gzipped """
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rt') as foo:
+            return cls.from_text(foo.read(), cif=cif, code=code)
+
+    @property
+    def residues(self):
+        """ chain, resnum, icode and resname of each residue, as a structured array """
+        return self.atoms[['chain', 'resnum', 'icode', 'resname']][self.residue_starts]
+
+    @property
+    def chain_starts(self):
+        """ Index of the first residue of each chain """
+        chains = self.atoms['chain'][self.residue_starts]
+        if len(chains) == 0:
+            return numpy.array([], dtype=int)
+        return numpy.flatnonzero(numpy.append(True, chains[1:] != chains[:-1]))
+
+    def chain_slices(self):
+        """ slice of the residues of each chain """
+        ends = numpy.append(self.chain_starts[1:], len(self))
+        return [slice(start, end) for start, end in zip(self.chain_starts, ends)]
+
+    def ca_coordinates(self):
+        """ (n_residues, 3) array of the CA position of each residue, NaN for residues without a CA atom """
+        ca = numpy.full((len(self), 3), numpy.nan)
+        is_ca = numpy.flatnonzero(self.atoms['name'] == 'CA')[::-1]
+        # reversed, so the first CA of a residue is the one kept.
+        ca[self.residue_index[is_ca]] = self.atoms['xyz'][is_ca]
+        return ca
+
+    def side_chain_centres(self):
+        """ (n_residues, 3) array of the centre of the side-chain atoms of each residue.
+
+        Notes
+        -----
+        As in the side chain centres of isambard.add_ons.knobs_into_holes: the mean position of all atoms other than
+        N, CA, C and O, or the CA position for residues without side-chain atoms (glycine).
+        """
+        side_chain = ~numpy.in1d(self.atoms['name'], BACKBONE)
+        residue_index = self.residue_index[side_chain]
+        xyz = self.atoms['xyz'][side_chain]
+        counts = numpy.bincount(residue_index, minlength=len(self))
+        sums = numpy.stack([numpy.bincount(residue_index, weights=xyz[:, i], minlength=len(self)) for i in range(3)],
+                           axis=1)
+        centres = self.ca_coordinates()
+        has_side_chain = counts > 0
+        centres[has_side_chain] = sums[has_side_chain] / counts[has_side_chain, None]
+        return centres
+
+    def to_pdb(self, residues=None):
+        """ PDB format text of the atoms of residues (a slice or index array of residues), or of all atoms.
+
+        Notes
+        -----
+        Chains with identifiers longer than one character (allowed in mmCIF) are written with their first character.
+        """
+        if residues is None:
+            atoms = self.atoms
+        else:
+            atoms = self.atoms[numpy.in1d(self.residue_index, numpy.arange(len(self))[residues])]
+        lines = []
+        for i, a in enumerate(atoms):
+            name = a['name'] if len(a['name']) == 4 else ' ' + a['name']
+            lines.append('ATOM  {0:5d} {1:<4s}{2:1s}{3:>3s} {4:1s}{5:4d}{6:1s}   {7:8.3f}{8:8.3f}{9:8.3f}{10:6.2f}'
+                         '{11:6.2f}          {12:>2s}'.format((i + 1) % 100000, name, a['altloc'], a['resname'],
+                                                            a['chain'][:1], a['resnum'], a['icode'], a['xyz'][0],
+                                                            a['xyz'][1], a['xyz'][2], 1.0, 0.0, a['element']))
+        lines.append('END')
+        return '\n'.join(lines) + '\n'
+
+    def tag_secondary_structure(self, force=False):
+        """ Assign the DSSP secondary structure of each residue to self.secondary_structure.
+
+        Notes
+        -----
+        As for AMPAL Polypeptides, DSSP is run on each chain separately, and its assignments are given to the
+        residues of the chain in order.
+        """
+        if (self.secondary_structure is not None) and not force:
+            return
+        ss = numpy.full(len(self), ' ', dtype='U1')
+        for chain in self.chain_slices():
+            dssp_out = run_dssp(self.to_pdb(residues=chain), path=False)
+            if dssp_out is None:
+                continue
+            assignments = [x[1] for x in extract_all_ss_dssp(dssp_out, path=False)][:chain.stop - chain.start]
+            ss[chain.start:chain.start + len(assignments)] = assignments
+        self.secondary_structure = ss
+        return
+
+    def helices(self, min_length=1):
+        """ Residues of each helix: runs of at least min_length residues of a chain assigned 'H' by DSSP.
+
+        Returns
+        -------
+        helices: list(numpy.ndarray)
+            Residue indices of each helix, in order of chain and then of residue.
+        """
+        self.tag_secondary_structure()
+        helices = []
+        for chain in self.chain_slices():
+            is_helix = numpy.append(self.secondary_structure[chain] == 'H', False).astype(int)
+            changes = numpy.diff(numpy.append(0, is_helix))
+            for start, stop in zip(numpy.flatnonzero(changes == 1), numpy.flatnonzero(changes == -1)):
+                if stop - start >= min_length:
+                    helices.append(numpy.arange(chain.start + start, chain.start + stop))
+        return helices
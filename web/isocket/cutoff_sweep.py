@@ -0,0 +1,181 @@
+""" Connected components of a KIH graph at every (scut, kcut) cutoff, from one KIHEdgeTable.
+
+The graphs at stricter cutoffs are subgraphs of those at looser cutoffs, so instead of filtering the full graph once
+per cutoff, the scut at which each KIH is first kept is found once for each kcut, from the arrays of the table. The
+rows of the table are sorted by that scut and added incrementally to a union-find structure, so components are only
+merged as scut increases, and are read off whenever the sweep reaches one of the requested scuts.
+"""
+import networkx
+import numpy
+
+from isocket.kih_table import KIHEdgeTable
+
+
+class UnionFind:
+    """ Disjoint sets of helices, with the rows of the KIHs that belong to each set. """
+    def __init__(self):
+        self.parent = {}
+        self.nodes = {}
+        self.edges = {}
+
+    def __contains__(self, x):
+        return x in self.parent
+
+    def add(self, x):
+        if x not in self.parent:
+            self.parent[x] = x
+            self.nodes[x] = [x]
+            self.edges[x] = []
+        return
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # path compression
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x, y, edge):
+        """ Merge the sets of x and y (which must already be added) and record edge in the merged set. """
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            if len(self.nodes[rx]) < len(self.nodes[ry]):
+                rx, ry = ry, rx
+            self.parent[ry] = rx
+            self.nodes[rx] += self.nodes.pop(ry)
+            self.edges[rx] += self.edges.pop(ry)
+        self.edges[rx].append(edge)
+        return
+
+    def roots(self):
+        return list(self.nodes.keys())
+
+
+class CutoffSweep:
+    """ Plain connected component graphs of a KIH graph for a lattice of scut and kcut values.
+
+    Notes
+    -----
+    Reproduces, for every (scut, kcut), the components obtained by KnobGroup.filter_graph(g, cutoff=scut,
+    min_kihs=kcut) followed by graph_to_plain_graph and a size-ordered split into connected components:
+        - a KIH is kept if its max_kh_distance <= scut;
+        - for kcut > 0, a KIH is only kept if both of its helices share more than kcut (kept) KIHs, in the same
+          direction, with at least one helix;
+        - nodes are numbered in order of first appearance in the kept KIHs, and components are ordered by size
+          (largest first), ties broken by their lowest node number.
+
+    Parameters
+    ----------
+    table: KIHEdgeTable
+        KIHs in the order of KnobGroup.graph.edges().
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def __repr__(self):
+        return '<CutoffSweep(kihs={})>'.format(len(self.table))
+
+    @classmethod
+    def from_kihs(cls, kihs):
+        """ Instantiate from a list of (knob helix number, hole helix number, max_kh_distance) """
+        return cls(table=KIHEdgeTable.from_kihs(kihs))
+
+    @classmethod
+    def from_knob_group(cls, kg):
+        """ Instantiate from an isambard.add_ons.knobs_into_holes.KnobGroup """
+        return cls(table=KIHEdgeTable.from_knob_group(kg))
+
+    def _node_thresholds(self, kcut):
+        """ Smallest scut at which each helix shares more than kcut KIHs, in one direction, with another helix.
+
+        Returns
+        -------
+        thresholds: numpy.ndarray
+            Indexed by helix number. inf for helices that never do.
+        """
+        t = self.table
+        thresholds = numpy.full(int(max(t.src.max(), t.dst.max())) + 1, numpy.inf)
+        keys = t._pair_keys()
+        # the KIHs of each (knob helix, hole helix) pair, closest first.
+        order = numpy.lexsort((t.max_kh_distance, keys))
+        keys = keys[order]
+        starts = numpy.flatnonzero(numpy.append(True, keys[1:] != keys[:-1]))
+        sizes = numpy.diff(numpy.append(starts, len(keys)))
+        # the KIH at which each pair first has more than kcut KIHs.
+        rows = order[starts[sizes > kcut] + kcut]
+        numpy.minimum.at(thresholds, t.src[rows], t.max_kh_distance[rows])
+        numpy.minimum.at(thresholds, t.dst[rows], t.max_kh_distance[rows])
+        return thresholds
+
+    def _activations(self, kcut):
+        """ Smallest scut at which each KIH is kept at kcut (inf for KIHs that never are) """
+        if kcut == 0:
+            return self.table.max_kh_distance
+        thresholds = self._node_thresholds(kcut=kcut)
+        return numpy.maximum(self.table.max_kh_distance,
+                             numpy.maximum(thresholds[self.table.src], thresholds[self.table.dst]))
+
+    def _components(self, uf, first_seen):
+        """ Plain graphs of the current components of uf, numbered and ordered as described in the class notes.
+
+        Parameters
+        ----------
+        uf: UnionFind
+            Helices and the rows of the KIHs kept so far.
+        first_seen: numpy.ndarray
+            Indexed by helix number: 2 * row + (0 for knob helix, 1 for hole helix) of the first appearance of the
+            helix in the kept KIHs.
+        """
+        helices = numpy.array(list(uf.parent), dtype=int)
+        labels = numpy.empty(len(first_seen), dtype=int)
+        labels[helices[numpy.argsort(first_seen[helices])]] = numpy.arange(len(helices))
+        ccs = []
+        for root in uf.roots():
+            rows = numpy.array(uf.edges[root], dtype=int)
+            h = networkx.Graph()
+            h.add_nodes_from(sorted(labels[uf.nodes[root]].tolist()))
+            h.add_edges_from(zip(labels[self.table.src[rows]].tolist(), labels[self.table.dst[rows]].tolist()))
+            h.graph['name'] = None
+            ccs.append(h)
+        return sorted(ccs, key=lambda x: (-x.number_of_nodes(), min(x.nodes())))
+
+    def plain_graphs(self, scuts, kcuts):
+        """ Connected component plain graphs at each cutoff.
+
+        Parameters
+        ----------
+        scuts: list[float]
+        kcuts: list[int]
+
+        Returns
+        -------
+        ccs: dict
+            (scut, kcut) -> list[networkx.Graph], ordered largest first. Empty if there are no KIHs at that cutoff.
+        """
+        if len(self.table) == 0:
+            return {(scut, kcut): [] for scut in scuts for kcut in kcuts}
+        t = self.table
+        n_helices = int(max(t.src.max(), t.dst.max())) + 1
+        ccs = {}
+        for kcut in kcuts:
+            activations = self._activations(kcut=kcut)
+            # rows in the order they are kept as scut increases (rows that are never kept are left out).
+            order = numpy.argsort(activations, kind='mergesort')
+            order = order[numpy.isfinite(activations[order])]
+            uf = UnionFind()
+            first_seen = numpy.full(n_helices, 2 * len(t), dtype=numpy.int64)
+            position = 0
+            for scut in sorted(scuts):
+                end = int(numpy.searchsorted(activations[order], scut, side='right'))
+                rows = order[position:end]
+                numpy.minimum.at(first_seen, t.src[rows], 2 * rows)
+                numpy.minimum.at(first_seen, t.dst[rows], 2 * rows + 1)
+                for row, e1, e2 in zip(rows.tolist(), t.src[rows].tolist(), t.dst[rows].tolist()):
+                    uf.add(e1)
+                    uf.add(e2)
+                    uf.union(e1, e2, edge=row)
+                position = end
+                ccs[(scut, kcut)] = self._components(uf=uf, first_seen=first_seen)
+        return ccs
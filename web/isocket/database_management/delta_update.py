@@ -0,0 +1,114 @@
+""" Delta updates: bring the database in line with a mirror manifest, processing only the entries that changed.
+
+Each PdbDB row stores the checksum and revision date of the source file its graphs were found in. Comparing these with
+a manifest of the mirror (see mirror_manifest) gives
+    added: codes in the manifest but not in the database;
+    revised: codes whose checksum in the manifest differs from the stored one (or has not been stored);
+    obsolete: codes in the database but no longer in the manifest.
+Obsolete codes are removed in bulk, revised codes are removed and processed again, and added codes are processed.
+"""
+from collections import namedtuple
+
+import sqlalchemy
+
+from isocket.database_management.models import PdbDB
+from isocket.database_management.populate_models import session_scope, remove_pdb_codes, set_pdb_revisions
+from isocket.database_management.update_db import UpdateCodes
+
+Delta = namedtuple('Delta', ['added', 'revised', 'obsolete'])
+
+
+def stored_checksums():
+    """ {code: checksum} of all codes in PdbDB. checksum is None for codes added without one. """
+    table = PdbDB.__table__
+    with session_scope() as session:
+        return dict(session.execute(sqlalchemy.select([table.c.pdb, table.c.checksum])).fetchall())
+
+
+def plan_delta(manifest):
+    """ The codes that need to be added, reprocessed or removed to match manifest.
+
+    Parameters
+    ----------
+    manifest: dict
+        Maps codes to ManifestEntry (see mirror_manifest.build_manifest).
+
+    Returns
+    -------
+    delta: Delta
+        Sorted lists of the added, revised and obsolete codes.
+    """
+    stored = stored_checksums()
+    added = sorted(code for code in manifest if code not in stored)
+    revised = sorted(code for code, checksum in stored.items()
+                     if code in manifest and checksum != manifest[code].checksum)
+    obsolete = sorted(code for code in stored if code not in manifest)
+    return Delta(added=added, revised=revised, obsolete=obsolete)
+
+
+def stamp_revisions(manifest):
+    """ Store the manifest checksum and revision date of codes that are in the database without one.
+
+    Notes
+    -----
+    For adopting delta updates on a database built before checksums were stored, when its graphs are known to be
+    up to date with the mirror. Otherwise all of its codes would be planned as revised.
+
+    Returns
+    -------
+    n_stamped: int
+    """
+    revisions = {code: (manifest[code].checksum, manifest[code].revision_date)
+                 for code, checksum in stored_checksums().items() if checksum is None and code in manifest}
+    set_pdb_revisions(revisions)
+    return len(revisions)
+
+
+def run_delta(manifest, mode=None, workers=None, chunk_size=100, journal=None, limit=None, store_files=False,
+              source=None, name_cache_file=None):
+    """ Remove obsolete codes and (re)process added and revised codes, so that the database matches manifest.
+
+    Notes
+    -----
+    A revised code is removed just before it is processed again, so it is missing from the database while its new
+    graphs are found. If processing fails it stays missing, and is planned as added by the next delta update.
+    If source is a MirrorSource, the mirrored files and preferred mmols of revised codes are evicted first, so that
+    their new revisions are fetched from upstream.
+
+    Parameters
+    ----------
+    manifest: dict
+        Maps codes to ManifestEntry (see mirror_manifest.build_manifest).
+    mode, workers, chunk_size, name_cache_file: see UpdateCodes.run_update
+    journal: RunJournal or None
+        If given, progress is recorded in journal (see UpdateCodes.run_update). Codes planned by this delta that the
+        journal shows as done from an earlier run are processed again; failed codes keep their retry times.
+    limit: int or None
+        If given, process at most this many of the added and revised codes. The rest are planned again by the next
+        delta update. Obsolete codes are always all removed.
+    store_files, source: see StructureHandler.from_code.
+
+    Returns
+    -------
+    delta: Delta
+        The plan that was carried out (in part, if limit was given).
+    """
+    delta = plan_delta(manifest)
+    remove_pdb_codes(delta.obsolete)
+    codes = sorted(delta.added + delta.revised)
+    if journal is not None:
+        journal.reopen(codes)
+        codes = journal.pending(codes, limit=limit)
+    elif limit is not None:
+        codes = codes[:limit]
+    revised = set(codes).intersection(delta.revised)
+    remove_pdb_codes(revised)
+    if hasattr(source, 'evict'):
+        # the mirror's copies of revised codes are out of date.
+        for code in revised:
+            source.evict(code)
+    revisions = {code: (manifest[code].checksum, manifest[code].revision_date) for code in codes}
+    UpdateCodes(codes=codes, store_files=store_files, source=source).run_update(
+        mode=mode, workers=workers, chunk_size=chunk_size, journal=journal, revisions=revisions,
+        name_cache_file=name_cache_file)
+    return delta
@@ -0,0 +1,50 @@
+""" Connection settings applied to the SQLAlchemy engine when the app is created.
+
+Pool sizes and recycling are passed to create_engine by Flask-SQLAlchemy from the SQLALCHEMY_POOL_* config values.
+This module adds what those values cannot express:
+    - pre-ping: each connection checked out of the pool is tested first, and replaced if the server has dropped it;
+    - SQLite pragmas: set on every new connection, e.g. WAL journalling so that readers are not blocked by a writer.
+"""
+from sqlalchemy import event, exc, select
+
+
+def add_pre_ping(engine):
+    """ Test each connection with SELECT 1 when it is checked out, reconnecting if it has gone away. """
+    @event.listens_for(engine, 'engine_connect')
+    def ping_connection(connection, branch):
+        if branch:
+            # sub-connections share the parent's DBAPI connection, which has already been tested.
+            return
+        should_close_with_result = connection.should_close_with_result
+        connection.should_close_with_result = False
+        try:
+            connection.scalar(select([1]))
+        except exc.DBAPIError as e:
+            # an invalidated connection is reconnected on the next statement.
+            if e.connection_invalidated:
+                connection.scalar(select([1]))
+            else:
+                raise
+        finally:
+            connection.should_close_with_result = should_close_with_result
+    return
+
+
+def add_sqlite_pragmas(engine, pragmas):
+    """ Run PRAGMA key=value for each item of pragmas on every new connection of engine. """
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute('PRAGMA {0}={1}'.format(key, value))
+        cursor.close()
+    return
+
+
+def configure_engine(engine, config):
+    """ Apply the SQLALCHEMY_PRE_PING and SQLITE_PRAGMAS values of config (a dict or Flask config) to engine. """
+    if config.get('SQLALCHEMY_PRE_PING'):
+        add_pre_ping(engine)
+    if engine.dialect.name == 'sqlite' and config.get('SQLITE_PRAGMAS'):
+        add_sqlite_pragmas(engine, config['SQLITE_PRAGMAS'])
+    return engine
@@ -0,0 +1,106 @@
+""" Columnar export of the graph database, for the atlas viewer and offline analysis.
+
+The GraphDB, PdbeDB and PdbDB rows are read in chunks of graph ids with core select statements (no ORM objects),
+joined in memory to the small CutoffDB and AtlasDB tables, and appended to an HDF5 table with one column per field:
+    pdb, mmol, preferred, scut, kcut, gname, cc_num, nodes, edges
+indexed by the GraphDB id. This is the 'graph_names' table read by atlas_visualisation.
+"""
+import os
+import tempfile
+
+import pandas
+import sqlalchemy
+
+from isocket.database_management.models import GraphDB, PdbDB, PdbeDB, CutoffDB, AtlasDB
+from isocket.database_management.populate_models import session_scope
+
+columns = ['pdb', 'mmol', 'preferred', 'scut', 'kcut', 'gname', 'cc_num', 'nodes', 'edges']
+_dtypes = dict(pdb=str, mmol='int16', preferred=bool, scut='float64', kcut='int8', gname=str, cc_num='int16',
+               nodes='int16', edges='int16')
+_min_itemsize = dict(pdb=4, gname=30)
+
+
+def last_exported_id(filename, key='graph_names'):
+    """ Largest GraphDB id in the export at filename, or 0 if there is no such export. """
+    if not os.path.exists(filename):
+        return 0
+    with pandas.HDFStore(filename, mode='r') as store:
+        if '/{}'.format(key) not in store.keys():
+            return 0
+        return int(getattr(store.get_storer(key).attrs, 'last_graph_id', 0))
+
+
+def iter_graph_frames(after_id=0, chunk_size=100000):
+    """ DataFrames of the graphs with GraphDB id > after_id, in id order, chunk_size rows at a time.
+
+    Notes
+    -----
+    Chunks are selected by id range (WHERE id > last id ORDER BY id LIMIT chunk_size) rather than with OFFSET, so
+    each query is an index range scan whatever the size of the table.
+    """
+    graph, pdbe, pdb = GraphDB.__table__, PdbeDB.__table__, PdbDB.__table__
+    with session_scope() as session:
+        cutoffs = pandas.DataFrame(
+            [(x.id, float(x.scut), x.kcut) for x in session.query(CutoffDB.id, CutoffDB.scut, CutoffDB.kcut)],
+            columns=['cutoff_id', 'scut', 'kcut']).set_index('cutoff_id')
+        atlas = pandas.DataFrame(
+            session.query(AtlasDB.id, AtlasDB.name, AtlasDB.nodes, AtlasDB.edges).all(),
+            columns=['atlas_id', 'gname', 'nodes', 'edges']).set_index('atlas_id')
+        q = sqlalchemy.select([graph.c.id, pdb.c.pdb, pdbe.c.mmol, pdbe.c.preferred, graph.c.cutoff_id,
+                               graph.c.atlas_id, graph.c.connected_component]).select_from(
+            graph.join(pdbe, graph.c.pdbe_id == pdbe.c.id).join(pdb, pdbe.c.pdb_id == pdb.c.id)).order_by(
+            graph.c.id).limit(chunk_size)
+        while True:
+            rows = session.execute(q.where(graph.c.id > after_id)).fetchall()
+            if not rows:
+                return
+            frame = pandas.DataFrame.from_records(
+                rows, columns=['graph_id', 'pdb', 'mmol', 'preferred', 'cutoff_id', 'atlas_id', 'cc_num'],
+                index='graph_id')
+            frame = frame.join(cutoffs, on='cutoff_id').join(atlas, on='atlas_id')
+            yield frame[columns].astype(_dtypes)
+            after_id = int(rows[-1][0])
+
+
+def export_graphs(filename, append=False, chunk_size=100000, key='graph_names'):
+    """ Write the graphs in the database to a columnar HDF5 file.
+
+    Parameters
+    ----------
+    filename: str
+    append: bool
+        If True, only graphs added since the last export to filename are exported, and appended to it.
+        Graphs removed from the database since then are not removed from the file; use a full export for that.
+        If False, the file is written from scratch and replaces any existing file once complete.
+    chunk_size: int
+        Number of rows read from the database and written to the file at a time.
+    key: str
+        Name of the table in the HDF5 file.
+
+    Returns
+    -------
+    n_rows: int
+        Number of rows written.
+    """
+    if append:
+        path = filename
+        after_id = last_exported_id(filename, key=key)
+    else:
+        directory = os.path.dirname(os.path.abspath(filename))
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.h5', delete=False) as foo:
+            path = foo.name
+        after_id = 0
+    n_rows = 0
+    try:
+        with pandas.HDFStore(path, mode='a' if append else 'w', complevel=5, complib='blosc') as store:
+            for frame in iter_graph_frames(after_id=after_id, chunk_size=chunk_size):
+                store.append(key, frame, format='table', data_columns=True, min_itemsize=_min_itemsize)
+                store.get_storer(key).attrs.last_graph_id = int(frame.index[-1])
+                n_rows += len(frame)
+    except:
+        if not append:
+            os.remove(path)
+        raise
+    if not append:
+        os.replace(path, filename)
+    return n_rows
@@ -0,0 +1,110 @@
+""" Manifest of the entries in a local mirror of the PDB: the revision date and checksum of each code's file.
+
+A mirror made with rsync from a wwPDB site (e.g. the divided mmCIF or PDB format archives) keeps the modification time
+of each file, which is the date of its latest revision. The manifest is a tab-separated file with columns
+    code, revision_date, checksum, size, mtime
+and is rebuilt by scanning the mirror. Checksums are only recomputed for files whose size or modification time have
+changed since the previous manifest, so a weekly rebuild reads just the files that were added or revised that week.
+
+The mirror scanned here is a copy of a wwPDB archive, with one file per entry. It is not the structure source directory
+of a MirrorSource (the --mirror of manage.py), which holds the biological units of just the codes that have been
+processed, one file per mmol, and so cannot tell which entries were added or revised. build_manifest refuses such a
+directory.
+"""
+import csv
+import datetime
+import hashlib
+import os
+import re
+from collections import namedtuple
+
+ManifestEntry = namedtuple('ManifestEntry', ['revision_date', 'checksum', 'size', 'mtime'])
+
+# 1abc.cif, 1abc.cif.gz (mmCIF archive), pdb1abc.ent.gz (PDB format archive), 1abc.pdb
+_entry_file = re.compile(r'^(?:pdb)?([0-9a-z]{4})\.(cif|ent|pdb)(?:\.gz)?$')
+_columns = ['code', 'revision_date', 'checksum', 'size', 'mtime']
+# Index file of a structure source directory (see isocket.structure_sources).
+_source_index_filename = 'preferred_mmols.tsv'
+
+
+def file_checksum(path, block_size=1 << 20):
+    """ SHA-256 hex digest of the contents of the file at path """
+    h = hashlib.sha256()
+    with open(path, 'rb') as foo:
+        for block in iter(lambda: foo.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_manifest(mirror_dir, previous=None):
+    """ Manifest of the entry files under mirror_dir.
+
+    Parameters
+    ----------
+    mirror_dir: str
+        Root of the mirror. All subdirectories are searched.
+    previous: dict or None
+        An earlier manifest (as returned by read_manifest) of the same mirror. Checksums of files whose size and
+        mtime are unchanged are taken from it rather than recomputed.
+
+    Raises
+    ------
+    ValueError
+        If mirror_dir is a structure source directory rather than a mirror of a wwPDB archive.
+
+    Returns
+    -------
+    manifest: dict
+        Maps each PDB code to a ManifestEntry. Where a code has both an mmCIF and a PDB format file, the mmCIF file
+        is used, as it is the one StructureHandler reads first.
+    """
+    if os.path.exists(os.path.join(mirror_dir, _source_index_filename)):
+        raise ValueError('{} is a structure source directory, not a mirror of a wwPDB archive.'.format(mirror_dir))
+    previous = previous or {}
+    paths = {}
+    for directory, _, filenames in os.walk(mirror_dir):
+        for filename in filenames:
+            match = _entry_file.match(filename.lower())
+            if match is None:
+                continue
+            code, extension = match.groups()
+            if code not in paths or extension == 'cif':
+                paths[code] = os.path.join(directory, filename)
+    manifest = {}
+    for code, path in paths.items():
+        st = os.stat(path)
+        mtime = int(st.st_mtime)
+        old = previous.get(code)
+        if old is not None and old.size == st.st_size and old.mtime == mtime:
+            checksum = old.checksum
+        else:
+            checksum = file_checksum(path)
+        revision_date = datetime.datetime.utcfromtimestamp(mtime).date()
+        manifest[code] = ManifestEntry(revision_date=revision_date, checksum=checksum, size=st.st_size, mtime=mtime)
+    return manifest
+
+
+def write_manifest(manifest, filename):
+    """ Write manifest (see build_manifest) to filename, sorted by code. The file is replaced once complete. """
+    temp_filename = '{}.tmp'.format(filename)
+    with open(temp_filename, 'w', newline='') as foo:
+        writer = csv.writer(foo, delimiter='\t')
+        writer.writerow(_columns)
+        for code in sorted(manifest):
+            x = manifest[code]
+            writer.writerow([code, x.revision_date.isoformat(), x.checksum, x.size, x.mtime])
+    os.replace(temp_filename, filename)
+    return
+
+
+def read_manifest(filename):
+    """ The manifest written to filename by write_manifest, or an empty manifest if there is no such file. """
+    if not os.path.exists(filename):
+        return {}
+    manifest = {}
+    with open(filename, 'r', newline='') as foo:
+        for row in csv.DictReader(foo, delimiter='\t'):
+            manifest[row['code']] = ManifestEntry(
+                revision_date=datetime.datetime.strptime(row['revision_date'], '%Y-%m-%d').date(),
+                checksum=row['checksum'], size=int(row['size']), mtime=int(row['mtime']))
+    return manifest
@@ -47,13 +47,24 @@ class CutoffDB(db.Model):
 
 class GraphDB(db.Model):
     __tablename__ = 'graph'
-    __table_args__ = {'mysql_engine': 'InnoDB'}
+    # Covering indexes: by cutoff, for counting the graphs with each atlas graph (see queries.graph_frequencies), and
+    # by pdbe, for the graphs of given structures (per-code queries and the existing graphs check of add_graphs_to_db).
+    # They also serve lookups on their first column, so cutoff_id and pdbe_id have no single-column indexes.
+    # Each connected component of a structure has one graph at each cutoff, so that is the unique key, and graphs
+    # already in the database are skipped when added again (see populate_models). atlas_id is not part of it, as the
+    # name of a graph can change between runs (e.g. when an unknown graph is given a name).
+    __table_args__ = (db.Index('ix_graph_cutoff_id_atlas_id_pdbe_id', 'cutoff_id', 'atlas_id', 'pdbe_id'),
+                      db.Index('ix_graph_pdbe_id_cutoff_id_atlas_id_cc', 'pdbe_id', 'cutoff_id', 'atlas_id',
+                               'connected_component'),
+                      db.Index('uq_graph_pdbe_id_cutoff_id_cc', 'pdbe_id', 'cutoff_id', 'connected_component',
+                               unique=True),
+                      {'mysql_engine': 'InnoDB'})
 
     id = db.Column(db.Integer, primary_key=True)
     connected_component = db.Column(db.SmallInteger, nullable=False, index=True)
     atlas_id = db.Column(db.ForeignKey('atlas.id'), index=True, nullable=False)
-    cutoff_id = db.Column(db.ForeignKey('cutoff.id'), nullable=False, index=True)
-    pdbe_id = db.Column(db.ForeignKey('pdbe.id', ondelete='CASCADE'), nullable=False, index=True)
+    cutoff_id = db.Column(db.ForeignKey('cutoff.id'), nullable=False)
+    pdbe_id = db.Column(db.ForeignKey('pdbe.id', ondelete='CASCADE'), nullable=False)
 
     atlas = db.relationship('AtlasDB', back_populates='graphs')
     cutoff = db.relationship('CutoffDB', back_populates='graphs')
@@ -69,6 +80,9 @@ class PdbDB(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     pdb = db.Column(db.String(4), nullable=False, unique=True)
+    # Checksum and revision date of the source file the graphs were found in (see mirror_manifest).
+    checksum = db.Column(db.String(64), nullable=True)
+    revision_date = db.Column(db.Date, nullable=True)
 
     pdbes = db.relationship('PdbeDB', back_populates='pdb', cascade='all, delete-orphan', passive_deletes=True)
 
@@ -91,3 +105,15 @@ class PdbeDB(db.Model):
 
     def __repr__(self):
         return '<PdbeDB(pdb={0}, mmol={1}, preferred={2})>'.format(self.pdb.pdb, self.mmol, bool(self.preferred))
+
+
+class DataVersionDB(db.Model):
+    """ One row counting the changes to the graphs and structures in the database (see queries.data_version). """
+    __tablename__ = 'data_version'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<DataVersionDB(version={0})>'.format(self.version)
@@ -0,0 +1,280 @@
+""" Staged database update, in which reading structures, finding their graphs and writing to the database overlap.
+
+Stages, connected by bounded queues so that a slow stage holds back the stages before it:
+    read: asyncio tasks read (decompress, or fetch) the structure of each code, in a pool of threads;
+    graph: parsing, KIH detection and the cutoff sweep of each structure run in a pool of worker processes;
+    write: a single thread names the graphs and writes them to the database, chunk_size codes at a time.
+The throughput of each stage and its occupancy (the fraction of its threads' or processes' time that was spent
+working) are collected in PipelineStats, showing which stage limits the run.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app, has_app_context
+
+from isocket.database_management.run_journal import PARSED, GRAPHED
+from isocket.database_management.update_db import Attempt, write_attempts, graph_to_record, record_to_graph, \
+    isolated_records, _error_message
+from isocket.name_cache import name_cache
+from isocket.structure_handler import StructureHandler, name_knob_graphs
+from isocket.structure_sources import PDBeSource, read_structure
+
+
+def structure_knob_graph_records(code, mmol, text, cif, source, coordinates=False):
+    """ Knob graph records (see graph_to_record) of a structure read by read_structure, for running in a worker process.
+
+    Parameters
+    ----------
+    code, mmol, text, cif: as returned by read_structure.
+    source: structure source the structure was read from.
+    coordinates: bool
+        If True, the structure is read into a CoordinateStructure (see StructureHandler.from_code).
+
+    Returns
+    -------
+    records, status, error: as knob_graph_records.
+    """
+    status = None
+    try:
+        try:
+            sh = StructureHandler.from_text(text, code=code, mmol=mmol, preferred=True, cif=cif,
+                                            coordinates=coordinates)
+        except ValueError:
+            if not cif:
+                raise
+            # as in StructureHandler.from_code, use the PDB format file if the mmCIF file cannot be read.
+            sh = StructureHandler.from_text(source.get_mmol(code, mmol), code=code, mmol=mmol, preferred=True,
+                                            cif=False, coordinates=coordinates)
+        status = PARSED
+        kgs = sh.get_knob_graphs(min_scut=7.0, max_scut=9.0, scut_increment=0.5, name_graphs=False)
+        return [graph_to_record(g) for g in kgs], GRAPHED, None
+    except Exception as e:
+        return [], status, _error_message(e)
+
+
+class StageStats:
+    """ Number of items a pipeline stage has processed, and the time it spent processing them.
+
+    Parameters
+    ----------
+    name: str
+    slots: int
+        Number of items the stage can work on at the same time.
+    """
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self.items = 0
+        self.busy = 0.0
+
+    def __repr__(self):
+        return '<StageStats(name={0}, slots={1}, items={2}, busy={3:.1f})>'.format(
+            self.name, self.slots, self.items, self.busy)
+
+    def add(self, seconds, items=1):
+        self.items += items
+        self.busy += seconds
+        return
+
+    def throughput(self, elapsed):
+        """ Items per second over a run of elapsed seconds """
+        return self.items / elapsed if elapsed else 0.0
+
+    def occupancy(self, elapsed):
+        """ Fraction of the stage's capacity over a run of elapsed seconds that was spent working """
+        return self.busy / (elapsed * self.slots) if elapsed else 0.0
+
+
+class PipelineStats(OrderedDict):
+    """ StageStats of each stage by name, and the elapsed time of the run. """
+    def __init__(self, stages):
+        super().__init__((x.name, x) for x in stages)
+        self.elapsed = 0.0
+
+    def __str__(self):
+        lines = ['{0} codes in {1:.1f} s'.format(self['read'].items, self.elapsed)]
+        for x in self.values():
+            lines.append('{0:>6}: {1:>7} items, {2:8.2f} /s, {3:4.0%} occupied ({4} slots)'.format(
+                x.name, x.items, x.throughput(self.elapsed), x.occupancy(self.elapsed), x.slots))
+        return '\n'.join(lines)
+
+
+class UpdatePipeline:
+    """ Adds the graphs of codes to the database with the read, graph and write stages running concurrently.
+
+    Parameters
+    ----------
+    codes: list(str)
+        4-letter PDB accession codes
+    source: structure source or None
+        Where structures are read from (see isocket.structure_sources), e.g. a MirrorSource. Defaults to the PDBe.
+    workers: int or None
+        Number of worker processes of the graph stage. Defaults to the number of CPUs.
+    readers: int
+        Number of structures read at the same time.
+    chunk_size: int
+        Number of codes whose graphs are named and written to the database together.
+    queue_size: int or None
+        Maximum number of structures read and waiting for a worker. Defaults to 2 * workers.
+        Memory use depends on queue_size and chunk_size, not on the number of codes.
+    coordinates: bool
+        If True, structures are read into CoordinateStructures rather than AMPAL assemblies in the graph stage.
+    """
+    def __init__(self, codes, source=None, workers=None, readers=8, chunk_size=100, queue_size=None,
+                 coordinates=False):
+        self.codes = codes
+        self.source = PDBeSource() if source is None else source
+        self.workers = workers or os.cpu_count()
+        self.readers = readers
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size or 2 * self.workers
+        self.coordinates = coordinates
+        self.stats = None
+
+    def __repr__(self):
+        return '<UpdatePipeline(codes={0}, source={1}, workers={2})>'.format(len(self.codes), self.source,
+                                                                             self.workers)
+
+    def run(self, mode=None, journal=None, limit=None, revisions=None, name_cache_file=None):
+        """ Run the pipeline over self.codes.
+
+        Parameters
+        ----------
+        mode, journal, limit, revisions, name_cache_file: see UpdateCodes.run_update
+
+        Returns
+        -------
+        stats: PipelineStats
+        """
+        codes = self.codes if journal is None else journal.pending(self.codes, limit=limit)
+        self.stats = PipelineStats([StageStats('read', self.readers), StageStats('graph', self.workers),
+                                    StageStats('write', 1)])
+        # the writer thread needs the application context for the database session.
+        app = current_app._get_current_object() if has_app_context() else None
+        loop = asyncio.new_event_loop()
+        start = time.perf_counter()
+        try:
+            with name_cache.persisted(name_cache_file):
+                loop.run_until_complete(self._run(codes, app=app, mode=mode, journal=journal, revisions=revisions))
+        finally:
+            self.stats.elapsed = time.perf_counter() - start
+            loop.close()
+        return self.stats
+
+    async def _run(self, codes, app, mode, journal, revisions):
+        loop = asyncio.get_event_loop()
+        structures = asyncio.Queue(maxsize=self.queue_size)
+        results = asyncio.Queue(maxsize=self.chunk_size)
+        code_iter = iter(codes)
+        # a list, so that the graph stage can replace a pool that a dying worker has broken.
+        graph_pool = [ProcessPoolExecutor(max_workers=self.workers)]
+        try:
+            with ThreadPoolExecutor(max_workers=self.readers) as read_pool, \
+                    ThreadPoolExecutor(max_workers=1) as write_pool:
+
+                async def read_stage():
+                    await asyncio.gather(*[self._read(loop, read_pool, code_iter, structures)
+                                           for _ in range(self.readers)])
+                    for _ in range(self.workers):
+                        await structures.put(None)
+
+                async def graph_stage():
+                    await asyncio.gather(*[self._graph(loop, graph_pool, structures, results)
+                                           for _ in range(self.workers)])
+                    await results.put(None)
+
+                tasks = [asyncio.ensure_future(read_stage()),
+                         asyncio.ensure_future(graph_stage()),
+                         asyncio.ensure_future(self._write(loop, write_pool, results, app=app, mode=mode,
+                                                           journal=journal, revisions=revisions))]
+                # if a stage fails (e.g. the database write), the others are stopped rather than left waiting on it.
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                for task in done:
+                    task.result()
+        finally:
+            graph_pool[0].shutdown()
+        return
+
+    async def _read(self, loop, read_pool, code_iter, structures):
+        for code in code_iter:
+            start = time.perf_counter()
+            try:
+                mmol, text, cif = await loop.run_in_executor(read_pool, read_structure, self.source, code)
+                item = (code, mmol, text, cif, None)
+            except asyncio.CancelledError:
+                # an Exception before Python 3.8, so re-raised here to stop the stage.
+                raise
+            except Exception as e:
+                item = (code, None, None, None, _error_message(e))
+            self.stats['read'].add(time.perf_counter() - start)
+            await structures.put(item)
+        return
+
+    async def _graph(self, loop, graph_pool, structures, results):
+        while True:
+            item = await structures.get()
+            if item is None:
+                return
+            code, mmol, text, cif, error = item
+            if error is not None:
+                await results.put((code, [], None, error))
+                continue
+            start = time.perf_counter()
+            args = (code, mmol, text, cif, self.source, self.coordinates)
+            pool = graph_pool[0]
+            try:
+                records, status, error = await loop.run_in_executor(pool, structure_knob_graph_records, *args)
+            except asyncio.CancelledError:
+                raise
+            except BrokenProcessPool:
+                # a worker died, failing every structure in the pool. The first graph task to see it replaces the
+                # pool, and each runs its structure again in a process of its own, so only the one that killed the
+                # worker fails.
+                if graph_pool[0] is pool:
+                    graph_pool[0] = ProcessPoolExecutor(max_workers=self.workers)
+                    pool.shutdown(wait=False)
+                records, status, error = await loop.run_in_executor(None, isolated_records,
+                                                                    structure_knob_graph_records, *args)
+            except Exception as e:
+                # the result of the worker could not be returned.
+                records, status, error = [], None, _error_message(e)
+            self.stats['graph'].add(time.perf_counter() - start)
+            await results.put((code, records, status, error))
+
+    async def _write(self, loop, write_pool, results, app, mode, journal, revisions):
+        batch = []
+        finished = False
+        while not finished:
+            item = await results.get()
+            if item is None:
+                finished = True
+            else:
+                batch.append(item)
+            if batch and (finished or len(batch) >= self.chunk_size):
+                start = time.perf_counter()
+                await loop.run_in_executor(write_pool, _write_batch, batch, app, mode, journal, revisions)
+                self.stats['write'].add(time.perf_counter() - start, items=len(batch))
+                batch = []
+        return
+
+
+def _write_batch(batch, app, mode, journal, revisions):
+    """ Rebuild and name the graphs of batch of (code, records, status, error) and write them with write_attempts """
+    attempts = []
+    for code, records, status, error in batch:
+        kgs = [record_to_graph(record) for record in records]
+        name_knob_graphs(kgs)
+        attempts.append(Attempt(code=code, knob_graphs=kgs, status=status, error=error))
+    if app is None:
+        write_attempts(attempts, mode=mode, journal=journal, revisions=revisions)
+    else:
+        with app.app_context():
+            write_attempts(attempts, mode=mode, journal=journal, revisions=revisions)
+    return
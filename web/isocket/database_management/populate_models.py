@@ -1,9 +1,18 @@
 import itertools
+import sqlite3
+from collections import OrderedDict
 from contextlib import contextmanager
 
 import sqlalchemy
+import sqlalchemy.exc
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Insert
 
-from isocket.database_management.models import db, GraphDB, PdbDB, PdbeDB, CutoffDB, AtlasDB
+from isocket.database_management.models import db, GraphDB, PdbDB, PdbeDB, CutoffDB, AtlasDB, DataVersionDB
+
+# SQLite versions that support INSERT ... ON CONFLICT (upsert) and RETURNING.
+_sqlite_has_upsert = sqlite3.sqlite_version_info >= (3, 24, 0)
+_sqlite_has_returning = sqlite3.sqlite_version_info >= (3, 35, 0)
 
 
 @contextmanager
@@ -20,18 +29,195 @@ def session_scope():
         session.close()
 
 
-class PopulateModel:
-    def __init__(self, model, **kwargs):
-        try:
-            self.model = model
-            self.instance = model(**kwargs)
-            self.parameters = kwargs
-        except Exception as e:
-            raise e
+class InsertIgnore(Insert):
+    """ INSERT that skips rows whose unique keys are already in the table, instead of raising IntegrityError.
+
+    Notes
+    -----
+    Compiled as INSERT ... ON CONFLICT (key) DO NOTHING on SQLite, where key is the unique key of the table (see
+    unique_key), and as INSERT ... ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id) on MySQL.
+    On MySQL the id of the existing row is then returned as the lastrowid of a single-row insert.
+    On both, only duplicates of the key are skipped: rows that break NOT NULL, CHECK or foreign key constraints still
+    raise IntegrityError (unlike INSERT OR IGNORE and INSERT IGNORE). Other databases get a plain INSERT.
+    SQLite before 3.24 has no ON CONFLICT clause, so there INSERT OR IGNORE is used, which also skips rows that break
+    NOT NULL or CHECK constraints.
+    """
+    pass
+
+
+def unique_key(table):
+    """ Names of the columns of the unique constraint or unique index of table other than its primary key, or of its
+    primary key if it has neither.
+
+    Raises ValueError if table has more than one.
+    """
+    keys = [x for x in table.constraints if isinstance(x, sqlalchemy.UniqueConstraint)]
+    keys += [x for x in table.indexes if x.unique]
+    if not keys:
+        keys = [table.primary_key]
+    if len(keys) != 1:
+        raise ValueError('Table {0} has {1} unique keys, not one.'.format(table.name, len(keys)))
+    return [c.name for c in keys[0].columns]
+
+
+@compiles(InsertIgnore)
+def _compile_insert_ignore(insert, compiler, **kwargs):
+    return compiler.visit_insert(insert, **kwargs)
+
+
+@compiles(InsertIgnore, 'sqlite')
+def _compile_insert_ignore_sqlite(insert, compiler, **kwargs):
+    if not _sqlite_has_upsert:
+        return compiler.visit_insert(insert, **kwargs).replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1)
+    key = ', '.join(compiler.preparer.quote(x) for x in unique_key(insert.table))
+    return compiler.visit_insert(insert, **kwargs) + ' ON CONFLICT ({}) DO NOTHING'.format(key)
+
 
-    def go(self, session):
-        item, created = get_or_create(model=self.model, session=session, **self.parameters)
-        return item
+@compiles(InsertIgnore, 'mysql')
+def _compile_insert_ignore_mysql(insert, compiler, **kwargs):
+    return compiler.visit_insert(insert, **kwargs) + ' ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)'
+
+
+def upsert_id(session, table, key_columns, **values):
+    """ Id of the row of table with the key_columns values of values, inserting values first if there is none.
+
+    Notes
+    -----
+    Safe to run concurrently with other processes inserting the same keys: the database resolves the race through
+    the unique constraint on key_columns. On MySQL this is a single INSERT ... ON DUPLICATE KEY statement (which
+    uses up an auto-increment value even when the row exists). On SQLite 3.35 or later it is a single INSERT ...
+    ON CONFLICT DO UPDATE ... RETURNING id statement, whose update sets a key column to its own value, so that the id
+    of an existing row is returned too. Older SQLite cannot return the id of an existing row from an insert, so there
+    it takes up to three statements: the row is selected, inserted if it is missing, and selected again if another
+    process inserted it in between. To add many rows, use the batched _upsert_ids instead.
+
+    Parameters
+    ----------
+    session : session
+        An sqlalchemy session.
+    table : sqlalchemy.Table
+    key_columns : list(str)
+        Names of the columns of the unique key of table (see unique_key).
+    values : specified keyword=value pairs
+        The row to insert. Values of columns not in key_columns are ignored if the row already exists.
+
+    Returns
+    -------
+    id: int
+    """
+    insert = InsertIgnore(table).values(**values)
+    dialect = session.get_bind().dialect
+    if dialect.name == 'mysql':
+        return session.execute(insert).lastrowid
+    if dialect.name == 'sqlite' and _sqlite_has_returning:
+        quote = dialect.identifier_preparer.quote
+        columns = list(values)
+        statement = sqlalchemy.text(
+            'INSERT INTO {0} ({1}) VALUES ({2}) ON CONFLICT ({3}) DO UPDATE SET {4} = excluded.{4} RETURNING id'.format(
+                quote(table.name), ', '.join(quote(x) for x in columns), ', '.join(':' + x for x in columns),
+                ', '.join(quote(x) for x in key_columns), quote(key_columns[0])))
+        # typed, so that values are converted as they are by table.insert().
+        statement = statement.bindparams(*[sqlalchemy.bindparam(x, type_=table.c[x].type) for x in columns])
+        return session.execute(statement, values).scalar()
+    q = sqlalchemy.select([table.c.id]).where(sqlalchemy.and_(*[table.c[k] == values[k] for k in key_columns]))
+    row_id = session.execute(q).scalar()
+    if row_id is None:
+        result = session.execute(insert)
+        # if no row was inserted, another process has added this key since it was selected.
+        row_id = result.inserted_primary_key[0] if result.rowcount == 1 else session.execute(q).scalar()
+    return row_id
+
+
+class DimensionCache:
+    """ In-memory maps from the natural keys of the CutoffDB and AtlasDB tables to their ids.
+
+    Notes
+    -----
+    Both tables are small and rarely change, so they are each read in full once rather than queried for every graph.
+    The maps are reloaded after invalidate() (called by populate_atlas and populate_cutoff, and when either table is
+    created or dropped, e.g. by db.create_all and db.drop_all), when the database URL changes, or when a key is not
+    found. Rows changed by other processes can still leave ids stale, so add_graph_to_db and add_graphs_to_db
+    invalidate the cache and try again once if their insert fails with an IntegrityError.
+    """
+    def __init__(self):
+        self.invalidate()
+
+    def __repr__(self):
+        return '<DimensionCache(cutoffs={0}, atlas={1})>'.format(
+            len(self._cutoff_ids or {}), len(self._atlas_ids or {}))
+
+    def invalidate(self):
+        self._bind = None
+        self._cutoff_ids = None
+        self._atlas_ids = None
+        return
+
+    def _check_bind(self, session):
+        bind = str(session.get_bind().url)
+        if bind != self._bind:
+            self.invalidate()
+            self._bind = bind
+        return
+
+    def cutoff_ids(self, session):
+        """ {(scut, kcut): CutoffDB.id}, with scut as a float """
+        self._check_bind(session)
+        if self._cutoff_ids is None:
+            self._cutoff_ids = {(float(scut), kcut): i
+                                for i, scut, kcut in session.query(CutoffDB.id, CutoffDB.scut, CutoffDB.kcut)}
+        return self._cutoff_ids
+
+    def atlas_ids(self, session):
+        """ {name: AtlasDB.id} """
+        self._check_bind(session)
+        if self._atlas_ids is None:
+            self._atlas_ids = {name: i for i, name in session.query(AtlasDB.id, AtlasDB.name)}
+        return self._atlas_ids
+
+    def cutoff_id(self, session, scut, kcut):
+        """ CutoffDB.id for (scut, kcut). Raises KeyError if there is no such row. """
+        key = (float(scut), kcut)
+        if key not in self.cutoff_ids(session):
+            self.invalidate()
+        return self.cutoff_ids(session)[key]
+
+
+dimension_cache = DimensionCache()
+
+
+def _invalidate_dimension_cache(*args, **kwargs):
+    dimension_cache.invalidate()
+
+
+for _table in (CutoffDB.__table__, AtlasDB.__table__):
+    sqlalchemy.event.listen(_table, 'after_create', _invalidate_dimension_cache)
+    sqlalchemy.event.listen(_table, 'after_drop', _invalidate_dimension_cache)
+
+
+def _retry_with_fresh_dimensions(add):
+    """ Runs add() in a session_scope, and once more with dimension_cache reloaded if it raised IntegrityError. """
+    try:
+        with session_scope() as session:
+            return add(session)
+    except sqlalchemy.exc.IntegrityError:
+        # a cached CutoffDB or AtlasDB id may no longer exist, e.g. if another process has recreated the tables.
+        dimension_cache.invalidate()
+    with session_scope() as session:
+        return add(session)
+
+
+def bump_data_version(session):
+    """ Increment the version in DataVersionDB, adding its row if there is none.
+
+    Notes
+    -----
+    Called in the same transaction as every change to GraphDB or PdbDB, so that queries.data_version changes with
+    them. The row stays locked until the transaction ends, so it is bumped last.
+    """
+    table = DataVersionDB.__table__
+    session.execute(InsertIgnore(table).values(id=1, version=0))
+    session.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1))
+    return
 
 
 def populate_atlas(graph_list):
@@ -46,14 +232,13 @@ def populate_atlas(graph_list):
     -------
     None
     """
-    with session_scope() as session:
-        s1 = set([x[0] for x in session.query(AtlasDB.name).all()])  # graph names of Atlas objects already in db.
-    s2 = set([x.name for x in graph_list])
-    to_add = s2 - s1  # only want to add g in graph_list if not in Atlas already.
-    atlas_dbs = [AtlasDB(name=g.name, nodes=g.number_of_nodes(), edges=g.number_of_edges())
-                 for g in filter(lambda x: x.name in to_add, graph_list)]
-    with session_scope() as session:
-        session.add_all(atlas_dbs)
+    rows = OrderedDict((g.name, dict(name=g.name, nodes=g.number_of_nodes(), edges=g.number_of_edges()))
+                       for g in graph_list)
+    if rows:
+        # graphs already in AtlasDB (by name) are skipped.
+        with session_scope() as session:
+            session.execute(InsertIgnore(AtlasDB.__table__), list(rows.values()))
+    dimension_cache.invalidate()
     return
 
 
@@ -67,15 +252,21 @@ def populate_cutoff():
     """
     scuts = [7.0, 7.5, 8.0, 8.5, 9.0]
     kcuts = list(range(4))
+    rows = [dict(kcut=kcut, scut=scut) for kcut, scut in itertools.product(kcuts, scuts)]
     with session_scope() as session:
-        for kcut, scut in itertools.product(kcuts, scuts):
-            PopulateModel(CutoffDB, kcut=kcut, scut=scut).go(session)
+        session.execute(InsertIgnore(CutoffDB.__table__), rows)
+    dimension_cache.invalidate()
     return
 
 
 def add_graph_to_db(code, mmol, preferred, cc_num, name, kcut, scut, nodes, edges):
     """ Populates PdbDB, PdbeDB, AtlasDB (if necessary) and GraphDB with input data
 
+    Notes
+    -----
+    Each of the Pdb, Pdbe and Atlas rows is added with upsert_id, so this takes several statements per graph.
+    Use add_graphs_to_db to add many graphs.
+
     Parameters
     ----------
     code: str
@@ -101,18 +292,116 @@ def add_graph_to_db(code, mmol, preferred, cc_num, name, kcut, scut, nodes, edge
     -------
     None
     """
-    with session_scope() as session:
-        pdb = PopulateModel(model=PdbDB, pdb=code).go(session=session)
-        pdbe = PopulateModel(model=PdbeDB, pdb_id=pdb.id, preferred=preferred, mmol=mmol).go(
-            session=session)
-        cutoff = session.query(CutoffDB).filter(CutoffDB.scut == scut,
-                                                CutoffDB.kcut == kcut).one()
-        atlas = PopulateModel(AtlasDB, name=name, nodes=nodes, edges=edges).go(session)
-        PopulateModel(GraphDB, pdbe=pdbe, atlas=atlas, cutoff=cutoff, connected_component=cc_num).go(
-            session=session)
+    def add(session):
+        pdb_id = upsert_id(session, PdbDB.__table__, ['pdb'], pdb=code)
+        pdbe_id = upsert_id(session, PdbeDB.__table__, ['pdb_id', 'mmol'], pdb_id=pdb_id, mmol=mmol,
+                            preferred=preferred)
+        cutoff_id = dimension_cache.cutoff_id(session, scut=scut, kcut=kcut)
+        atlas_id = dimension_cache.atlas_ids(session).get(name)
+        if atlas_id is None:
+            atlas_id = upsert_id(session, AtlasDB.__table__, ['name'], name=name, nodes=nodes, edges=edges)
+            dimension_cache.invalidate()
+        session.execute(InsertIgnore(GraphDB.__table__).values(pdbe_id=pdbe_id, atlas_id=atlas_id,
+                                                               cutoff_id=cutoff_id, connected_component=cc_num))
+        bump_data_version(session)
+    _retry_with_fresh_dimensions(add)
+    return
+
+
+def add_graphs_to_db(graph_dicts):
+    """ Populates PdbDB, PdbeDB, AtlasDB (if necessary) and GraphDB with many graphs in one transaction.
+
+    Notes
+    -----
+    Set-based equivalent of calling add_graph_to_db(**d) for each d in graph_dicts.
+    The Pdb and Pdbe rows are inserted (skipping those already present) with one executemany per table and their ids
+    read back with one query per batch of keys, Atlas and Cutoff ids come from dimension_cache, and all GraphDB rows
+    are inserted with a single executemany that skips graphs already in the database. Safe to run concurrently with
+    other processes adding graphs of the same codes. If the insert fails because a cached id is stale, the whole
+    transaction is run again with the ids reloaded.
+
+    Parameters
+    ----------
+    graph_dicts: list(dict)
+        Each dict has the keyword arguments of add_graph_to_db.
+
+    Returns
+    -------
+    None
+    """
+    if not graph_dicts:
+        return
+    def add(session):
+        pdb_ids = _upsert_ids(
+            session, table=PdbDB.__table__, key_columns=['pdb'],
+            rows={(d['code'],): dict(pdb=d['code']) for d in graph_dicts})
+        pdbe_ids = _upsert_ids(
+            session, table=PdbeDB.__table__, key_columns=['pdb_id', 'mmol'],
+            rows={(pdb_ids[(d['code'],)], d['mmol']): dict(pdb_id=pdb_ids[(d['code'],)], mmol=d['mmol'],
+                                                          preferred=d['preferred'])
+                  for d in graph_dicts})
+        atlas_ids = dict(dimension_cache.atlas_ids(session))
+        new_atlas_rows = {(d['name'],): dict(name=d['name'], nodes=d['nodes'], edges=d['edges'])
+                          for d in graph_dicts if d['name'] not in atlas_ids}
+        if new_atlas_rows:
+            new_atlas_ids = _upsert_ids(session, table=AtlasDB.__table__, key_columns=['name'], rows=new_atlas_rows)
+            atlas_ids.update((k[0], i) for k, i in new_atlas_ids.items())
+            dimension_cache.invalidate()
+        graph_keys = [(pdbe_ids[(pdb_ids[(d['code'],)], d['mmol'])], atlas_ids[d['name']],
+                       dimension_cache.cutoff_id(session, scut=d['scut'], kcut=d['kcut']), d['cc_num'])
+                      for d in graph_dicts]
+        graph_rows = [dict(pdbe_id=k[0], atlas_id=k[1], cutoff_id=k[2], connected_component=k[3])
+                      for k in OrderedDict.fromkeys(graph_keys)]
+        session.execute(InsertIgnore(GraphDB.__table__), graph_rows)
+        bump_data_version(session)
+    _retry_with_fresh_dimensions(add)
     return
 
 
+# SQLite allows at most 999 bound parameters per statement.
+_batch_size = 400
+
+
+def _select_ids(session, table, key_columns, keys):
+    """ {key: id} for the rows of table whose key_columns values are in keys """
+    ids = {}
+    columns = [table.c[x] for x in key_columns]
+    keys = list(keys)
+    for i in range(0, len(keys), _batch_size):
+        batch = keys[i:i + _batch_size]
+        # tuple IN is not supported by SQLite, so candidates are selected on the first column and filtered here.
+        condition = columns[0].in_(set(k[0] for k in batch))
+        q = session.execute(sqlalchemy.select([table.c.id] + columns).where(condition))
+        wanted = set(batch)
+        for row in q:
+            key = tuple(row[1:])
+            if key in wanted:
+                ids[key] = row[0]
+    return ids
+
+
+def _upsert_ids(session, table, key_columns, rows):
+    """ Set-based upsert_id.
+
+    Parameters
+    ----------
+    session : session
+        An sqlalchemy session.
+    table : sqlalchemy.Table
+    key_columns : list(str)
+        Names of the columns of the unique key of table (see unique_key).
+    rows : dict
+        Maps each key (tuple of key_columns values) to the row to insert if the key is not yet in table.
+
+    Returns
+    -------
+    ids : dict
+        Maps each key in rows to the id of its row in table.
+    """
+    session.execute(InsertIgnore(table), list(rows.values()))
+    return _select_ids(session, table=table, key_columns=key_columns, keys=rows.keys())
+
+
 def remove_pdb_code(code):
     """ Remove all data associated with the given PDB accession code.
 
@@ -131,51 +420,64 @@ def remove_pdb_code(code):
         p = q.one_or_none()
         if p is not None:
             session.delete(p)
+            bump_data_version(session)
     return
 
 
-def get_or_create(model, session, **kwargs):
-    """Uses kwargs to get instance of model. If can't get that instance from session, add it to session.
+def remove_pdb_codes(codes):
+    """ Remove all data associated with each of the given PDB accession codes, in one transaction.
 
     Notes
     -----
-    This is an analogue to the Django function get_or_create, written for sqlalchemy.
-    Implements sqlalchemy query function one_or_none(). See:
-        http://docs.sqlalchemy.org/en/latest/orm/query.html#sqlalchemy.orm.query.Query.one_or_none
-    Code adapted from a response to a question on Stack Overflow:
-        http://stackoverflow.com/questions/2546207/does-sqlalchemy-have-an-equivalent-of-djangos-get-or-create
-    Posted by stackoverflow.com user Wolph:
-        http://stackoverflow.com/users/54017/wolph
+    Set-based equivalent of calling remove_pdb_code for each code: one DELETE per batch of codes, with the PdbeDB and
+    GraphDB rows removed by the ON DELETE CASCADE of their foreign keys.
 
     Parameters
     ----------
-    session : session
-        An sqlalchemy session.
-    model : Base
-        An sqlalchemy table.
-    kwargs : dict or specified keyword=value pairs
-        key/value pairs used to instantiate the model.
+    codes: list(str)
+        4-letter PDB accession codes
 
     Returns
     -------
-    2-tuple:
-        First element of tuple is instance of model instantiated by **kwargs
-        Second element of tuple is bool:
-            True if instance has been added to session.
-            False is instance was already present.
-
-    Raises
-    ------
-    sqlalchemy.orm.exc.MultipleResultsFound
-        If query selects multiple objects.
+    n_removed: int
+        Number of codes that were in the database.
     """
-    instance = session.query(model).filter_by(**kwargs).one_or_none()
-    if instance:
-        return instance, False
-    else:
-        params = dict((k, v) for k, v in kwargs.items() if not isinstance(v, sqlalchemy.sql.expression.ClauseElement))
-        instance = model(**params)
-        session.add(instance)
-        # Need this step to retrieve automatically populated columns, i.e., the assigned id
-        instance = session.query(model).filter_by(**kwargs).one()
-        return instance, True
+    codes = list(set(codes))
+    table = PdbDB.__table__
+    n_removed = 0
+    with session_scope() as session:
+        for i in range(0, len(codes), _batch_size):
+            result = session.execute(table.delete().where(table.c.pdb.in_(codes[i:i + _batch_size])))
+            n_removed += result.rowcount
+        if n_removed:
+            bump_data_version(session)
+    return n_removed
+
+
+def set_pdb_revisions(revisions):
+    """ Record the source file checksum and revision date of each code, adding codes not yet in PdbDB.
+
+    Notes
+    -----
+    Codes are added even if no graphs were found in them, so that they are known to be up to date.
+
+    Parameters
+    ----------
+    revisions: dict
+        Maps 4-letter PDB accession codes to (checksum, revision_date) pairs.
+
+    Returns
+    -------
+    None
+    """
+    if not revisions:
+        return
+    table = PdbDB.__table__
+    with session_scope() as session:
+        session.execute(InsertIgnore(table), [dict(pdb=code) for code in revisions])
+        session.execute(table.update().where(table.c.pdb == sqlalchemy.bindparam('code')).values(
+            checksum=sqlalchemy.bindparam('checksum'), revision_date=sqlalchemy.bindparam('revision_date')),
+            [dict(code=code, checksum=checksum, revision_date=revision_date)
+             for code, (checksum, revision_date) in revisions.items()])
+        bump_data_version(session)
+    return
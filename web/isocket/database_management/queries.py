@@ -0,0 +1,103 @@
+""" Aggregate queries over the graph tables, for the atlas API. """
+import re
+
+import sqlalchemy
+from sqlalchemy import func
+
+from isocket.database_management.models import GraphDB, PdbDB, PdbeDB, AtlasDB, DataVersionDB
+
+_pdb_code = re.compile('^[0-9a-z]{4}$')
+
+
+def data_version(session):
+    """ Token that changes whenever graphs or structures are added to or removed from the database.
+
+    Notes
+    -----
+    The version in DataVersionDB, which is incremented by every write to the graph and pdb tables (see
+    populate_models.bump_data_version). Reading it is a primary key lookup, so it is cheap enough to check on every
+    request.
+    """
+    table = DataVersionDB.__table__
+    version = session.execute(sqlalchemy.select([table.c.version]).where(table.c.id == 1)).scalar()
+    return str(version or 0)
+
+
+def graph_counts(cutoff_id, preferred=None, codes=None):
+    """ Select of (atlas_id, graphs, structures) per atlas graph at cutoff_id.
+
+    Parameters
+    ----------
+    cutoff_id: int
+    preferred: bool or None
+        If not None, only count graphs from PdbeDB entries whose preferred flag has this value.
+    codes: list(str) or None
+        If not None, only count graphs from these PDB codes.
+
+    Raises
+    ------
+    ValueError
+        If any of codes is not a lower case 4-character PDB code.
+    """
+    graph, pdbe, pdb = GraphDB.__table__, PdbeDB.__table__, PdbDB.__table__
+    joined = graph.join(pdbe, graph.c.pdbe_id == pdbe.c.id)
+    conditions = [graph.c.cutoff_id == cutoff_id]
+    if preferred is not None:
+        conditions.append(pdbe.c.preferred == preferred)
+    if codes is not None:
+        joined = joined.join(pdb, pdbe.c.pdb_id == pdb.c.id)
+        codes = sorted(set(codes))
+        if not all(_pdb_code.match(c) for c in codes):
+            raise ValueError('PDB codes must be 4 lower case letters or digits.')
+        # The validated codes are inlined, since a code set can be larger than the number of bound parameters
+        # SQLite allows in one statement.
+        conditions.append(pdb.c.pdb.in_([sqlalchemy.literal_column("'{}'".format(c)) for c in codes]))
+    return sqlalchemy.select([graph.c.atlas_id,
+                              func.count(graph.c.id).label('graphs'),
+                              func.count(sqlalchemy.distinct(pdbe.c.pdb_id)).label('structures')]).select_from(
+        joined).where(sqlalchemy.and_(*conditions)).group_by(graph.c.atlas_id)
+
+
+def graph_frequencies(session, cutoff_id, preferred=None, codes=None, name=None, page=1, per_page=50):
+    """ Number of graphs and of distinct PDB codes with each atlas graph at a cutoff, most frequent first.
+
+    Parameters
+    ----------
+    session : session
+        An sqlalchemy session.
+    cutoff_id: int
+        Id of the CutoffDB row.
+    preferred: bool or None
+        If not None, only count graphs from PdbeDB entries whose preferred flag has this value.
+    codes: list(str) or None
+        If not None, only count graphs from these PDB codes.
+    name: str or None
+        If not None, only return the frequency of the atlas graph with this name.
+    page: int
+        1-based page number.
+    per_page: int
+        Number of graphs per page.
+
+    Returns
+    -------
+    total: int
+        Number of atlas graphs found at least once.
+    frequencies: list(dict)
+        name, nodes, edges, graphs (count of GraphDB rows) and structures (count of distinct PDB codes) of each atlas
+        graph on the page.
+
+    Raises
+    ------
+    ValueError
+        If any of codes is not a lower case 4-character PDB code.
+    """
+    counts = graph_counts(cutoff_id=cutoff_id, preferred=preferred, codes=codes).alias('counts')
+    atlas = AtlasDB.__table__
+    q = sqlalchemy.select([atlas.c.name, atlas.c.nodes, atlas.c.edges, counts.c.graphs, counts.c.structures]).select_from(
+        counts.join(atlas, counts.c.atlas_id == atlas.c.id))
+    if name is not None:
+        q = q.where(atlas.c.name == name)
+    total = session.execute(sqlalchemy.select([func.count()]).select_from(q.alias('q'))).scalar()
+    q = q.order_by(counts.c.graphs.desc(), atlas.c.name).limit(per_page).offset((page - 1) * per_page)
+    frequencies = [dict(row) for row in session.execute(q)]
+    return total, frequencies
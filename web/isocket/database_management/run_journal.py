@@ -0,0 +1,152 @@
+""" Journal of the progress of a database update, so that an interrupted or failed run can be resumed.
+
+The journal is a local SQLite file with one row per PDB code, recording how far its latest attempt got:
+    parsed: the structure was fetched and parsed (both happen in StructureHandler.from_code);
+    graphed: its knob graphs were found;
+    inserted: its graphs were written to the database - the code is done;
+and, if the attempt failed, the error, the number of failed attempts and the time after which it may be retried.
+A run with the journal (see UpdateCodes.run_update) skips codes that are done, and failed codes until their retry
+time, which doubles with each failed attempt.
+"""
+import os
+import sqlite3
+import time
+from collections import Counter
+
+PARSED = 'parsed'
+GRAPHED = 'graphed'
+INSERTED = 'inserted'
+FAILED = 'failed'
+
+_schema = '''CREATE TABLE IF NOT EXISTS codes (
+    code TEXT PRIMARY KEY,
+    status TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    retry_after REAL NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+)'''
+
+
+class RunJournal:
+    """ Per-code progress of database updates, stored in a SQLite file.
+
+    Parameters
+    ----------
+    filename: str
+        Path of the journal file, created if it does not exist.
+    backoff: float
+        Seconds to wait before retrying a code after its first failure. Doubles after each further failure.
+    max_backoff: float
+        Longest wait between retries.
+    max_attempts: int or None
+        Codes that have failed this many times are no longer retried. If None, they are always retried.
+    """
+    def __init__(self, filename, backoff=3600, max_backoff=7 * 24 * 3600, max_attempts=5):
+        self.filename = filename
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        # autocommit: each record is written as soon as it is made, so it survives the process being killed.
+        # The journal may be handed to another thread (e.g. the writer of UpdatePipeline), but is only ever used by
+        # one thread at a time.
+        self._conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self._conn.execute(_schema)
+
+    def __repr__(self):
+        return '<RunJournal(filename={0}, {1})>'.format(self.filename, dict(self.summary()))
+
+    def close(self):
+        self._conn.close()
+        return
+
+    def record(self, code, status):
+        """ Record that code has reached status (PARSED, GRAPHED or INSERTED) in its current attempt. """
+        self._conn.execute('INSERT OR IGNORE INTO codes (code, updated) VALUES (?, ?)', (code, time.time()))
+        self._conn.execute('UPDATE codes SET status = ?, error = NULL, updated = ? WHERE code = ?',
+                           (status, time.time(), code))
+        return
+
+    def record_many(self, codes, status):
+        """ record(code, status) for each of codes, in one transaction. """
+        now = time.time()
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('INSERT OR IGNORE INTO codes (code, updated) VALUES (?, ?)',
+                                   [(code, now) for code in codes])
+            self._conn.executemany('UPDATE codes SET status = ?, error = NULL, updated = ? WHERE code = ?',
+                                   [(status, now, code) for code in codes])
+        return
+
+    def record_failure(self, code, error, status=None):
+        """ Record that the current attempt at code failed with error, after reaching status (None if no stage was
+        completed), and schedule its next attempt.
+        """
+        now = time.time()
+        self._conn.execute('INSERT OR IGNORE INTO codes (code, updated) VALUES (?, ?)', (code, now))
+        attempts = self._conn.execute('SELECT attempts FROM codes WHERE code = ?', (code,)).fetchone()[0] + 1
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        self._conn.execute('UPDATE codes SET status = ?, error = ?, attempts = ?, retry_after = ?, updated = ? '
+                           'WHERE code = ?', (status, error, attempts, now + delay, now, code))
+        return
+
+    def reopen(self, codes):
+        """ Mark those of codes that are done as pending again, e.g. because their source files have been revised. """
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('DELETE FROM codes WHERE code = ? AND status = ? AND error IS NULL',
+                                   [(code, INSERTED) for code in codes])
+        return
+
+    def state(self, code):
+        """ dict of the journal row of code (status, error, attempts, retry_after, updated), or None. """
+        cursor = self._conn.execute('SELECT status, error, attempts, retry_after, updated FROM codes WHERE code = ?',
+                                    (code,))
+        row = cursor.fetchone()
+        if row is None:
+            return
+        return dict(zip(['status', 'error', 'attempts', 'retry_after', 'updated'], row))
+
+    def pending(self, codes, limit=None, now=None):
+        """ The codes that still need to be processed, in the order of codes.
+
+        Parameters
+        ----------
+        codes: list(str)
+        limit: int or None
+            If given, return at most this many codes.
+        now: float or None
+            Time (as from time.time()) against which retry times are compared. Defaults to the current time.
+
+        Returns
+        -------
+        codes: list(str)
+            Codes that are not in the journal, that did not finish their last attempt, or that failed and are due to
+            be retried. Codes that are done, or that have failed max_attempts times, are left out.
+        """
+        now = time.time() if now is None else now
+        skip = set()
+        for code, status, error, attempts, retry_after in self._conn.execute(
+                'SELECT code, status, error, attempts, retry_after FROM codes'):
+            if error is None:
+                if status == INSERTED:
+                    skip.add(code)
+            elif retry_after > now or (self.max_attempts is not None and attempts >= self.max_attempts):
+                skip.add(code)
+        pending = [code for code in codes if code not in skip]
+        return pending if limit is None else pending[:limit]
+
+    def summary(self):
+        """ Counter of the number of codes that are done (INSERTED), FAILED, or part-way (PARSED or GRAPHED). """
+        counts = Counter()
+        for status, error, n in self._conn.execute(
+                'SELECT status, error IS NOT NULL, COUNT(*) FROM codes GROUP BY status, error IS NOT NULL'):
+            counts[FAILED if error else status] += n
+        return counts
+
+    def failures(self):
+        """ List of (code, status reached, error, attempts) of the codes whose last attempt failed. """
+        return self._conn.execute('SELECT code, status, error, attempts FROM codes WHERE error IS NOT NULL '
+                                  'ORDER BY code').fetchall()
@@ -1,18 +1,27 @@
+import itertools
 import pickle
-from collections import Counter
+from collections import Counter, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import networkx
 
 from isocket.graph_theory import AtlasHandler, isomorphism_checker, graph_to_plain_graph
-from isocket.structure_handler import StructureHandler
+from isocket.name_cache import name_cache
+from isocket.structure_handler import StructureHandler, name_knob_graphs
+from isocket.structure_sources import prefetched
 
-from isocket.database_management.populate_models import populate_atlas, add_graph_to_db
+from isocket.database_management.populate_models import populate_atlas, add_graphs_to_db, set_pdb_revisions
+from isocket.database_management.run_journal import PARSED, GRAPHED, INSERTED
 from isocket_settings import global_settings
 
 
 class UpdateCodes:
     """ Class for updating database with data associated with list of PDB accession codes """
-    def __init__(self, codes=None, store_files=False):
+    def __init__(self, codes=None, store_files=False, source=None):
         self.store_files = store_files
         self.codes = codes
+        self.source = source
 
     def __repr__(self):
         if len(self.codes) <= 3:
@@ -22,40 +31,329 @@ class UpdateCodes:
         return '<UpdateCodes({})>'.format(codes_repr)
 
 
+    def iter_structure_handlers(self):
+        """ Yields a StructureHandler for the preferred biological unit (mmol) of each code in turn """
+        for code in self.codes:
+            yield StructureHandler.from_code(code=code, store_files=self.store_files, source=self.source)
+
     @property
     def structure_handlers(self):
         """ StructureHandler instances for preferred biological unit (mmol) for each code """
-        return [StructureHandler.from_code(code=code, store_files=self.store_files) for code in self.codes]
+        return list(self.iter_structure_handlers())
+
+    def iter_knob_graphs(self, workers=None):
+        """ Yields the list of named knob graphs for each code in turn.
+
+        Notes
+        -----
+        Each structure is parsed, swept for graphs and discarded before the next one is parsed, so only the graphs of
+        the codes that have not been consumed yet are held in memory. Codes that fail contribute an empty list.
+
+        Parameters
+        ----------
+        workers: int or None
+            If given, structures are fetched, parsed and swept in a pool of this many worker processes.
+            Workers return compact graph records, which are rebuilt and named in this process.
+            Up to 4 * workers codes are submitted to the pool at a time, and a new code is submitted as soon as any
+            of them completes, so one slow structure does not leave the other workers idle. Results are yielded in
+            the order of self.codes. If a worker dies, the pool is replaced and only the code it was parsing fails.
+        """
+        for attempt in iter_attempts(codes=self.codes, workers=workers, store_files=self.store_files,
+                                     source=self.source):
+            yield attempt.knob_graphs
 
     @property
     def knob_graphs(self):
         """ Concatenates all knob_graphs associates with each code into one list """
-        all_kgs = []
-        for sh in self.structure_handlers:
-            try:
-                kgs = sh.get_knob_graphs(min_scut=7.0, max_scut=9.0, scut_increment=0.5)
-                for x in kgs:
-                    all_kgs.append(x)
-            except:
+        return list(itertools.chain.from_iterable(self.iter_knob_graphs()))
+
+    def parallel_knob_graphs(self, workers):
+        """ As knob_graphs, with structures processed in a pool of worker processes (see iter_knob_graphs). """
+        return list(itertools.chain.from_iterable(self.iter_knob_graphs(workers=workers)))
+
+    def run_update(self, mode=None, workers=None, chunk_size=100, journal=None, limit=None, revisions=None,
+                   name_cache_file=None):
+        """ Gets name for each knob graph and then adds them to the database, chunk_size codes at a time.
+
+        Parameters
+        ----------
+        mode: str or None
+            Allowed values: 'production' or 'testing'. Needed if new unknown graphs are found.
+        workers: int or None
+            If given, structures are processed in a pool of this many worker processes (see iter_knob_graphs).
+        chunk_size: int
+            Number of codes whose graphs are named and written to the database together.
+            Memory use depends on chunk_size, not on the number of codes.
+        journal: RunJournal or None
+            If given, the progress of each code is recorded in journal, and codes that it shows are done (or failed
+            and not yet due for a retry) are skipped. An interrupted run resumes where it stopped when run again
+            with the same journal.
+        limit: int or None
+            If given with journal, process at most this many of the pending codes, so that a long update can be
+            spread over several runs.
+        revisions: dict or None
+            If given, maps codes to the (checksum, revision_date) of their source files, which are stored in PdbDB
+            for each code that is processed successfully (see populate_models.set_pdb_revisions).
+        name_cache_file: str or None
+            If given, the names of atlas graphs are loaded from this file before the update and saved to it afterwards
+            (see NameCache.persisted), so later runs start with the names found by earlier ones.
+
+        Returns
+        -------
+        None
+        """
+        codes = self.codes if journal is None else journal.pending(self.codes, limit=limit)
+        with name_cache.persisted(name_cache_file):
+            for attempts in chunks(iter_attempts(codes=codes, workers=workers, store_files=self.store_files,
+                                                 source=self.source), size=chunk_size):
+                write_attempts(attempts, mode=mode, journal=journal, revisions=revisions)
+        return
+
+
+Attempt = namedtuple('Attempt', ['code', 'knob_graphs', 'status', 'error'])
+
+
+def write_attempts(attempts, mode=None, journal=None, revisions=None):
+    """ Add the named knob graphs of attempts to the database, recording the outcome of each code in journal.
+
+    Parameters
+    ----------
+    attempts: list(Attempt)
+    mode, journal, revisions: see UpdateCodes.run_update
+
+    Returns
+    -------
+    None
+    """
+    kgs = list(itertools.chain.from_iterable(x.knob_graphs for x in attempts))
+    graphed = [x.code for x in attempts if x.error is None]
+    if journal is not None:
+        for x in attempts:
+            if x.error is None:
+                journal.record(x.code, GRAPHED)
+            else:
+                journal.record_failure(x.code, error=x.error, status=x.status)
+    try:
+        update_knob_graphs(knob_graphs=kgs, mode=mode)
+        if revisions is not None:
+            set_pdb_revisions({code: revisions[code] for code in graphed if code in revisions})
+    except Exception as e:
+        if journal is not None:
+            for code in graphed:
+                journal.record_failure(code, error=_error_message(e), status=GRAPHED)
+        raise
+    if journal is not None:
+        journal.record_many(graphed, INSERTED)
+    return
+
+
+def iter_attempts(codes, workers=None, store_files=False, source=None):
+    """ Yields an Attempt (code, named knob graphs, last stage completed, error) for each of codes in turn.
+
+    Notes
+    -----
+    See UpdateCodes.iter_knob_graphs. status and error are as returned by code_knob_graphs_attempt.
+    If source is a MirrorSource, codes are fetched into it by a pool of threads ahead of being parsed
+    (see structure_sources.prefetched).
+    """
+    codes = prefetched(codes, source=source)
+    if workers is None:
+        for code in codes:
+            kgs, status, error = code_knob_graphs_attempt(code=code, store_files=store_files, source=source)
+            name_knob_graphs(kgs)
+            yield Attempt(code=code, knob_graphs=kgs, status=status, error=error)
+        return
+    codes = iter(codes)
+    window = 4 * workers
+    # [code, future] in the order of codes; the head is yielded once it is done.
+    outstanding = deque()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            running = [f for _, f in outstanding if not f.done()]
+            # keep window codes running, and stop submitting if a slow head has let 4 * window results pile up.
+            while len(running) < window and len(outstanding) < 4 * window:
+                code = next(codes, None)
+                if code is None:
+                    break
+                try:
+                    future = executor.submit(knob_graph_records, code=code, store_files=store_files, source=source)
+                except BrokenProcessPool as e:
+                    future = Future()
+                    future.set_exception(e)
+                outstanding.append([code, future])
+                running.append(future)
+            if not outstanding:
+                return
+            if any(_broken(f) for _, f in outstanding):
+                executor = _replace_broken_pool(executor, outstanding, workers=workers, store_files=store_files,
+                                                source=source)
+                continue
+            code, future = outstanding[0]
+            if not future.done():
+                wait(running, return_when=FIRST_COMPLETED)
                 continue
-        return all_kgs
+            outstanding.popleft()
+            try:
+                records, status, error = future.result()
+            except Exception as e:
+                # the result of the worker could not be returned.
+                records, status, error = [], None, _error_message(e)
+            kgs = [record_to_graph(record) for record in records]
+            name_knob_graphs(kgs)
+            yield Attempt(code=code, knob_graphs=kgs, status=status, error=error)
+    finally:
+        executor.shutdown()
+
+
+def _broken(future):
+    """ True if future failed because its process pool broke, e.g. when a worker was killed """
+    return future.done() and isinstance(future.exception(), BrokenProcessPool)
+
+
+def _replace_broken_pool(executor, outstanding, workers, store_files=False, source=None):
+    """ A new pool in place of the broken executor, with the codes of outstanding that it failed run again.
+
+    Notes
+    -----
+    A worker that dies (e.g. segfaults or is killed for using too much memory) breaks its pool, and every code that
+    was running or queued in it fails with BrokenProcessPool. Each of those is run again in a process of its own
+    (see isolated_records), so only the code that killed its worker fails. The futures in outstanding are replaced
+    by the results.
+    """
+    executor.shutdown()
+    wait([f for _, f in outstanding])
+    suspects = [entry for entry in outstanding if _broken(entry[1])]
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        results = list(threads.map(lambda code: isolated_records(knob_graph_records, code=code, store_files=store_files,
+                                                                  source=source), [code for code, _ in suspects]))
+    for entry, result in zip(suspects, results):
+        entry[1] = Future()
+        entry[1].set_result(result)
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def isolated_records(fn, *args, **kwargs):
+    """ fn(*args, **kwargs), returning (records, status, error), run in a worker process of its own.
+
+    If the worker dies, the error is the BrokenProcessPool it causes, and no other call is affected.
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(fn, *args, **kwargs).result()
+        except BrokenProcessPool as e:
+            return [], None, _error_message(e)
+
 
-    def run_update(self, mode=None):
-        """ Gets name for each knob graph and then adds them all to the database """
-        kgs = self.knob_graphs
-        # is not all named, then need to turn to list of larger graphs.
+def chunks(iterable, size):
+    """ Yields lists of up to size consecutive items of iterable """
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def update_knob_graphs(knob_graphs, mode=None):
+    """ Names knob graphs that are not in the atlas against the unknown graphs (adding new ones), then adds them all
+    to the database.
+
+    Parameters
+    ----------
+    knob_graphs: list(networkx.Graph)
+    mode: str or None
+        Allowed values: 'production' or 'testing'. Needed if new unknown graphs are found.
+
+    Returns
+    -------
+    None
+    """
+    kgs = knob_graphs
+    # is not all named, then need to turn to list of larger graphs.
+    if not all_graphs_named(knob_graphs=kgs):
+        # Get names from list of larger graphs
+        name_against_unknowns(knob_graphs=kgs)
+        # If still not named, add graphs to list of larger graphs, and write to the file.
         if not all_graphs_named(knob_graphs=kgs):
-            # Get names from list of larger graphs
-            name_against_unknowns(knob_graphs=kgs)
-            # If still not named, add graphs to list of larger graphs, and write to the file.
-            if not all_graphs_named(knob_graphs=kgs):
-                if mode is None:
-                    allowed_modes = ['production', 'testing']
-                    raise ValueError('Please provide running mode for adding new unknown_graphs.'
-                                     ' Currently allowed values are {}'.format(allowed_modes))
-                add_unknowns(knob_graphs=kgs, mode=mode)
-        add_knob_graphs_to_db(knob_graphs=kgs)
-        return
+            if mode is None:
+                allowed_modes = ['production', 'testing']
+                raise ValueError('Please provide running mode for adding new unknown_graphs.'
+                                 ' Currently allowed values are {}'.format(allowed_modes))
+            add_unknowns(knob_graphs=kgs, mode=mode)
+    add_knob_graphs_to_db(knob_graphs=kgs)
+    return
+
+
+def code_knob_graphs(code, store_files=False, source=None):
+    """ Unnamed knob graphs for the preferred biological unit of code.
+
+    Notes
+    -----
+    Any failure (fetching, parsing or finding the graphs) results in no graphs.
+    The parsed assembly is released when this function returns.
+
+    Parameters
+    ----------
+    code: str
+        4-letter PDB accession code
+    store_files: bool
+        See StructureHandler.from_code
+    source: structure source or None
+        See StructureHandler.from_code
+
+    Returns
+    -------
+    knob_graphs: list(networkx.Graph)
+    """
+    return code_knob_graphs_attempt(code=code, store_files=store_files, source=source)[0]
+
+
+def code_knob_graphs_attempt(code, store_files=False, source=None):
+    """ As code_knob_graphs, also reporting how far it got and why it failed.
+
+    Returns
+    -------
+    knob_graphs: list(networkx.Graph)
+        Empty if any stage failed.
+    status: str or None
+        Last stage completed: run_journal.PARSED, run_journal.GRAPHED, or None if the structure was not parsed.
+    error: str or None
+        Type and message of the exception that stopped processing, or None if all stages succeeded.
+    """
+    status = None
+    try:
+        sh = StructureHandler.from_code(code=code, store_files=store_files, source=source)
+        status = PARSED
+        kgs = sh.get_knob_graphs(min_scut=7.0, max_scut=9.0, scut_increment=0.5, name_graphs=False)
+        return kgs, GRAPHED, None
+    except Exception as e:
+        return [], status, _error_message(e)
+
+
+def _error_message(e):
+    return '{0}: {1}'.format(type(e).__name__, e)
+
+
+def knob_graph_records(code, store_files=False, source=None):
+    """ code_knob_graphs_attempt with the graphs as compact records (see graph_to_record), for returning from worker
+    processes.
+    """
+    kgs, status, error = code_knob_graphs_attempt(code=code, store_files=store_files, source=source)
+    return [graph_to_record(g) for g in kgs], status, error
+
+
+def graph_to_record(g):
+    """ Plain-data form of a knob graph: its nodes, edges and g.graph dictionary. """
+    return dict(nodes=list(g.nodes()), edges=list(g.edges()), graph=dict(g.graph))
+
+
+def record_to_graph(record):
+    """ Rebuild the knob graph from graph_to_record(g). """
+    g = networkx.Graph()
+    g.add_nodes_from(record['nodes'])
+    g.add_edges_from(record['edges'])
+    g.graph.update(record['graph'])
+    return g
 
 
 def all_graphs_named(knob_graphs):
@@ -112,7 +410,7 @@ def name_against_unknowns(knob_graphs):
     large_graph_list = AtlasHandler().get_graph_list(atlas=False, cyclics=False, paths=False, unknowns=True)
     for g in knob_graphs:
         if g.graph['name'] is None:
-            name = isomorphism_checker(g, graph_list=large_graph_list)
+            name = name_cache.name(g, graph_list=large_graph_list, namespace='unknowns')
             if name is not None:
                 g.graph['name'] = name
     return
@@ -150,6 +448,8 @@ def add_unknowns(knob_graphs, mode):
     with open(unknown_pickle, 'wb') as foo:
         pickle.dump(large_graph_list, foo)
     populate_atlas(graph_list=to_add_to_atlas)
+    # cached misses against the unknown graphs may now have names.
+    name_cache.clear(namespace='unknowns')
     return
 
 
@@ -165,6 +465,5 @@ def add_knob_graphs_to_db(knob_graphs):
     None
     """
     assert all_graph_dicts_valid(knob_graphs=knob_graphs)
-    for g in knob_graphs:
-        add_graph_to_db(**g.graph)
+    add_graphs_to_db(graph_dicts=[g.graph for g in knob_graphs])
     return
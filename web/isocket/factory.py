@@ -12,6 +12,9 @@ def create_app(config=None):
     # Database set up
     from isocket.extensions import db
     db.init_app(app)
+    from isocket.database_management.engine_profiles import configure_engine
+    with app.app_context():
+        configure_engine(db.engine, app.config)
     from isocket.extensions import assets
     assets.init_app(app)
     from isocket.extensions import migrate
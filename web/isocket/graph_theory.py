@@ -1,3 +1,5 @@
+import hashlib
+import os
 import pickle
 
 import networkx
@@ -8,8 +10,11 @@ from isocket_settings import global_settings
 
 
 class AtlasHandler:
-    def __init__(self, mode='production'):
+    def __init__(self, mode='production', artifact=None):
         self.mode = mode
+        if artifact is None:
+            artifact = global_settings.get("atlas_artifact", {}).get(mode)
+        self.artifact = artifact
         return
 
     @property
@@ -55,18 +60,131 @@ class AtlasHandler:
             graph_list += self.unknown_graphs
         return graph_list
 
+    def get_graph_index(self, atlas=True, cyclics=True, paths=False, unknowns=False, max_cyclics=100, max_paths=100):
+        """ AtlasIndex of the graphs that get_graph_list would return with the same arguments.
+
+        Notes
+        -----
+        Read from the memory-mapped atlas artifact (see isocket.atlas_artifact) if one has been built for this mode
+        and it holds the requested graphs. Otherwise the graphs are generated as in get_graph_list.
+        """
+        kwargs = dict(atlas=atlas, cyclics=cyclics, paths=paths, unknowns=unknowns,
+                      max_cyclics=max_cyclics, max_paths=max_paths)
+        if self.artifact is not None and os.path.exists(self.artifact):
+            from isocket.atlas_artifact import AtlasArtifact
+            try:
+                artifact = AtlasArtifact(self.artifact)
+                if not (unknowns and not artifact.unknowns_current(mode=self.mode)):
+                    return artifact.get_graph_index(**kwargs)
+            except ValueError:
+                pass
+        return AtlasIndex(self.get_graph_list(**kwargs))
+
 
 def graph_to_plain_graph(g):
     """ Convert complex (MultiDiGraph) into Graph, with integer nodes and tuple edges """
     # construct h fully in case of unorderable/unsortable edges.
     h = networkx.Graph()
-    h.add_nodes_from(range(len(g.nodes())))
-    edges = [(g.nodes().index(e1), g.nodes().index(e2)) for e1, e2 in g.edges()]
-    h.add_edges_from(edges)
+    # nodes are numbered by their position in g.nodes(), looked up in a dict rather than with list.index.
+    index = {n: i for i, n in enumerate(g.nodes())}
+    h.add_nodes_from(range(len(index)))
+    h.add_edges_from((index[e1], index[e2]) for e1, e2 in g.edges())
     h.graph['name'] = None
     return h
 
 
+def degree_sequence(g):
+    """ Degrees of the nodes of g, sorted in descending order. """
+    return tuple(sorted(dict(g.degree()).values(), reverse=True))
+
+
+def weisfeiler_lehman_hash(g, iterations=3):
+    """ Hash of the Weisfeiler-Lehman colour refinement of g.
+
+    Notes
+    -----
+    Isomorphic graphs always have the same hash. Non-isomorphic graphs usually, but not always, have different hashes.
+
+    Parameters
+    ----------
+    g : A networkx Graph.
+    iterations : int
+        Number of rounds of neighbourhood aggregation.
+
+    Returns
+    -------
+    wl_hash : str
+    """
+    labels = {n: str(len(g.adj[n])) for n in g.nodes()}
+    for _ in range(iterations):
+        labels = {n: hashlib.md5('{0}|{1}'.format(labels[n], ','.join(sorted(labels[m] for m in g.adj[n])))
+                                 .encode()).hexdigest()
+                  for n in g.nodes()}
+    return hashlib.md5(','.join(sorted(labels.values())).encode()).hexdigest()
+
+
+def graph_invariants(g):
+    """ Cheap isomorphism invariants of g: (node count, edge count, degree sequence, Weisfeiler-Lehman hash). """
+    return g.number_of_nodes(), g.number_of_edges(), degree_sequence(g), weisfeiler_lehman_hash(g)
+
+
+def _graph_name(isomorph, index):
+    iso_name = isomorph.name
+    if iso_name is None:
+        iso_name = str(index)
+    return iso_name
+
+
+class AtlasIndex:
+    """ Graphs from a graph_list bucketed by their isomorphism invariants.
+
+    Notes
+    -----
+    Isomorphic graphs share all of their invariants, so a graph can only be isomorphic to graphs in its own bucket.
+    Buckets preserve the order of the graph_list, so lookup returns the same name as a linear scan of the graph_list.
+
+    Parameters
+    ----------
+    graph_list :
+        A list of networkx.Graph objects against which to check for isomorphism.
+    invariants : list or None
+        Precomputed graph_invariants of each graph in graph_list, e.g. from an atlas artifact.
+        If None, they are computed from the graphs.
+    """
+    def __init__(self, graph_list, invariants=None):
+        self.graph_list = graph_list
+        if invariants is None:
+            invariants = [graph_invariants(x) for x in graph_list]
+        self.buckets = {}
+        for i, key in enumerate(invariants):
+            self.buckets.setdefault(key, []).append(i)
+
+    def __repr__(self):
+        return '<AtlasIndex(graphs={0}, buckets={1})>'.format(len(self), len(self.buckets))
+
+    def __len__(self):
+        return len(self.graph_list)
+
+    def lookup(self, h):
+        """ Name of the graph in the index that is isomorphic to the (plain) Graph h, or None if there is none. """
+        for i in self.buckets.get(graph_invariants(h), []):
+            isomorph = self.graph_list[i]
+            if networkx.is_isomorphic(h, isomorph):
+                return _graph_name(isomorph, i)
+        return
+
+
+_atlas_index = None
+
+
+def default_atlas_index():
+    """ AtlasIndex of graph_atlas_g(), built on first use. """
+    global _atlas_index
+    if _atlas_index is None:
+        _atlas_index = AtlasIndex(graph_atlas_g())
+    return _atlas_index
+
+
 def isomorphism_checker(g, graph_list=None):
     """ Finds the name of the graph by checking for isomorphism with the graphs in the graph_list.
 
@@ -79,8 +197,9 @@ def isomorphism_checker(g, graph_list=None):
     ----------
     g : A networkx Graph.
     graph_list :
-        A list of networkx.Graph objects against which to check for isomorphism.
+        A list of networkx.Graph objects, or an AtlasIndex, against which to check for isomorphism.
         If the graphs in the list do not have names, then their index will be returned as a string
+        If None, an AtlasIndex of graph_atlas_g() is used.
 
     Returns
     -------
@@ -91,17 +210,15 @@ def isomorphism_checker(g, graph_list=None):
 
     """
     if graph_list is None:
-        graph_list = graph_atlas_g()
+        graph_list = default_atlas_index()
     # run isomorphism check on the Graph of g (i.e. not the DiGraph or MultiGraph).
     h = graph_to_plain_graph(g)
-    isomorph = next(filter(lambda x: networkx.is_isomorphic(h, x), graph_list), None)
-    if isomorph is None:
-        return
-    else:
-        iso_name = isomorph.name
-        if iso_name is None:
-            iso_name = str(graph_list.index(isomorph))
-    return iso_name
+    if isinstance(graph_list, AtlasIndex):
+        return graph_list.lookup(h)
+    for i, x in enumerate(graph_list):
+        if networkx.is_isomorphic(h, x):
+            return _graph_name(x, i)
+    return
 
 
 def get_filtered_graph_list(atlas=True, cyclics=True, unknowns=False, paths=False, max_nodes=8,
@@ -0,0 +1,307 @@
+""" Background jobs for long-running analyses, so that web requests do not wait for them.
+
+Jobs are shared by all web processes through `folder`:
+    - the state of every job is a JSON file, so any web process can report on any job;
+    - submitted jobs are queued as files in folder/queue, and run oldest first by runner processes
+      (python -m isocket.jobs), one of which is started on each submission;
+    - a runner only runs jobs while it holds the lock of one of `workers` slot files in folder/slots, so at most
+      `workers` jobs run at once however many web processes there are. Locks are released by the OS when a runner
+      exits, however it exits;
+    - each job runs in a child process of its runner, and is terminated if it runs for longer than `timeout` seconds.
+A running job whose runner has died, or that has run for longer than its timeout allows, is reported as failed, as is a
+queued job not started within `expiry` seconds. The state files of jobs that ended more than `expiry` seconds ago are
+removed by the runners.
+"""
+import argparse
+import fcntl
+import importlib
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+# seconds a running job may outlive its timeout (while its runner stops it and writes its state) before it is
+# reported as interrupted.
+_grace = 30
+# folder from which isocket (and the modules of job functions) can be imported by runner processes.
+_import_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _call(conn, func, args):
+    """ Run func(*args) in a child process and send (success, result or error message) back through conn """
+    try:
+        conn.send((True, func(*args)))
+    except Exception as e:
+        conn.send((False, '{0}: {1}'.format(type(e).__name__, e)))
+    finally:
+        conn.close()
+
+
+def func_name(func):
+    """ 'module:name' of a module-level function, by which runner processes import it """
+    name = '{0}:{1}'.format(func.__module__, func.__qualname__)
+    if func.__module__ == '__main__' or not re.match(r'^\w+$', func.__qualname__):
+        raise ValueError('Jobs must be module-level functions, not {}.'.format(name))
+    return name
+
+
+def import_func(name):
+    """ The function named by func_name """
+    module, qualname = name.split(':')
+    return getattr(importlib.import_module(module), qualname)
+
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _write_json(path, data):
+    """ Write data to path atomically, so that readers never see a partly written file """
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False) as foo:
+        json.dump(data, foo)
+    os.replace(foo.name, path)
+    return
+
+
+class JobQueue:
+    """ Queue of jobs, shared through a folder, run in worker processes.
+
+    Parameters
+    ----------
+    folder: str
+        Directory in which the queue and the state of each job are stored.
+    workers: int
+        Maximum number of jobs run at the same time, by all JobQueues sharing folder.
+    timeout: float
+        Seconds after which a running job is terminated and marked as failed.
+    expiry: float
+        Seconds after which a job that has not started is marked as failed, and after which the state of a job that
+        has ended is removed.
+    """
+    def __init__(self, folder, workers=2, timeout=300, expiry=3600):
+        self.folder = folder
+        self.workers = workers
+        self.timeout = timeout
+        self.expiry = expiry
+        self._runners = []
+        os.makedirs(self._queue_folder, exist_ok=True)
+        os.makedirs(self._slot_folder, exist_ok=True)
+
+    def __repr__(self):
+        return '<JobQueue(folder={0}, workers={1}, timeout={2})>'.format(self.folder, self.workers, self.timeout)
+
+    @property
+    def _queue_folder(self):
+        return os.path.join(self.folder, 'queue')
+
+    @property
+    def _slot_folder(self):
+        return os.path.join(self.folder, 'slots')
+
+    def submit(self, func, *args):
+        """ Queue func(*args). func must be a module-level function, and its args and return value JSON-serialisable.
+        Returns the job id.
+        """
+        spec = dict(func=func_name(func), args=list(args), job_id=uuid.uuid4().hex)
+        submitted = time.time()
+        self._write(spec['job_id'], status=QUEUED, submitted=submitted)
+        # queue files are named so that they sort in order of submission.
+        _write_json(os.path.join(self._queue_folder, '{0:.6f}-{1}.json'.format(submitted, spec['job_id'])), spec)
+        self._start_runner()
+        return spec['job_id']
+
+    def status(self, job_id):
+        """ State of the job: dict with keys 'status', 'result' and 'error', or None if there is no such job.
+
+        Notes
+        -----
+        Jobs whose runner has died, or that have not started within expiry seconds, are marked as failed here.
+        """
+        if not re.match(r'^[0-9a-f]{32}$', job_id):
+            return
+        try:
+            with open(self._path(job_id), 'r') as foo:
+                state = json.load(foo)
+        except (FileNotFoundError, ValueError):
+            return
+        if state['status'] == RUNNING and not self._is_running(state):
+            state = self._write(job_id, status=FAILED, error='Job was interrupted before it finished.',
+                                submitted=state['submitted'])
+        elif state['status'] == QUEUED and time.time() - state['submitted'] > self.expiry:
+            state = self._write(job_id, status=FAILED, error='Job was not started within {} seconds.'.format(
+                self.expiry), submitted=state['submitted'])
+        return state
+
+    def wait(self, job_id, timeout, interval=0.1):
+        """ status(job_id), once the job has finished or failed or after timeout seconds """
+        end = time.time() + timeout
+        state = self.status(job_id)
+        while state is not None and state['status'] in (QUEUED, RUNNING) and time.time() < end:
+            time.sleep(interval)
+            state = self.status(job_id)
+        return state
+
+    def run_queued(self):
+        """ Run queued jobs, oldest first, for as long as there are any and a slot is free.
+
+        Returns
+        -------
+        n_jobs: int
+            Number of jobs run.
+        """
+        n_jobs = 0
+        while True:
+            slot = self._claim_slot()
+            if slot is None:
+                return n_jobs
+            try:
+                spec = self._claim_job()
+                while spec is not None:
+                    self._run(spec)
+                    n_jobs += 1
+                    spec = self._claim_job()
+            finally:
+                slot.close()
+            # a job queued after the last claim, whose own runner found no free slot, is picked up here.
+            if not self._queued():
+                return n_jobs
+
+    def clean(self):
+        """ Remove the state of jobs that finished or failed more than expiry seconds ago. """
+        now = time.time()
+        for filename in os.listdir(self.folder):
+            path = os.path.join(self.folder, filename)
+            if not re.match(r'^[0-9a-f]{32}\.json$', filename):
+                continue
+            try:
+                if now - os.path.getmtime(path) <= self.expiry:
+                    continue
+            except FileNotFoundError:
+                continue
+            state = self.status(os.path.splitext(filename)[0])
+            if state is not None and state['status'] in (FINISHED, FAILED):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, '{}.json'.format(job_id))
+
+    def _write(self, job_id, status, result=None, error=None, submitted=None, started=None, pid=None):
+        state = dict(status=status, result=result, error=error, submitted=submitted, started=started, pid=pid)
+        _write_json(self._path(job_id), state)
+        return state
+
+    def _is_running(self, state):
+        """ Whether the runner of a job in the RUNNING state is alive, and within the job's timeout """
+        return _pid_exists(state['pid']) and time.time() - state['started'] <= self.timeout + _grace
+
+    def _start_runner(self):
+        """ Start a runner process (python -m isocket.jobs) for this queue. """
+        # reap runners that have exited.
+        self._runners = [x for x in self._runners if x.poll() is None]
+        command = [sys.executable, '-m', 'isocket.jobs', os.path.abspath(self.folder), '--workers', str(self.workers),
+                   '--timeout', str(self.timeout), '--expiry', str(self.expiry)]
+        self._runners.append(subprocess.Popen(command, cwd=_import_root, stdin=subprocess.DEVNULL,
+                                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                              start_new_session=True))
+        return
+
+    def _claim_slot(self):
+        """ Open file of a free slot, whose lock is held until it is closed, or None if all slots are taken """
+        for i in range(self.workers):
+            foo = open(os.path.join(self._slot_folder, '{}.lock'.format(i)), 'a')
+            try:
+                fcntl.flock(foo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                foo.close()
+                continue
+            return foo
+        return
+
+    def _queued(self):
+        return sorted(x for x in os.listdir(self._queue_folder) if x.endswith('.json'))
+
+    def _claim_job(self):
+        """ Remove the oldest job from the queue and return it, or None if the queue is empty """
+        for filename in self._queued():
+            path = os.path.join(self._queue_folder, filename)
+            claimed = '{}.claimed'.format(path)
+            # only one runner can rename the file.
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, 'r') as foo:
+                spec = json.load(foo)
+            os.remove(claimed)
+            return spec
+        return
+
+    def _run(self, spec):
+        job_id = spec['job_id']
+        state = self.status(job_id)
+        if state is None or state['status'] != QUEUED:
+            return
+        submitted = state['submitted']
+        self._write(job_id, status=RUNNING, submitted=submitted, started=time.time(), pid=os.getpid())
+        try:
+            func = import_func(spec['func'])
+        except (ImportError, AttributeError, ValueError) as e:
+            self._write(job_id, status=FAILED, error='{0}: {1}'.format(type(e).__name__, e), submitted=submitted)
+            return
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_call, args=(child_conn, func, spec['args']), daemon=True)
+        process.start()
+        child_conn.close()
+        if parent_conn.poll(self.timeout):
+            try:
+                success, value = parent_conn.recv()
+            except EOFError:
+                success, value = False, 'Job process exited unexpectedly.'
+        else:
+            success, value = False, 'Job timed out after {} seconds.'.format(self.timeout)
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        parent_conn.close()
+        if success:
+            self._write(job_id, status=FINISHED, result=value, submitted=submitted)
+        else:
+            self._write(job_id, status=FAILED, error=value, submitted=submitted)
+        return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the queued jobs of a JobQueue folder.')
+    parser.add_argument('folder')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--expiry', type=float, default=3600)
+    args = parser.parse_args()
+    job_queue = JobQueue(folder=args.folder, workers=args.workers, timeout=args.timeout, expiry=args.expiry)
+    job_queue.clean()
+    job_queue.run_queued()
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+""" Knobs-into-holes (KIHs) of CoordinateStructures, as found by isambard.add_ons.knobs_into_holes.KnobGroup.
+
+As in KnobGroup.from_helices:
+    helices are the runs of at least min_helix_length residues assigned 'H' by DSSP, numbered in chain order;
+    helices are clustered by single linkage on the distance between the segments joining their first and last CA
+    atoms, at cutoff + 10 Angstroms, and KIHs are only looked for between helices of the same cluster;
+    each residue (knob) of one helix forms a KIH with another helix if at least hole_size side-chain centres of that
+    helix are within cutoff of its own side-chain centre. The hole is the hole_size closest of them, and the
+    max_kh_distance of the KIH is the largest knob to hole distance.
+KIHs are returned as a KIHEdgeTable of (knob helix number, hole helix number, max_kh_distance), in the order of
+KnobGroup.graph.edges(), the form used by CutoffSweep and the KIH cache.
+
+Comparing every pair of helices in a cluster, as KnobGroup does, scales with the square of the number of helices,
+and large assemblies (capsids, fibres) often form a single cluster. By default, KIHs are instead found from the pairs
+of side-chain centres within cutoff of each other, read from a KD-tree of all helix residues, and clusters from the
+pairs of helices whose segments could be within the cluster distance, read from KD-trees of the segment midpoints.
+Both give the same KIHs, in the same order, as the pairwise comparison (spatial_index=False).
+"""
+import itertools
+from collections import OrderedDict
+
+import numpy
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from isocket.kih_table import KIHEdgeTable
+
+# added to KD-tree query radii, so that no pair within a cutoff is missed through rounding. Pairs are then filtered
+# on the same distances the pairwise comparison uses.
+_radius_margin = 1e-6
+
+
+def segment_distances(p0, p1, q0, q1):
+    """ Minimal distances between the line segments p0-p1 and q0-q1.
+
+    Parameters
+    ----------
+    p0, p1, q0, q1: numpy.ndarray
+        (n, 3) arrays of the end points of n pairs of segments.
+
+    Returns
+    -------
+    distances: numpy.ndarray
+        (n,) array.
+    """
+    u, v, w = p1 - p0, q1 - q0, p0 - q0
+    a, b, c = (u * u).sum(1), (u * v).sum(1), (v * v).sum(1)
+    d, e = (u * w).sum(1), (v * w).sum(1)
+    denominator = a * c - b * b
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        # closest points of the infinite lines, as fractions s along p and t along q, clamped to the segments.
+        parallel = denominator < 1e-8
+        s = numpy.where(parallel, 0.0, (b * e - c * d) / denominator)
+        s = numpy.clip(s, 0.0, 1.0)
+        t = numpy.where(c > 0, (b * s + e) / c, 0.0)
+        # where t is clamped, s is recalculated for the clamped t.
+        t_clipped = numpy.clip(t, 0.0, 1.0)
+        s = numpy.where(t != t_clipped, numpy.clip(numpy.where(a > 0, (b * t_clipped - d) / a, 0.0), 0.0, 1.0), s)
+    closest = w + s[:, None] * u - t_clipped[:, None] * v
+    return numpy.sqrt((closest * closest).sum(1))
+
+
+def helix_clusters(ends, cluster_distance, spatial_index=True):
+    """ Clusters of helices, as in isambard.add_ons.knobs_into_holes.cluster_helices.
+
+    Parameters
+    ----------
+    ends: numpy.ndarray
+        (n_helices, 2, 3) array of the first and last CA positions of each helix.
+    cluster_distance: float
+    spatial_index: bool
+        If True, only the segment distances of helices whose midpoints are close enough for their segments to be
+        within cluster_distance are calculated. Otherwise all are, and clustered with scipy's single linkage.
+
+    Returns
+    -------
+    clusters: list(list(int))
+        Helix numbers of each cluster, in order of their first helix.
+    """
+    n = len(ends)
+    if n < 2:
+        return [list(range(n))]
+    if spatial_index:
+        i, j = _midpoint_pairs(ends, cluster_distance)
+        close = segment_distances(ends[i, 0], ends[i, 1], ends[j, 0], ends[j, 1]) <= cluster_distance
+        # single linkage clusters at cluster_distance are the connected components of the pairs within it.
+        graph = coo_matrix((numpy.ones(numpy.count_nonzero(close)), (i[close], j[close])), shape=(n, n))
+        labels = connected_components(graph, directed=False)[1]
+    else:
+        i, j = numpy.triu_indices(n, k=1)
+        condensed = segment_distances(ends[i, 0], ends[i, 1], ends[j, 0], ends[j, 1])
+        labels = fcluster(linkage(condensed, method='single'), t=cluster_distance, criterion='distance')
+    clusters = OrderedDict()
+    for h, label in enumerate(labels):
+        clusters.setdefault(label, []).append(h)
+    return list(clusters.values())
+
+
+def _midpoint_pairs(ends, cluster_distance):
+    """ Pairs of helices whose segments could be within cluster_distance of each other.
+
+    Notes
+    -----
+    Segments within cluster_distance have midpoints within cluster_distance plus their two half lengths. Helices are
+    grouped by half length, to within a factor of two, and each pair of groups is searched to the distance of its own
+    longest helices, so that a few long helices do not widen the search for all of the others.
+
+    Returns
+    -------
+    i, j: numpy.ndarray
+        Helix numbers of each pair.
+    """
+    midpoints = ends.mean(axis=1)
+    half_lengths = numpy.sqrt(((ends[:, 1] - ends[:, 0]) ** 2).sum(1)) / 2
+    groups = numpy.ceil(numpy.log2(numpy.maximum(half_lengths, 1.0))).astype(int)
+    members = [numpy.flatnonzero(groups == g) for g in numpy.unique(groups)]
+    trees = [cKDTree(midpoints[m]) for m in members]
+    longest = [half_lengths[m].max() for m in members]
+    i, j = [], []
+    for a, b in itertools.combinations_with_replacement(range(len(members)), 2):
+        r = cluster_distance + longest[a] + longest[b] + _radius_margin
+        if a == b:
+            pairs = _query_pairs(trees[a], r)
+            i.append(members[a][pairs[:, 0]])
+            j.append(members[a][pairs[:, 1]])
+        else:
+            neighbours = trees[a].query_ball_tree(trees[b], r)
+            i.append(numpy.repeat(members[a], [len(x) for x in neighbours]))
+            j.append(members[b][numpy.fromiter(itertools.chain.from_iterable(neighbours), dtype=int,
+                                               count=len(i[-1]))])
+    return numpy.concatenate(i), numpy.concatenate(j)
+
+
+def _query_pairs(tree, r):
+    """ (n, 2) int array of the pairs of points of cKDTree tree within distance r of each other """
+    try:
+        return tree.query_pairs(r, output_type='ndarray').reshape(-1, 2)
+    except TypeError:
+        # scipy without output_type returns a set, which is much slower to convert.
+        pairs = tree.query_pairs(r)
+        return numpy.fromiter(itertools.chain.from_iterable(pairs), dtype=int, count=2 * len(pairs)).reshape(-1, 2)
+
+
+def _distances(a, b):
+    """ Euclidean distances between the rows of a and b, computed as in pair_kihs """
+    return numpy.sqrt(((a - b) ** 2).sum(-1))
+
+
+def pair_kihs(knob_centres, hole_centres, cutoff, hole_size=4):
+    """ KIHs formed by residues of one helix (knobs) with another helix.
+
+    Parameters
+    ----------
+    knob_centres, hole_centres: numpy.ndarray
+        (n, 3) arrays of the side-chain centres of the residues of the two helices.
+    cutoff: float
+    hole_size: int
+
+    Returns
+    -------
+    knobs: numpy.ndarray
+        Index of the knob residue of each KIH, in ascending order.
+    max_kh_distances: numpy.ndarray
+    """
+    if len(hole_centres) < hole_size:
+        return numpy.array([], dtype=int), numpy.array([])
+    distances = _distances(knob_centres[:, None], hole_centres[None])
+    knobs = numpy.flatnonzero((distances <= cutoff).sum(1) >= hole_size)
+    # the largest distance to the hole_size closest hole residues.
+    max_kh_distances = numpy.partition(distances[knobs], hole_size - 1, axis=1)[:, hole_size - 1]
+    return knobs, max_kh_distances
+
+
+def _pairwise_kihs(centres, clusters, cutoff, hole_size):
+    """ KIHEdgeTable of the KIHs found by comparing every ordered pair of helices of a cluster """
+    kihs = []
+    for cluster in clusters:
+        for h1, h2 in itertools.permutations(cluster, 2):
+            knobs, distances = pair_kihs(centres[h1], centres[h2], cutoff=cutoff, hole_size=hole_size)
+            kihs.extend((h1, h2, float(d)) for d in distances)
+    return KIHEdgeTable.from_kihs(kihs)
+
+
+def _neighbour_kihs(centres, clusters, cutoff, hole_size):
+    """ KIHs as found by _pairwise_kihs, and in the same order, from the pairs of residues within cutoff. """
+    lengths = [len(x) for x in centres]
+    helix = numpy.repeat(numpy.arange(len(centres)), lengths)
+    position = numpy.concatenate([numpy.arange(n) for n in lengths])
+    xyz = numpy.concatenate(centres)
+    cluster = numpy.empty(len(centres), dtype=int)
+    for rank, members in enumerate(clusters):
+        cluster[members] = rank
+    # residues without a side-chain centre (no side chain and no CA) are never within cutoff.
+    valid = numpy.flatnonzero(~numpy.isnan(xyz).any(axis=1))
+    pairs = valid[_query_pairs(cKDTree(xyz[valid]), cutoff + _radius_margin)]
+    i, j = pairs[:, 0], pairs[:, 1]
+    keep = (helix[i] != helix[j]) & (cluster[helix[i]] == cluster[helix[j]])
+    i, j = i[keep], j[keep]
+    d = _distances(xyz[i], xyz[j])
+    within = d <= cutoff
+    # each pair is a possible knob and hole residue in both directions.
+    knob = numpy.concatenate([i[within], j[within]])
+    hole_helix = helix[numpy.concatenate([j[within], i[within]])]
+    d = numpy.concatenate([d[within], d[within]])
+    # the hole residues of each (knob, hole helix), closest first.
+    order = numpy.lexsort((d, hole_helix, knob))
+    knob, hole_helix, d = knob[order], hole_helix[order], d[order]
+    starts = numpy.flatnonzero(numpy.append(True, (knob[1:] != knob[:-1]) | (hole_helix[1:] != hole_helix[:-1])))
+    sizes = numpy.diff(numpy.append(starts, len(knob)))
+    starts = starts[sizes >= hole_size]
+    knob, hole_helix, max_kh = knob[starts], hole_helix[starts], d[starts + hole_size - 1]
+    knob_helix = helix[knob]
+    # the order of _pairwise_kihs: by cluster, then knob helix, then hole helix, then knob residue.
+    order = numpy.lexsort((position[knob], hole_helix, knob_helix, cluster[knob_helix]))
+    return KIHEdgeTable(src=knob_helix[order], dst=hole_helix[order], max_kh_distance=max_kh[order])
+
+
+def helix_kihs(centres, ends, cutoff=7.0, hole_size=4, spatial_index=True):
+    """ KIHs between helices, given the side-chain centres of their residues and the CA positions of their ends.
+
+    Parameters
+    ----------
+    centres: list(numpy.ndarray)
+        (n_residues, 3) array of the side-chain centres of the residues of each helix.
+    ends: numpy.ndarray
+        (n_helices, 2, 3) array of the first and last CA positions of each helix.
+    cutoff: float
+        Socket cutoff in Angstroms.
+    hole_size: int
+    spatial_index: bool
+        If True, use KD-trees to find the helices and residues close enough to form KIHs. If False, compare all
+        pairs of helices in each cluster, as KnobGroup does.
+
+    Returns
+    -------
+    kihs: KIHEdgeTable
+        (knob helix number, hole helix number, max_kh_distance) for each KIH, in the order of KnobGroup.graph.edges().
+    """
+    if len(centres) <= 1:
+        return KIHEdgeTable.from_kihs([])
+    clusters = helix_clusters(numpy.asarray(ends, dtype=float), cluster_distance=cutoff + 10,
+                              spatial_index=spatial_index)
+    if spatial_index:
+        kihs = _neighbour_kihs(centres, clusters=clusters, cutoff=cutoff, hole_size=hole_size)
+    else:
+        kihs = _pairwise_kihs(centres, clusters=clusters, cutoff=cutoff, hole_size=hole_size)
+    return kihs.graph_edge_order()
+
+
+def find_kihs(structure, cutoff=7.0, min_helix_length=8, hole_size=4, spatial_index=True):
+    """ KIHs between the helices of structure.
+
+    Parameters
+    ----------
+    structure: CoordinateStructure
+    cutoff: float
+        Socket cutoff in Angstroms.
+    min_helix_length: int
+    hole_size: int
+    spatial_index: bool
+        See helix_kihs.
+
+    Returns
+    -------
+    kihs: KIHEdgeTable
+        (knob helix number, hole helix number, max_kh_distance) for each KIH, in the order of KnobGroup.graph.edges().
+        Empty if the structure has fewer than two helices.
+    """
+    helices = structure.helices(min_length=min_helix_length)
+    centres = structure.side_chain_centres()
+    ca = structure.ca_coordinates()
+    ends = numpy.array([[ca[h[0]], ca[h[-1]]] for h in helices]).reshape(-1, 2, 3)
+    return helix_kihs([centres[h] for h in helices], ends=ends, cutoff=cutoff, hole_size=hole_size,
+                      spatial_index=spatial_index)
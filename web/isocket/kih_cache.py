@@ -0,0 +1,75 @@
+""" Size-bounded cache of the KIHs found in uploaded structures, keyed on a hash of the file content.
+
+Finding KIHs means parsing the structure and building a KnobGroup. The KIHs found at one cutoff contain those at
+every smaller cutoff, so once a structure has been analysed, other scut and kcut values only need KIHEdgeTable.filter.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+
+from isocket.kih_table import KIHEdgeTable
+
+
+def content_hash(content):
+    """ sha256 hex digest of content (bytes) """
+    return hashlib.sha256(content).hexdigest()
+
+
+class KIHCache:
+    """ LRU cache from content hash to the KIHs of a structure.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of structures held. The least recently used are evicted first.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __repr__(self):
+        return '<KIHCache(structures={0}, maxsize={1})>'.format(len(self.entries), self.maxsize)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, cutoff):
+        """ KIHs of the structure with content hash key, or None if not cached at a cutoff of at least cutoff.
+
+        Returns
+        -------
+        kihs: KIHEdgeTable, or None
+            KIHs found at the cached cutoff.
+        """
+        if key not in self.entries:
+            return
+        cached_cutoff, kihs = self.entries[key]
+        if cached_cutoff < cutoff:
+            return
+        self.entries.move_to_end(key)
+        return kihs
+
+    def put(self, key, cutoff, kihs):
+        """ Store the KIHs found at cutoff for the structure with content hash key """
+        self.entries[key] = (cutoff, kihs)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return
+
+
+def save_kihs(filename, cutoff, kihs):
+    """ Write the KIHs (a KIHEdgeTable) found at cutoff to a JSON file, so that they can be shared between processes """
+    with open(filename, 'w') as foo:
+        json.dump(dict(cutoff=cutoff, kihs=kihs.kihs()), foo)
+    return
+
+
+def load_kihs(filename):
+    """ (cutoff, KIHEdgeTable) from a file written by save_kihs, or None if there is no such file """
+    try:
+        with open(filename, 'r') as foo:
+            d = json.load(foo)
+    except FileNotFoundError:
+        return
+    return d['cutoff'], KIHEdgeTable.from_kihs(d['kihs'])
@@ -0,0 +1,148 @@
+""" KIHs of a structure as columns of NumPy arrays, instead of a MultiDiGraph or a list of tuples.
+
+KIHEdgeTable is the form in which KIHs are passed from KIH detection (isocket.kih, or a KnobGroup) to CutoffSweep, the
+KIH cache and the structure views. Lists of tuples are only used to store them as JSON.
+
+A KIHEdgeTable has one row per KIH: the number of its knob helix (src), the number of its hole helix (dst) and its
+max_kh_distance. The number of KIHs (knobs) from one helix into another is derived from the rows kept at a cutoff
+(knob_counts). Filtering at a cutoff (as KnobGroup.filter_graph) is a boolean mask over the rows, and the plain graph
+of a table (as graph_to_plain_graph of the MultiDiGraph of its KIHs) is built from integer arrays in one pass.
+"""
+import networkx
+import numpy
+
+
+class KIHEdgeTable:
+    """ KIHs as arrays of knob helix, hole helix and max_kh_distance.
+
+    Parameters
+    ----------
+    src: array-like of int
+        Knob helix number of each KIH.
+    dst: array-like of int
+        Hole helix number of each KIH.
+    max_kh_distance: array-like of float
+        Largest knob to hole distance of each KIH.
+    """
+    def __init__(self, src, dst, max_kh_distance):
+        self.src = numpy.asarray(src, dtype=numpy.int32).reshape(-1)
+        self.dst = numpy.asarray(dst, dtype=numpy.int32).reshape(-1)
+        self.max_kh_distance = numpy.asarray(max_kh_distance, dtype=float).reshape(-1)
+
+    def __repr__(self):
+        return '<KIHEdgeTable(kihs={0}, helices={1})>'.format(len(self), len(self.nodes()))
+
+    def __len__(self):
+        return len(self.src)
+
+    @classmethod
+    def from_kihs(cls, kihs):
+        """ Instantiate from a list of (knob helix number, hole helix number, max_kh_distance) """
+        if len(kihs) == 0:
+            return cls([], [], [])
+        src, dst, max_kh_distance = zip(*kihs)
+        return cls(src=src, dst=dst, max_kh_distance=max_kh_distance)
+
+    @classmethod
+    def from_knob_group(cls, kg):
+        """ Instantiate from the KnobIntoHoles of an isambard.add_ons.knobs_into_holes.KnobGroup, without building its
+        graph. Helices are identified by their number, and the KIHs are put in the order of KnobGroup.graph.edges().
+        """
+        kihs = [(x.knob_helix.number, x.hole_helix.number, x.max_kh_distance) for x in kg.get_monomers()]
+        return cls.from_kihs(kihs).graph_edge_order()
+
+    def kihs(self):
+        """ List of (knob helix number, hole helix number, max_kh_distance), in the order of the rows """
+        return list(zip(self.src.tolist(), self.dst.tolist(), self.max_kh_distance.tolist()))
+
+    def take(self, rows):
+        """ KIHEdgeTable of rows (a boolean mask or index array) """
+        return KIHEdgeTable(src=self.src[rows], dst=self.dst[rows], max_kh_distance=self.max_kh_distance[rows])
+
+    def nodes(self):
+        """ Helix numbers in order of first appearance in the rows, the knob helix of each row before its hole helix """
+        interleaved = numpy.column_stack([self.src, self.dst]).ravel()
+        helices, first = numpy.unique(interleaved, return_index=True)
+        return helices[numpy.argsort(first)]
+
+    def _pair_keys(self):
+        """ Integer key of the (src, dst) helix pair of each row """
+        return self.src.astype(numpy.int64) * (int(max(self.src.max(), self.dst.max())) + 1) + self.dst
+
+    def knob_counts(self, cutoff=None):
+        """ Number of KIHs from each helix into another.
+
+        Parameters
+        ----------
+        cutoff: float or None
+            If given, only KIHs with max_kh_distance <= cutoff are counted.
+
+        Returns
+        -------
+        src, dst, counts: numpy.ndarray
+            Knob helix, hole helix and number of KIHs of each pair of helices with at least one KIH.
+        """
+        table = self if cutoff is None else self.take(self.max_kh_distance <= cutoff)
+        if len(table) == 0:
+            empty = numpy.array([], dtype=numpy.int32)
+            return empty, empty, numpy.array([], dtype=int)
+        _, first, counts = numpy.unique(table._pair_keys(), return_index=True, return_counts=True)
+        return table.src[first], table.dst[first], counts
+
+    def filter(self, cutoff=7.0, min_kihs=2):
+        """ The KIHs kept by KnobGroup.filter_graph at a single cutoff, in their original order.
+
+        Parameters
+        ----------
+        cutoff : float
+            Socket cutoff in Angstroms.
+        min_kihs : int
+            KIHs are only kept if both of their helices share more than min_kihs KIHs, in the same direction, with at
+            least one helix.
+
+        Returns
+        -------
+        table: KIHEdgeTable
+        """
+        keep = self.max_kh_distance <= cutoff
+        if min_kihs > 0 and keep.any():
+            src, dst, counts = self.take(keep).knob_counts()
+            helices = numpy.union1d(src[counts > min_kihs], dst[counts > min_kihs])
+            keep &= numpy.in1d(self.src, helices) & numpy.in1d(self.dst, helices)
+        return self.take(keep)
+
+    def graph_edge_order(self):
+        """ KIHEdgeTable of the rows in the order of the edges of a networkx MultiDiGraph they are added to.
+
+        Notes
+        -----
+        MultiDiGraph.edges() lists the edges of each node in the order the nodes were added, and the edges of a node in
+        the order its neighbours were added. This is the order KnobGroup.graph.edges() gives its KIHs in.
+        """
+        if len(self) == 0:
+            return self
+        nodes = self.nodes()
+        node_rank = numpy.empty(int(nodes.max()) + 1, dtype=int)
+        node_rank[nodes] = numpy.arange(len(nodes))
+        _, first, pair = numpy.unique(self._pair_keys(), return_index=True, return_inverse=True)
+        order = numpy.lexsort((numpy.arange(len(self)), first[pair], node_rank[self.src]))
+        return self.take(order)
+
+    def to_plain_graph(self):
+        """ networkx.Graph of the KIHs, as graph_to_plain_graph of their MultiDiGraph.
+
+        Notes
+        -----
+        Nodes are numbered 0, 1, ... in order of their first appearance in the rows.
+        """
+        h = networkx.Graph()
+        if len(self) == 0:
+            h.graph['name'] = None
+            return h
+        nodes = self.nodes()
+        labels = numpy.empty(int(nodes.max()) + 1, dtype=int)
+        labels[nodes] = numpy.arange(len(nodes))
+        h.add_nodes_from(range(len(nodes)))
+        h.add_edges_from(zip(labels[self.src].tolist(), labels[self.dst].tolist()))
+        h.graph['name'] = None
+        return h
@@ -0,0 +1,235 @@
+""" Process-wide memo of graph names, keyed on a canonical labelling of the graph.
+
+The same small topologies (dimers, trimers, C4, ...) are found in a large fraction of all structures, so after the
+first isomorphism search for a topology its name is remembered and later lookups cost one dictionary access.
+Database updates keep the atlas names in a file between runs (see NameCache.persisted and NAME_CACHE_FILE in config).
+"""
+import os
+import pickle
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
+
+from isocket.graph_theory import graph_to_plain_graph, isomorphism_checker
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class CanonicalFormTooExpensive(Exception):
+    pass
+
+
+def _refine(adj, colours):
+    """ Equitable refinement of colours: split each colour class by the colours of its members' neighbours.
+
+    Parameters
+    ----------
+    adj: dict
+        node -> list of neighbours.
+    colours: dict
+        node -> sortable colour.
+
+    Returns
+    -------
+    colours: dict
+        node -> int, numbered in a way that depends only on the structure of the graph and the input colours.
+    """
+    signatures = colours
+    n_colours = -1
+    while True:
+        ranks = {s: i for i, s in enumerate(sorted(set(signatures.values())))}
+        colours = {n: ranks[signatures[n]] for n in adj}
+        if len(ranks) == n_colours:
+            return colours
+        n_colours = len(ranks)
+        signatures = {n: (colours[n], tuple(sorted(colours[m] for m in adj[n]))) for n in adj}
+
+
+def canonical_form(h, max_leaves=1000):
+    """ Certificate of h that is the same for two graphs if and only if they are isomorphic.
+
+    Notes
+    -----
+    Individualisation-refinement search: nodes in the first non-singleton colour class are individualised in turn
+    and the colouring refined, until every node has its own colour. The certificate is the lexicographically
+    smallest edge list over all such numberings.
+
+    Parameters
+    ----------
+    h: networkx.Graph
+    max_leaves: int
+        Give up on very symmetric graphs (e.g. large complete graphs) once this many numberings have been tried.
+
+    Returns
+    -------
+    certificate: tuple
+        (number of nodes, sorted tuple of edges between canonical node numbers).
+
+    Raises
+    ------
+    CanonicalFormTooExpensive
+        If more than max_leaves numberings would need to be compared.
+    """
+    adj = {n: [m for m in h.adj[n] if m != n] for n in h.nodes()}
+    loops = {n for n in h.nodes() if n in h.adj[n]}
+    leaves = [0]
+    best = [None]
+
+    def search(colours):
+        colours = _refine(adj, colours)
+        cells = {}
+        for n, c in colours.items():
+            cells.setdefault(c, []).append(n)
+        target = next((cells[c] for c in sorted(cells) if len(cells[c]) > 1), None)
+        if target is None:
+            leaves[0] += 1
+            if leaves[0] > max_leaves:
+                raise CanonicalFormTooExpensive
+            edges = tuple(sorted(tuple(sorted((colours[u], colours[v]))) for u in adj for v in adj[u] if u < v)
+                          + sorted((colours[n], colours[n]) for n in loops))
+            if best[0] is None or edges < best[0]:
+                best[0] = edges
+            return
+        # swapping twins (nodes with the same neighbours apart from each other) is an automorphism that fixes the
+        # colouring, so individualising either of them leads to the same certificates.
+        twins = set()
+        for v in target:
+            twin_key = (frozenset(adj[v]), frozenset(adj[v]) | {v})
+            if twin_key[0] in twins or twin_key[1] in twins:
+                continue
+            twins.update(twin_key)
+            # v is placed just before the rest of its cell.
+            search({n: (c, 0 if n == v else 1) for n, c in colours.items()})
+        return
+
+    search({n: (n in loops) for n in adj})
+    return h.number_of_nodes(), best[0]
+
+
+class NameCache:
+    """ Bounded LRU cache from canonical forms of plain graphs to their names.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of graphs remembered. The least recently used entries are evicted first.
+
+    Notes
+    -----
+    Entries are keyed by a namespace as well as the graph, since the same graph can have a name in one graph list
+    (e.g. the atlas) and none in another. None is cached too, so repeated misses are also cheap.
+    Each graph is stored under its canonical form and under its edge list as numbered by graph_to_plain_graph, so a
+    graph that recurs with the same numbering (common for graphs from get_knob_graphs) skips the canonical labelling.
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<NameCache({})>'.format(self.cache_info())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def cache_info(self):
+        return CacheInfo(hits=self.hits, misses=self.misses, maxsize=self.maxsize, currsize=len(self.entries))
+
+    def name(self, g, graph_list, namespace):
+        """ Name of g in graph_list, as returned by isomorphism_checker, via the cache.
+
+        Parameters
+        ----------
+        g: networkx.Graph
+        graph_list:
+            A list of networkx.Graph objects, or an AtlasIndex, against which to check for isomorphism on a miss.
+        namespace: str
+            Identifies graph_list. Must be the same every time the same graph_list is used.
+
+        Returns
+        -------
+        iso_name : str, or None
+        """
+        h = graph_to_plain_graph(g)
+        # A graph that has been seen with exactly the same numbering needs no canonical labelling.
+        labelled_key = (namespace, 'labelled', (h.number_of_nodes(), tuple(sorted(tuple(sorted(e)) for e in h.edges()))))
+        if labelled_key in self.entries:
+            return self._hit(labelled_key)
+        try:
+            canonical_key = (namespace, 'canonical', canonical_form(h))
+        except CanonicalFormTooExpensive:
+            self.misses += 1
+            return isomorphism_checker(h, graph_list=graph_list)
+        if canonical_key in self.entries:
+            iso_name = self._hit(canonical_key)
+        else:
+            self.misses += 1
+            iso_name = isomorphism_checker(h, graph_list=graph_list)
+            self._add(canonical_key, iso_name)
+        self._add(labelled_key, iso_name)
+        return iso_name
+
+    def _hit(self, key):
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def _add(self, key, iso_name):
+        self.entries[key] = iso_name
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return
+
+    def clear(self, namespace=None):
+        """ Remove all entries, or only those in namespace, e.g. after graphs have been added to that graph list. """
+        if namespace is None:
+            self.entries.clear()
+        else:
+            for key in [k for k in self.entries if k[0] == namespace]:
+                del self.entries[key]
+        return
+
+    def save(self, filename, namespace=None):
+        """ Write the entries, or only those in namespace, to a pickle file. The file is replaced once complete. """
+        items = [(k, v) for k, v in self.entries.items() if namespace is None or k[0] == namespace]
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        temp_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(temp_filename, 'wb') as foo:
+            pickle.dump(items, foo)
+        os.replace(temp_filename, filename)
+        return
+
+    def load(self, filename):
+        """ Add the entries from a pickle file written by save. Missing or empty files are ignored. """
+        try:
+            with open(filename, 'rb') as foo:
+                items = pickle.load(foo)
+        except (FileNotFoundError, EOFError):
+            items = []
+        for key, iso_name in items:
+            self.entries[key] = iso_name
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return
+
+    @contextmanager
+    def persisted(self, filename, namespace='atlas'):
+        """ Load the entries from filename (if it is not None) and save those in namespace to it on exit.
+
+        Notes
+        -----
+        Only the atlas namespace is kept by default: the atlas never changes, but unknown graphs are added between
+        runs, so cached misses against them would go stale.
+        """
+        if filename is None:
+            yield self
+            return
+        self.load(filename)
+        try:
+            yield self
+        finally:
+            self.save(filename, namespace=namespace)
+
+
+name_cache = NameCache()
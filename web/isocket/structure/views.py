@@ -2,15 +2,89 @@ import json
 import os
 
 import networkx
-from flask import render_template, flash, redirect, request, url_for, current_app
-from flask_uploads import UploadSet
+from flask import render_template, flash, redirect, request, url_for, current_app, jsonify, abort
+from flask_uploads import UploadSet, extension
 from isocket.structure import structure_bp
 from isocket.structure.forms import SocketForm
 from networkx.readwrite import json_graph
 from werkzeug.utils import secure_filename
 
+from isocket.jobs import JobQueue, FINISHED
+from isocket.kih_cache import KIHCache, content_hash, save_kihs, load_kihs
 from isocket.structure_handler import StructureHandler
 
+_kih_cache = None
+_job_queue = None
+
+
+def get_kih_cache():
+    """ Process-wide KIHCache, sized by the KIH_CACHE_SIZE config value """
+    global _kih_cache
+    if _kih_cache is None:
+        _kih_cache = KIHCache(maxsize=current_app.config['KIH_CACHE_SIZE'])
+    return _kih_cache
+
+
+def get_job_queue():
+    """ Process-wide JobQueue, configured by the STRUCTURE_JOB_* config values """
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(folder=current_app.config['STRUCTURE_JOB_FOLDER'],
+                              workers=current_app.config['STRUCTURE_JOB_WORKERS'],
+                              timeout=current_app.config['STRUCTURE_JOB_TIMEOUT'],
+                              expiry=current_app.config['STRUCTURE_JOB_EXPIRY'])
+    return _job_queue
+
+
+def kihs_path(filename):
+    """ Path of the file holding the KIHs found in the uploaded structure filename """
+    return os.path.join(current_app.config['UPLOADED_STRUCTURES_DEST'], '{}.kihs.json'.format(filename))
+
+
+def analyse_upload(static_file_path, cutoff, kihs_filename):
+    """ Find the KIHs in an uploaded structure and write them to kihs_filename. Run as a background job. """
+    kihs = StructureHandler.from_file(filename=static_file_path).get_kih_table(cutoff=cutoff)
+    save_kihs(kihs_filename, cutoff=cutoff, kihs=kihs)
+    return len(kihs)
+
+
+def get_cached_kihs(filename, cutoff):
+    """ KIHs of an uploaded structure from the in-memory cache or from the KIHs file, or None if neither has them
+    at a cutoff >= cutoff. Uploaded files are named by the hash of their content, which is the key into the cache.
+    """
+    key = os.path.splitext(filename)[0]
+    kih_cache = get_kih_cache()
+    kihs = kih_cache.get(key, cutoff=cutoff)
+    if kihs is None:
+        saved = load_kihs(kihs_path(filename))
+        if saved is not None and saved[0] >= cutoff:
+            kih_cache.put(key, cutoff=saved[0], kihs=saved[1])
+            kihs = saved[1]
+    return kihs
+
+
+def submit_analysis(filename, scut, kcut):
+    """ Submit a job finding the KIHs in an uploaded structure, and return the url of the page that waits for it.
+
+    Notes
+    -----
+    KIHs are found at max(scut, KIH_CACHE_CUTOFF), so that later requests at smaller cutoffs can be served from the
+    cache.
+    """
+    cutoff = max(scut, current_app.config['KIH_CACHE_CUTOFF'])
+    static_file_path = os.path.join(current_app.config['UPLOADED_STRUCTURES_DEST'], filename)
+    job_id = get_job_queue().submit(analyse_upload, static_file_path, cutoff, kihs_path(filename))
+    return url_for('structure_bp.job', job_id=job_id, filename=filename, scut=scut, kcut=kcut)
+
+
+def kih_graph_json(kihs, scut, kcut):
+    """ node_link_data of the graph of helices formed by the KIHs (a KIHEdgeTable) kept at scut and kcut """
+    kept = kihs.filter(cutoff=scut, min_kihs=kcut)
+    h = networkx.Graph()
+    h.add_nodes_from(kept.nodes().tolist())
+    h.add_edges_from(zip(kept.src.tolist(), kept.dst.tolist()))
+    return json_graph.node_link_data(h)
+
 
 @structure_bp.route('/run', methods=['GET', 'POST'])
 def upload_file():
@@ -21,27 +95,66 @@ def upload_file():
             flash('Please upload a structure file.')
             return redirect(request.url)
         structure = request.files['structure']
-        filename = secure_filename(structures.save(structure))
-        return redirect(url_for('structure_bp.uploaded_file', filename=filename, scut=form.scut.data, kcut=form.kcut.data))
+        # store uploads under the hash of their content, so the same structure always has the same url.
+        content = structure.stream.read()
+        structure.stream.seek(0)
+        filename = secure_filename('{0}.{1}'.format(content_hash(content), extension(structure.filename)))
+        if not os.path.exists(structures.path(filename)):
+            structures.save(structure, name=filename)
+        scut = float(form.scut.data)
+        kcut = int(form.kcut.data)
+        if get_cached_kihs(filename=filename, cutoff=scut) is not None:
+            return redirect(url_for('structure_bp.uploaded_file', filename=filename, scut=scut, kcut=kcut))
+        # Analyse the structure in the background and send the user to a page that waits for it.
+        return redirect(submit_analysis(filename=filename, scut=scut, kcut=kcut))
     return render_template('upload.html', form=form)
 
 
-#TODO add tokens to urls to avoid problems with same url and different data
-# (e.g. same filename with differnet file content).
+@structure_bp.route('/jobs/<job_id>')
+def job(job_id):
+    if get_job_queue().status(job_id) is None:
+        abort(404)
+    filename = request.args.get('filename', '')
+    scut = request.args.get('scut', 7.0, type=float)
+    kcut = request.args.get('kcut', 2, type=int)
+    return render_template('job.html', title=filename, job_id=job_id,
+                           status_url=url_for('structure_bp.job_status', job_id=job_id, filename=filename,
+                                              scut=scut, kcut=kcut),
+                           result_url=url_for('structure_bp.uploaded_file', filename=filename, scut=scut, kcut=kcut))
+
+
+@structure_bp.route('/jobs/<job_id>.json')
+def job_status(job_id):
+    """ State of a job as JSON, with the graph of the structure once it has finished.
+    Answers immediately: clients poll it until the job has finished or failed.
+    """
+    state = get_job_queue().status(job_id)
+    if state is None:
+        abort(404)
+    state = dict(status=state['status'], result=state['result'], error=state['error'])
+    if state['status'] == FINISHED:
+        filename = secure_filename(request.args.get('filename', ''))
+        scut = request.args.get('scut', 7.0, type=float)
+        kcut = request.args.get('kcut', 2, type=int)
+        kihs = get_cached_kihs(filename=filename, cutoff=scut)
+        if kihs is not None:
+            state['graph'] = kih_graph_json(kihs, scut=scut, kcut=kcut)
+    return jsonify(state)
+
+
 @structure_bp.route('/uploads.<filename>.<float:scut>.<int:kcut>')
 def uploaded_file(filename, scut, kcut):
     scut = float(scut)
     kcut = int(kcut)
     uploaded_structures_dest = current_app.config['UPLOADED_STRUCTURES_DEST']
     static_file_path = os.path.join(uploaded_structures_dest, filename)
+    if filename != secure_filename(filename) or not os.path.isfile(static_file_path):
+        abort(404)
     # Deal with file extension here (is it cif or pdb)
-    structure = StructureHandler.from_file(filename=static_file_path)
-    kg = structure.get_knob_group(cutoff=scut)
-    g = kg.filter_graph(kg.graph, cutoff=scut, min_kihs=kcut)
-    h = networkx.Graph()
-    h.add_nodes_from([x.number for x in g.nodes()])
-    h.add_edges_from([(e[0].number, e[1].number) for e in g.edges()])
-    graph_as_json = json_graph.node_link_data(h)
-    graph_as_json = json.dumps(graph_as_json)
-    return render_template('structure.html', structure=static_file_path, title=filename, kg=kg,
+    kihs = get_cached_kihs(filename=filename, cutoff=scut)
+    if kihs is None:
+        # not analysed at this cutoff (e.g. the KIHs file was removed): analyse it in the background, as on upload.
+        return redirect(submit_analysis(filename=filename, scut=scut, kcut=kcut))
+    graph_as_json = json.dumps(kih_graph_json(kihs, scut=scut, kcut=kcut))
+    return render_template('structure.html', structure=static_file_path, title=filename,
                            graph_as_json=graph_as_json)
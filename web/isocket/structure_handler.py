@@ -1,20 +1,26 @@
 import itertools
 
-import networkx
 import numpy
-from isambard.add_ons.filesystem import FileSystem, preferred_mmol, get_cif, get_mmol
+from isambard.add_ons.filesystem import FileSystem
 from isambard.add_ons.knobs_into_holes import KnobGroup
 from isambard.add_ons.parmed_to_ampal import convert_cif_to_ampal
 from isambard.ampal.pdb_parser import convert_pdb_to_ampal
 
-from isocket.graph_theory import graph_to_plain_graph, AtlasHandler, isomorphism_checker
+from isocket.coordinates import CoordinateStructure
+from isocket.cutoff_sweep import CutoffSweep
+from isocket.graph_theory import AtlasHandler
+from isocket.kih import find_kihs
+from isocket.kih_table import KIHEdgeTable
+from isocket.name_cache import name_cache
+from isocket.structure_sources import PDBeSource
 from isocket_settings import global_settings
 
 try:
     data_dir = global_settings['structural_database']['path']
 except KeyError:
     data_dir = None
-_graph_list = AtlasHandler().get_graph_list(atlas=True, paths=True, cyclics=True, unknowns=False)
+_pdbe_source = PDBeSource()
+_graph_list = AtlasHandler().get_graph_index(atlas=True, paths=True, cyclics=True, unknowns=False)
 
 
 class StructureHandler:
@@ -29,7 +35,7 @@ class StructureHandler:
         return '<StructureHandler(code={0}, mmol={1})>'.format(self.code, self.mmol)
 
     @classmethod
-    def from_code(cls, code, mmol=None, store_files=False):
+    def from_code(cls, code, mmol=None, store_files=False, source=None, coordinates=False):
         """ Instantiate from PDB code
 
         Parameters
@@ -41,8 +47,16 @@ class StructureHandler:
             If None, set to preferred biological unit as stated on the PDBe.
         store_files: bool
             If True, use FileSystem module from isambard.add_ons to write files to data_dir.
+        source: structure source or None
+            Where to get the preferred mmol and the structure from (see isocket.structure_sources), e.g. a local
+            MirrorSource. If None, they are fetched from the PDBe (or, with store_files, through FileSystem).
+        coordinates: bool
+            If True, read only the atoms into a CoordinateStructure (see isocket.coordinates) instead of building an
+            AMPAL assembly. Enough for finding KIHs, and much faster and smaller for large structures.
         """
-        pref_mmol = preferred_mmol(code=code)
+        if source is None:
+            source = _pdbe_source
+        pref_mmol = source.preferred_mmol(code)
         if mmol is None:
             mmol = pref_mmol
             preferred = True
@@ -51,23 +65,35 @@ class StructureHandler:
         else:
             preferred = False
         # Use FileSystem if storing the cif/pdb files.
-        if (data_dir is not None) and store_files:
+        if (data_dir is not None) and store_files and source is _pdbe_source:
             fs = FileSystem(code=code, data_dir=data_dir)
             # Try with cif file, if that fails try with pdb file.
             try:
                 cif = fs.cifs[mmol]
-                a = convert_cif_to_ampal(cif=cif, path=True, assembly_id=code)
+                if coordinates:
+                    a = CoordinateStructure.from_file(cif, cif=True, code=code)
+                else:
+                    a = convert_cif_to_ampal(cif=cif, path=True, assembly_id=code)
             except ValueError:
                 pdb = fs.mmols[mmol]
-                a = convert_pdb_to_ampal(pdb=pdb, path=True, pdb_id=code)
+                if coordinates:
+                    a = CoordinateStructure.from_file(pdb, cif=False, code=code)
+                else:
+                    a = convert_pdb_to_ampal(pdb=pdb, path=True, pdb_id=code)
         else:
             # Try with cif file, if that fails try with pdb file.
             try:
-                cif = get_cif(code=code, mmol_number=mmol)
-                a = convert_cif_to_ampal(cif=cif, path=False, assembly_id=code)
+                cif = source.get_cif(code=code, mmol=mmol)
+                if coordinates:
+                    a = CoordinateStructure.from_text(cif, cif=True, code=code)
+                else:
+                    a = convert_cif_to_ampal(cif=cif, path=False, assembly_id=code)
             except ValueError:
-                pdb = get_mmol(code=code, mmol_number=mmol)
-                a = convert_pdb_to_ampal(pdb=pdb, path=False, pdb_id=code)
+                pdb = source.get_mmol(code=code, mmol=mmol)
+                if coordinates:
+                    a = CoordinateStructure.from_text(pdb, cif=False, code=code)
+                else:
+                    a = convert_pdb_to_ampal(pdb=pdb, path=False, pdb_id=code)
         instance = cls(assembly=a)
         instance.is_preferred = preferred
         instance.mmol = mmol
@@ -75,7 +101,38 @@ class StructureHandler:
         return instance
 
     @classmethod
-    def from_file(cls, filename, code='', cif=False):
+    def from_text(cls, text, code, mmol=None, preferred=False, cif=True, coordinates=False):
+        """ Instantiate from the contents of a cif or pdb file, e.g. as read by structure_sources.read_structure
+
+        Parameters
+        ----------
+        text: str
+            mmCIF or PDB format text.
+        code: str
+            4-letter PDB accession code
+        mmol: int or None
+            Number of the biological unit.
+        preferred: bool
+            True if mmol is the preferred biological unit.
+        cif: bool
+            True if text is mmCIF, False if it is PDB format.
+        coordinates: bool
+            If True, read only the atoms into a CoordinateStructure (see from_code).
+        """
+        if coordinates:
+            a = CoordinateStructure.from_text(text, cif=cif, code=code)
+        elif cif:
+            a = convert_cif_to_ampal(cif=text, path=False, assembly_id=code)
+        else:
+            a = convert_pdb_to_ampal(pdb=text, path=False, pdb_id=code)
+        instance = cls(assembly=a)
+        instance.is_preferred = preferred
+        instance.mmol = mmol
+        instance.code = code
+        return instance
+
+    @classmethod
+    def from_file(cls, filename, code='', cif=False, coordinates=False):
         """ Instantiate from cif or pdb file
 
         Parameters
@@ -87,8 +144,12 @@ class StructureHandler:
         cif: bool
             True if cif file provided.
             False if pdb file provided.
+        coordinates: bool
+            If True, read only the atoms into a CoordinateStructure (see from_code).
         """
-        if cif:
+        if coordinates:
+            a = CoordinateStructure.from_file(filename, cif=cif, code=code)
+        elif cif:
             a = convert_cif_to_ampal(cif=filename, path=True)
             a.id = code
         else:
@@ -109,7 +170,14 @@ class StructureHandler:
         Returns
         -------
         knob_group: isambard.add_ons.knobs_into_holes.KnobGroup instance.
+
+        Raises
+        ------
+        TypeError
+            If the structure was read with coordinates=True. Use get_kih_table instead.
         """
+        if isinstance(self.assembly, CoordinateStructure):
+            raise TypeError('No KnobGroup for a CoordinateStructure: use get_kih_table.')
         # try / except is for AmpalContainers
         try:
             knob_group = KnobGroup.from_helices(self.assembly, cutoff=cutoff)
@@ -117,7 +185,28 @@ class StructureHandler:
             knob_group = KnobGroup.from_helices(self.assembly[state_selection], cutoff=cutoff)
         return knob_group
 
-    def get_knob_graphs(self, min_scut=7.0, max_scut=9.0, scut_increment=0.5):
+    def get_kih_table(self, cutoff=9.0):
+        """ KIHs of the structure as a KIHEdgeTable.
+
+        Parameters
+        ----------
+        cutoff: float
+            iSocket cutoff value
+
+        Returns
+        -------
+        kih_table: KIHEdgeTable
+            (knob helix number, hole helix number, max_kh_distance) for each KIH, in the order of
+            KnobGroup.graph.edges().
+        """
+        if isinstance(self.assembly, CoordinateStructure):
+            return find_kihs(self.assembly, cutoff=cutoff)
+        kg = self.get_knob_group(cutoff=cutoff)
+        if kg is None:
+            return KIHEdgeTable.from_kihs([])
+        return KIHEdgeTable.from_knob_group(kg)
+
+    def get_knob_graphs(self, min_scut=7.0, max_scut=9.0, scut_increment=0.5, name_graphs=True):
         """
 
         Parameters
@@ -126,6 +215,8 @@ class StructureHandler:
         max_scut: float
         scut_increment: float
             values between min and max scut at scut_increment are used as iSocket cutoffs for getting graphs
+        name_graphs: bool
+            If False, the 'name' of each graph is left as None, to be filled in later by name_knob_graphs.
 
         Returns
         -------
@@ -133,30 +224,39 @@ class StructureHandler:
             List of graph objects representing each connected component subgraph at range of scut and kcut values.
             Each graph g has a g.graph dictionary containing the data needed to populate the database.
         """
-        kg = self.get_knob_group(cutoff=max_scut)
-        if kg is not None:
+        kih_table = self.get_kih_table(cutoff=max_scut)
+        if len(kih_table) > 0:
             scuts = list(numpy.arange(min_scut, max_scut + scut_increment, scut_increment))
             kcuts = list(range(4))
-            g = kg.graph
+            # graphs at all cutoffs come from one incremental sweep rather than filtering kg.graph for each cutoff.
+            plain_graphs = CutoffSweep(table=kih_table).plain_graphs(scuts=scuts, kcuts=kcuts)
             knob_graphs = []
             for scut, kcut in itertools.product(scuts[::-1], kcuts):
-                h = kg.filter_graph(g=g, cutoff=scut, min_kihs=kcut)
-                h = graph_to_plain_graph(g=h)
-                # if is null graph
-                if h.number_of_nodes() == 0:
-                    continue
-                if networkx.connected.is_connected(h):
-                    ccs = [h]
-                else:
-                    ccs = sorted(networkx.connected_component_subgraphs(h, copy=True),
-                                 key=lambda x: len(x.nodes()), reverse=True)
+                ccs = plain_graphs[(scut, kcut)]
                 for cc_num, cc in enumerate(ccs):
-                    name = isomorphism_checker(cc, graph_list=_graph_list)
                     d = dict(scut=scut, kcut=kcut, code=self.code, cc_num=cc_num,
                              preferred=self.is_preferred, mmol=self.mmol,
-                             name=name, nodes=cc.number_of_nodes(), edges=cc.number_of_edges())
+                             name=None, nodes=cc.number_of_nodes(), edges=cc.number_of_edges())
                     cc.graph.update(d)
                     knob_graphs.append(cc)
+            if name_graphs:
+                name_knob_graphs(knob_graphs)
         else:
             knob_graphs = []
         return knob_graphs
+
+
+def name_knob_graphs(knob_graphs):
+    """ Set the 'name' of each knob graph to the name of its isomorph in the atlas, cyclic and path graphs.
+
+    Parameters
+    ----------
+    knob_graphs: list(networkx.Graph)
+
+    Returns
+    -------
+    None
+    """
+    for g in knob_graphs:
+        g.graph['name'] = name_cache.name(g, graph_list=_graph_list, namespace='atlas')
+    return
@@ -0,0 +1,343 @@
+""" Where StructureHandler.from_code gets structures from.
+
+A structure source answers two questions about a PDB code: which biological unit (mmol) is preferred, and what the
+mmCIF or PDB format text of a given mmol is. There are three kinds:
+    PDBeSource: fetches each answer from the PDBe (via isambard.add_ons.filesystem), one request at a time;
+    DirectorySource: reads a local directory of gzipped files and an index of preferred mmols, without network access;
+    MirrorSource: a DirectorySource that fetches anything it does not have from an upstream source and keeps it.
+Batch runs use a MirrorSource and prefetched(), which fetches codes into the mirror in a pool of threads ahead of the
+code being parsed, so that parsing reads from local disk instead of waiting on the network.
+
+Layout of a source directory:
+    preferred_mmols.tsv: lines of code<TAB>mmol, appended as they are found, or code<TAB> when the preferred mmol of
+        code is forgotten;
+    bc/1bcd_1.cif.gz: the mmCIF text of mmol 1 of 1bcd (1bcd_1.pdb.gz for PDB format text);
+    bc/1bcd_1.cif.missing: marks that upstream has no mmCIF file for mmol 1 of 1bcd;
+    bc/1bcd_1.cif.unavailable: marks that fetching it failed for another reason (e.g. a timeout or a 5xx or 429 from
+        the PDBe). It is fetched again once the marker is older than the mirror's retry_after.
+"""
+import gzip
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from isambard.add_ons.filesystem import preferred_mmol, get_cif, get_mmol
+
+_index_filename = 'preferred_mmols.tsv'
+
+
+class StructureNotFound(ValueError):
+    """ Raised by a source that knows it has no such structure file, as opposed to failing to get it. """
+    pass
+
+
+class PDBeSource:
+    """ Structures fetched from the PDBe on demand. """
+    def __repr__(self):
+        return '<PDBeSource>'
+
+    def preferred_mmol(self, code):
+        return preferred_mmol(code=code)
+
+    def get_cif(self, code, mmol):
+        """ mmCIF text of mmol of code. Raises ValueError if it could not be fetched.
+
+        Notes
+        -----
+        isambard's get_cif returns None for any unsuccessful request, so a file that does not exist (404) can not be
+        told apart from a failed request here, and StructureNotFound is not raised.
+        """
+        cif = get_cif(code=code, mmol_number=mmol)
+        if not cif:
+            raise ValueError('No mmCIF file for {0} mmol {1}.'.format(code, mmol))
+        return cif
+
+    def get_mmol(self, code, mmol):
+        """ PDB format text of mmol of code. Raises ValueError if it could not be fetched (see get_cif). """
+        pdb = get_mmol(code=code, mmol_number=mmol)
+        if not pdb:
+            raise ValueError('No PDB file for {0} mmol {1}.'.format(code, mmol))
+        return pdb
+
+
+class DirectorySource:
+    """ Structures read from a local directory (see module docstring for its layout).
+
+    Parameters
+    ----------
+    folder: str
+
+    Notes
+    -----
+    Safe to share between threads and processes: files are written whole under a temporary name and then renamed,
+    and lines of the preferred mmol index are appended in single writes. The index is read incrementally, so codes
+    added by other processes are found.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self._mmols = None
+        self._index_offset = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{0}(folder={1})>'.format(self.__class__.__name__, self.folder)
+
+    def __getstate__(self):
+        # sent to worker processes without the lock and the loaded index.
+        return dict(folder=self.folder)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def path(self, code, mmol, extension):
+        """ Path of the gzipped extension ('cif' or 'pdb') file of mmol of code """
+        return self.marker_path(code, mmol, extension, 'gz')
+
+    def marker_path(self, code, mmol, extension, marker):
+        return os.path.join(self.folder, code[1:3], '{0}_{1}.{2}.{3}'.format(code, mmol, extension, marker))
+
+    def _read_index(self):
+        """ Add lines appended to the index since it was last read """
+        if self._mmols is None:
+            self._mmols = {}
+        filename = os.path.join(self.folder, _index_filename)
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'r') as foo:
+            foo.seek(self._index_offset)
+            lines = foo.read()
+        # a line that is still being written is left for the next read.
+        complete = lines[:lines.rfind('\n') + 1]
+        for line in complete.splitlines():
+            code, mmol = line.split('\t')
+            if mmol:
+                self._mmols[code] = int(mmol)
+            else:
+                self._mmols.pop(code, None)
+        self._index_offset += len(complete)
+        return
+
+    def cached_mmol(self, code):
+        """ Preferred mmol of code from the index, or None if it is not in the index """
+        with self._lock:
+            if self._mmols is None or code not in self._mmols:
+                self._read_index()
+            return self._mmols.get(code)
+
+    def preferred_mmol(self, code):
+        mmol = self.cached_mmol(code)
+        if mmol is None:
+            raise LookupError('Preferred mmol of {} is not in the index.'.format(code))
+        return mmol
+
+    def _read(self, code, mmol, extension):
+        path = self.path(code, mmol, extension)
+        if not os.path.exists(path):
+            raise StructureNotFound('No {0} file for {1} mmol {2} in {3}.'.format(extension, code, mmol, self.folder))
+        with gzip.open(path, 'rt') as foo:
+            return foo.read()
+
+    def get_cif(self, code, mmol):
+        """ mmCIF text of mmol of code. Raises StructureNotFound if there is none. """
+        return self._read(code, mmol, 'cif')
+
+    def get_mmol(self, code, mmol):
+        """ PDB format text of mmol of code. Raises StructureNotFound if there is none. """
+        return self._read(code, mmol, 'pdb')
+
+    def add_mmol(self, code, mmol):
+        """ Record mmol as the preferred mmol of code """
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock:
+            with open(os.path.join(self.folder, _index_filename), 'a') as foo:
+                foo.write('{0}\t{1}\n'.format(code, mmol))
+            if self._mmols is not None:
+                self._mmols[code] = mmol
+        return
+
+    def forget_mmol(self, code):
+        """ Remove the preferred mmol of code from the index.
+
+        Notes
+        -----
+        Other instances that have already looked code up keep its old mmol; those created afterwards (including the
+        copies sent to worker processes) do not.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock:
+            with open(os.path.join(self.folder, _index_filename), 'a') as foo:
+                foo.write('{0}\t\n'.format(code))
+            if self._mmols is not None:
+                self._mmols.pop(code, None)
+        return
+
+    def add_file(self, code, mmol, extension, text, marker='missing'):
+        """ Store text as the extension ('cif' or 'pdb') file of mmol of code.
+        If text is None, the file is marked instead, with a marker ('missing' or 'unavailable') file.
+        """
+        path = self.path(code, mmol, extension)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        if text is None:
+            open(self.marker_path(code, mmol, extension, marker), 'w').close()
+            return
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as foo:
+            temp_path = foo.name
+        with gzip.open(temp_path, 'wt', compresslevel=6) as foo:
+            foo.write(text)
+        os.replace(temp_path, path)
+        return
+
+
+class MirrorSource(DirectorySource):
+    """ A DirectorySource that fetches what it does not have from upstream, and keeps it.
+
+    Parameters
+    ----------
+    folder: str
+    upstream: source or None
+        Where missing structures are fetched from. Defaults to PDBeSource().
+    retry_after: float
+        Seconds after which a file that upstream failed to give, without raising StructureNotFound, is fetched again.
+        Files that upstream does not have (StructureNotFound) are not fetched again.
+    """
+    def __init__(self, folder, upstream=None, retry_after=86400):
+        super().__init__(folder)
+        self.upstream = PDBeSource() if upstream is None else upstream
+        self.retry_after = retry_after
+
+    def __getstate__(self):
+        return dict(folder=self.folder, upstream=self.upstream, retry_after=self.retry_after)
+
+    def preferred_mmol(self, code):
+        mmol = self.cached_mmol(code)
+        if mmol is None:
+            mmol = self.upstream.preferred_mmol(code)
+            self.add_mmol(code, mmol)
+        return mmol
+
+    def _unavailable(self, code, mmol, extension):
+        """ True if fetching the file from upstream failed less than retry_after seconds ago """
+        try:
+            age = time.time() - os.path.getmtime(self.marker_path(code, mmol, extension, 'unavailable'))
+        except OSError:
+            return False
+        return age < self.retry_after
+
+    def _read(self, code, mmol, extension):
+        if os.path.exists(self.path(code, mmol, extension)) or \
+                os.path.exists(self.marker_path(code, mmol, extension, 'missing')):
+            return super()._read(code, mmol, extension)
+        if self._unavailable(code, mmol, extension):
+            raise ValueError('Fetching the {0} file for {1} mmol {2} failed less than {3} s ago.'.format(
+                extension, code, mmol, self.retry_after))
+        try:
+            text = self.upstream.get_cif(code, mmol) if extension == 'cif' else self.upstream.get_mmol(code, mmol)
+        except StructureNotFound:
+            self.add_file(code, mmol, extension, None, marker='missing')
+            raise
+        except ValueError:
+            self.add_file(code, mmol, extension, None, marker='unavailable')
+            raise
+        self.add_file(code, mmol, extension, text)
+        return text
+
+    def evict(self, code):
+        """ Remove the preferred mmol and all files (and markers) of code from the mirror, so that they are fetched
+        from upstream again, e.g. after code has been revised.
+        """
+        directory = os.path.join(self.folder, code[1:3])
+        prefix = '{}_'.format(code)
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.startswith(prefix):
+                    try:
+                        os.remove(os.path.join(directory, filename))
+                    except FileNotFoundError:
+                        # removed by another process.
+                        pass
+        self.forget_mmol(code)
+        return
+
+    def fetch(self, code):
+        """ Make sure the preferred mmol of code and its structure (mmCIF, else PDB format) are in the mirror. """
+        mmol = self.preferred_mmol(code)
+        for extension in ['cif', 'pdb']:
+            if os.path.exists(self.path(code, mmol, extension)):
+                return
+        try:
+            self.get_cif(code, mmol)
+        except ValueError:
+            self.get_mmol(code, mmol)
+        return
+
+
+def read_structure(source, code):
+    """ Preferred mmol of code and its structure: the mmCIF text if there is one, else the PDB format text.
+
+    Returns
+    -------
+    mmol: int
+    text: str
+    cif: bool
+        True if text is mmCIF.
+    """
+    mmol = source.preferred_mmol(code)
+    try:
+        return mmol, source.get_cif(code, mmol), True
+    except ValueError:
+        return mmol, source.get_mmol(code, mmol), False
+
+
+def prefetched(codes, source, ahead=64, workers=8):
+    """ Yields each of codes in order, once source.fetch(code) has finished, fetching up to ahead codes at a time.
+
+    Notes
+    -----
+    Fetch errors are ignored here: the code is yielded anyway, and the error is raised again when the code is parsed.
+    If source has no fetch method (e.g. it is not a mirror), codes are yielded straight away.
+
+    Parameters
+    ----------
+    codes: iterable(str)
+    source: source
+    ahead: int
+        Number of codes fetched ahead of the one being consumed.
+    workers: int
+        Number of fetching threads.
+    """
+    if not hasattr(source, 'fetch'):
+        yield from codes
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for code in codes:
+            futures.append((code, executor.submit(source.fetch, code)))
+            if len(futures) > ahead:
+                code, future = futures.popleft()
+                future.exception()
+                yield code
+        while futures:
+            code, future = futures.popleft()
+            future.exception()
+            yield code
+
+
+def prefetch(codes, source, workers=8):
+    """ Fetch codes into the mirror source, returning {code: error message} of those that failed. """
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for code, error in zip(codes, executor.map(lambda code: _fetch_error(source, code), codes)):
+            if error is not None:
+                errors[code] = error
+    return errors
+
+
+def _fetch_error(source, code):
+    try:
+        source.fetch(code)
+    except Exception as e:
+        return '{0}: {1}'.format(type(e).__name__, e)
@@ -8,5 +8,119 @@ manager.add_option("-c", "--config", dest="config", required=False)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def build_atlas(mode='production'):
+    """ Compile the graphs used for naming into the memory-mapped atlas artifact. """
+    from isocket.atlas_artifact import build_atlas_artifact
+    from isocket_settings import global_settings
+    build_atlas_artifact(filename=global_settings["atlas_artifact"][mode], mode=mode)
+
+
+@manager.command
+def export_graphs(filename, append=False, chunk_size=100000):
+    """ Write the graphs in the database to a columnar HDF5 file, e.g. the atlas.h5 of atlas_visualisation. """
+    from isocket.database_management.export_graphs import export_graphs as _export_graphs
+    n_rows = _export_graphs(filename=filename, append=append, chunk_size=int(chunk_size))
+    print('{0} graphs written to {1}'.format(n_rows, filename))
+
+
+@manager.command
+def update_codes(codes_file, journal=None, workers=None, chunk_size=100, limit=None, mode='production', mirror=None,
+                 pipeline=False, coordinates=False):
+    """ Add the graphs of the PDB codes in codes_file (one per line) to the database, resuming any previous run.
+
+    Codes already added, or failed and not yet due for a retry, in the journal (UPDATE_JOURNAL by default) are skipped.
+    With --limit, at most that many codes are processed, so a full update can be run in parts.
+    With --mirror, structures are read from (and fetched ahead into) that local mirror directory.
+    With --pipeline, reading, graph finding and database writes overlap (see UpdatePipeline), and the throughput and
+    occupancy of each stage are printed. With --coordinates as well, structures are read into coordinate arrays
+    rather than AMPAL assemblies (see isocket.coordinates).
+    """
+    from flask import current_app
+    from isocket.database_management.pipeline import UpdatePipeline
+    from isocket.database_management.run_journal import RunJournal
+    from isocket.database_management.update_db import UpdateCodes
+    from isocket.structure_sources import MirrorSource
+    codes = _read_codes(codes_file)
+    source = MirrorSource(mirror) if mirror else None
+    workers = int(workers) if workers else None
+    limit = int(limit) if limit else None
+    run_journal = RunJournal(journal or current_app.config['UPDATE_JOURNAL'])
+    name_cache_file = current_app.config['NAME_CACHE_FILE']
+    try:
+        if pipeline:
+            stats = UpdatePipeline(codes=codes, source=source, workers=workers, chunk_size=int(chunk_size),
+                                   coordinates=coordinates).run(mode=mode, journal=run_journal, limit=limit,
+                                                                name_cache_file=name_cache_file)
+            print(stats)
+        else:
+            UpdateCodes(codes=codes, source=source).run_update(mode=mode, workers=workers, chunk_size=int(chunk_size),
+                                                               journal=run_journal, limit=limit,
+                                                               name_cache_file=name_cache_file)
+    finally:
+        print(run_journal)
+        run_journal.close()
+
+
+@manager.command
+def build_manifest(mirror_dir, manifest):
+    """ Scan a local PDB mirror and write its manifest, reusing the checksums of unchanged files from manifest.
+
+    mirror_dir is a copy of a wwPDB archive (e.g. made with rsync), not the structure directory given as --mirror to
+    update_codes and delta_update.
+    """
+    from isocket.database_management.mirror_manifest import build_manifest as _build_manifest, read_manifest, \
+        write_manifest
+    entries = _build_manifest(mirror_dir=mirror_dir, previous=read_manifest(manifest))
+    write_manifest(entries, manifest)
+    print('{0} entries written to {1}'.format(len(entries), manifest))
+
+
+@manager.command
+def delta_update(manifest, journal=None, workers=None, chunk_size=100, limit=None, mode='production', stamp=False,
+                 mirror=None):
+    """ Update the database from the entries of a mirror manifest that were added, revised or made obsolete.
+
+    With --stamp, codes in the database without a stored checksum are first taken to be up to date with the manifest.
+    With --mirror, structures are read from (and fetched ahead into) that local mirror directory. It is a different
+    directory from the wwPDB archive the manifest was built from: revised codes are evicted from it and fetched again.
+    """
+    from flask import current_app
+    from isocket.database_management.delta_update import run_delta, stamp_revisions
+    from isocket.database_management.mirror_manifest import read_manifest
+    from isocket.database_management.run_journal import RunJournal
+    from isocket.structure_sources import MirrorSource
+    entries = read_manifest(manifest)
+    if stamp:
+        print('{} codes stamped with their manifest revisions'.format(stamp_revisions(entries)))
+    run_journal = RunJournal(journal or current_app.config['UPDATE_JOURNAL'])
+    try:
+        delta = run_delta(entries, mode=mode, workers=int(workers) if workers else None, chunk_size=int(chunk_size),
+                          journal=run_journal, limit=int(limit) if limit else None,
+                          source=MirrorSource(mirror) if mirror else None,
+                          name_cache_file=current_app.config['NAME_CACHE_FILE'])
+        print('{0} added, {1} revised, {2} obsolete'.format(len(delta.added), len(delta.revised),
+                                                           len(delta.obsolete)))
+    finally:
+        print(run_journal)
+        run_journal.close()
+
+
+@manager.command
+def prefetch_structures(codes_file, mirror, workers=8):
+    """ Fetch the preferred mmol and structure of each PDB code in codes_file (one per line) into a local mirror. """
+    from isocket.structure_sources import MirrorSource, prefetch
+    codes = _read_codes(codes_file)
+    errors = prefetch(codes, source=MirrorSource(mirror), workers=int(workers))
+    for code in sorted(errors):
+        print('{0}: {1}'.format(code, errors[code]))
+    print('{0} of {1} codes in {2}'.format(len(codes) - len(errors), len(codes), mirror))
+
+
+def _read_codes(codes_file):
+    with open(codes_file, 'r') as foo:
+        return [line.strip().lower() for line in foo if line.strip()]
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,27 @@
+"""Version counter for the graph and pdb tables
+
+Revision ID: 0c95e2a7d4f3
+Revises: e6a3d05b7c18
+Create Date: 2026-10-17 21:48:09.615274
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0c95e2a7d4f3'
+down_revision = 'e6a3d05b7c18'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    table = op.create_table('data_version',
+                            sa.Column('id', sa.Integer(), nullable=False),
+                            sa.Column('version', sa.Integer(), nullable=False),
+                            sa.PrimaryKeyConstraint('id'),
+                            mysql_engine='InnoDB')
+    op.bulk_insert(table, [dict(id=1, version=1)])
+
+
+def downgrade():
+    op.drop_table('data_version')
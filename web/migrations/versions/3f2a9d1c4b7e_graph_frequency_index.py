@@ -0,0 +1,22 @@
+"""Composite index for graph frequency queries
+
+Revision ID: 3f2a9d1c4b7e
+Revises: c72f4fbb0808
+Create Date: 2026-10-17 16:02:11.418305
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9d1c4b7e'
+down_revision = 'c72f4fbb0808'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_graph_cutoff_id_atlas_id_pdbe_id', 'graph', ['cutoff_id', 'atlas_id', 'pdbe_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_graph_cutoff_id_atlas_id_pdbe_id', table_name='graph')
@@ -0,0 +1,31 @@
+"""Unique key on graph rows, for idempotent inserts
+
+Revision ID: 5d7c2e9f1a64
+Revises: 8b1e6c0d9a53
+Create Date: 2026-10-17 18:02:51.473120
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d7c2e9f1a64'
+down_revision = '8b1e6c0d9a53'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Remove any duplicate graphs, keeping the first added. The inner select is wrapped in a derived table, as MySQL
+    # does not allow a subquery on the table being deleted from.
+    op.execute('DELETE FROM graph WHERE id NOT IN (SELECT id FROM (SELECT MIN(id) AS id FROM graph GROUP BY '
+               'pdbe_id, cutoff_id, atlas_id, connected_component) AS keep)')
+    # The new index is created before the old one is dropped, as MySQL needs an index on pdbe_id for its foreign key.
+    op.create_index('uq_graph_pdbe_id_cutoff_id_atlas_id_cc', 'graph',
+                    ['pdbe_id', 'cutoff_id', 'atlas_id', 'connected_component'], unique=True)
+    op.drop_index('ix_graph_pdbe_id_cutoff_id_atlas_id_cc', table_name='graph')
+
+
+def downgrade():
+    op.create_index('ix_graph_pdbe_id_cutoff_id_atlas_id_cc', 'graph',
+                    ['pdbe_id', 'cutoff_id', 'atlas_id', 'connected_component'], unique=False)
+    op.drop_index('uq_graph_pdbe_id_cutoff_id_atlas_id_cc', table_name='graph')
@@ -0,0 +1,28 @@
+"""Covering indexes for per-structure graph queries
+
+Revision ID: 8b1e6c0d9a53
+Revises: 3f2a9d1c4b7e
+Create Date: 2026-10-17 16:41:37.205914
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8b1e6c0d9a53'
+down_revision = '3f2a9d1c4b7e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_graph_pdbe_id_cutoff_id_atlas_id_cc', 'graph',
+                    ['pdbe_id', 'cutoff_id', 'atlas_id', 'connected_component'], unique=False)
+    # Both are prefixes of a composite index, which also serves their foreign keys.
+    op.drop_index('ix_graph_pdbe_id', table_name='graph')
+    op.drop_index('ix_graph_cutoff_id', table_name='graph')
+
+
+def downgrade():
+    op.create_index('ix_graph_cutoff_id', 'graph', ['cutoff_id'], unique=False)
+    op.create_index('ix_graph_pdbe_id', 'graph', ['pdbe_id'], unique=False)
+    op.drop_index('ix_graph_pdbe_id_cutoff_id_atlas_id_cc', table_name='graph')
@@ -0,0 +1,24 @@
+"""Source file checksum and revision date of each PDB code
+
+Revision ID: a41f7c3e2b90
+Revises: 5d7c2e9f1a64
+Create Date: 2026-10-17 19:24:05.918342
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a41f7c3e2b90'
+down_revision = '5d7c2e9f1a64'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('pdb', sa.Column('checksum', sa.String(length=64), nullable=True))
+    op.add_column('pdb', sa.Column('revision_date', sa.Date(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('pdb', 'revision_date')
+    op.drop_column('pdb', 'checksum')
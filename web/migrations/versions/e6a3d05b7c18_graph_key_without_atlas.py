@@ -0,0 +1,34 @@
+"""Unique key on graph rows without atlas_id
+
+Revision ID: e6a3d05b7c18
+Revises: a41f7c3e2b90
+Create Date: 2026-10-17 21:12:40.337816
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e6a3d05b7c18'
+down_revision = 'a41f7c3e2b90'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Remove graphs added again under a different name, keeping the first added (as inserts do).
+    op.execute('DELETE FROM graph WHERE id NOT IN (SELECT id FROM (SELECT MIN(id) AS id FROM graph GROUP BY '
+               'pdbe_id, cutoff_id, connected_component) AS keep)')
+    # The new indexes are created before the old one is dropped, as MySQL needs an index on pdbe_id for its foreign
+    # key.
+    op.create_index('uq_graph_pdbe_id_cutoff_id_cc', 'graph', ['pdbe_id', 'cutoff_id', 'connected_component'],
+                    unique=True)
+    op.create_index('ix_graph_pdbe_id_cutoff_id_atlas_id_cc', 'graph',
+                    ['pdbe_id', 'cutoff_id', 'atlas_id', 'connected_component'], unique=False)
+    op.drop_index('uq_graph_pdbe_id_cutoff_id_atlas_id_cc', table_name='graph')
+
+
+def downgrade():
+    op.create_index('uq_graph_pdbe_id_cutoff_id_atlas_id_cc', 'graph',
+                    ['pdbe_id', 'cutoff_id', 'atlas_id', 'connected_component'], unique=True)
+    op.drop_index('ix_graph_pdbe_id_cutoff_id_atlas_id_cc', table_name='graph')
+    op.drop_index('uq_graph_pdbe_id_cutoff_id_cc', table_name='graph')
@@ -0,0 +1,56 @@
+import json
+import os
+
+from isocket.extensions import db
+from isocket.database_management.populate_models import add_graphs_to_db, remove_pdb_codes, set_pdb_revisions
+from isocket.database_management.queries import data_version
+from unit_tests.test_database import GraphsTestCase, graph_dicts
+
+os.environ['ISOCKET_CONFIG'] = 'testing'
+
+
+class GraphFrequencyAPITestCase(GraphsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph_dicts = graph_dicts([('2ebo', 'G3'), ('10gs', 'G3'), ('1aq5', 'G4')], mmols=(1, 2), kcuts=[2])
+        add_graphs_to_db(graph_dicts=self.graph_dicts)
+
+    def test_frequencies(self):
+        r = self.client.get('/api/graphs?scut=7.0&kcut=2')
+        self.assertEqual(r.status_code, 200)
+        graphs = json.loads(r.data.decode())['graphs']
+        self.assertEqual([(x['name'], x['graphs'], x['structures']) for x in graphs], [('G3', 4, 2), ('G4', 2, 1)])
+
+    def test_filters(self):
+        r = self.client.get('/api/graphs/G3?scut=7.0&kcut=2&preferred=true&codes=2ebo,1aq5')
+        graphs = json.loads(r.data.decode())['graphs']
+        self.assertEqual([(x['name'], x['graphs'], x['structures']) for x in graphs], [('G3', 1, 1)])
+
+    def test_pagination(self):
+        r = self.client.get('/api/graphs?scut=7.0&kcut=2&page=2&per_page=1')
+        data = json.loads(r.data.decode())
+        self.assertEqual(data['total'], 2)
+        self.assertEqual([x['name'] for x in data['graphs']], ['G4'])
+
+    def test_etag(self):
+        r = self.client.get('/api/graphs?scut=7.0&kcut=2')
+        etag = r.headers['ETag']
+        self.assertEqual(self.client.get('/api/graphs?scut=7.0&kcut=2', headers={'If-None-Match': etag}).status_code,
+                         304)
+        add_graphs_to_db(graph_dicts=[dict(self.graph_dicts[0], code='1fmh')])
+        self.assertEqual(self.client.get('/api/graphs?scut=7.0&kcut=2', headers={'If-None-Match': etag}).status_code,
+                         200)
+
+    def test_data_version_bumped_by_writes(self):
+        versions = [data_version(db.session)]
+        remove_pdb_codes(['1aq5'])
+        versions.append(data_version(db.session))
+        set_pdb_revisions({'1fmh': ('0' * 64, None)})
+        versions.append(data_version(db.session))
+        self.assertEqual(len(set(versions)), 3)
+        remove_pdb_codes(['not_a_code'])
+        self.assertEqual(data_version(db.session), versions[-1])
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/graphs?scut=6.0&kcut=2').status_code, 404)
+        self.assertEqual(self.client.get('/api/graphs?codes=2eb;').status_code, 400)
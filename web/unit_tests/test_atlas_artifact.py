@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from networkx.generators import cycle_graph, complete_graph
+
+from isocket.atlas_artifact import AtlasArtifact, build_atlas_artifact
+from isocket.graph_theory import AtlasHandler, graph_invariants, isomorphism_checker
+
+mode = 'testing'
+
+
+class AtlasArtifactTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.filename = os.path.join(cls.tmp_dir.name, 'atlas_graphs.bin')
+        build_atlas_artifact(filename=cls.filename, mode=mode, max_cyclics=20, max_paths=20)
+        cls.artifact = AtlasArtifact(cls.filename)
+        cls.graph_list = AtlasHandler(mode=mode).get_graph_list(atlas=True, cyclics=True, paths=True,
+                                                                max_cyclics=20, max_paths=20)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_names(self):
+        self.assertEqual(self.artifact.names[:len(self.graph_list)], [g.name for g in self.graph_list])
+
+    def test_invariants(self):
+        for i in range(0, len(self.graph_list), 11):
+            self.assertEqual(self.artifact.invariants(i), graph_invariants(self.graph_list[i]))
+
+    def test_graphs(self):
+        for i in range(0, len(self.graph_list), 11):
+            g = self.artifact[i]
+            self.assertEqual(g.name, self.graph_list[i].name)
+            self.assertEqual(graph_invariants(g), graph_invariants(self.graph_list[i]))
+
+    def test_select(self):
+        selection = self.artifact.select(atlas=False, cyclics=True, paths=False, max_cyclics=10)
+        self.assertEqual([self.artifact.names[i] for i in selection], ['C8', 'C9', 'C10'])
+        with self.assertRaises(ValueError):
+            self.artifact.select(cyclics=True, max_cyclics=100)
+
+    def test_graph_index(self):
+        atlas_index = AtlasHandler(mode=mode, artifact=self.filename).get_graph_index(max_cyclics=20)
+        self.assertEqual(isomorphism_checker(cycle_graph(8), graph_list=atlas_index), 'C8')
+        self.assertEqual(isomorphism_checker(cycle_graph(5), graph_list=atlas_index), 'G38')
+        self.assertIsNone(isomorphism_checker(complete_graph(8), graph_list=atlas_index))
+
+    def test_not_an_artifact(self):
+        filename = os.path.join(self.tmp_dir.name, 'not_an_artifact.bin')
+        with open(filename, 'wb') as foo:
+            foo.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            AtlasArtifact(filename)
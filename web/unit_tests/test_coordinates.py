@@ -0,0 +1,83 @@
+import os
+import unittest
+
+import numpy
+
+from isocket.coordinates import CoordinateStructure, parse_pdb_atoms, parse_cif_atoms
+
+testing_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testing_files')
+
+
+def atoms_to_cif(atoms):
+    """ mmCIF text of an ATOM_DTYPE array, with a second model and a water that should not be read. """
+    items = ['group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_alt_id', 'auth_comp_id', 'auth_asym_id',
+             'auth_seq_id', 'pdbx_PDB_ins_code', 'Cartn_x', 'Cartn_y', 'Cartn_z', 'pdbx_PDB_model_num']
+    lines = ['data_test', 'loop_'] + ['_atom_site.{}'.format(x) for x in items]
+    for i, a in enumerate(atoms):
+        name = '"{}"'.format(a['name']) if "'" in a['name'] else a['name']
+        lines.append(' '.join(['ATOM', str(i + 1), a['element'] or '?', name, a['altloc'] or '.', a['resname'],
+                               a['chain'], str(a['resnum']), a['icode'] or '?'] +
+                              ['{:.3f}'.format(x) for x in a['xyz']] + ['1']))
+    lines.append('HETATM {} O O . HOH Z 1 ? 0.000 0.000 0.000 1'.format(len(atoms) + 1))
+    lines.append('ATOM {} N N . ALA A 1 ? 0.000 0.000 0.000 2'.format(len(atoms) + 2))
+    lines.append('#')
+    return '\n'.join(lines) + '\n'
+
+
+class CoordinateStructureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_codes = ['1ek9', '2ht0', '3qy1']
+        self.texts = {}
+        for code in self.test_codes:
+            with open(os.path.join(testing_folder, '{}.pdb'.format(code)), 'r') as foo:
+                self.texts[code] = foo.read()
+
+    def test_number_of_atoms(self):
+        """ Only the first of alternate locations is read (2ht0 and 3qy1 have A and B locations). """
+        for code, n_atoms in zip(self.test_codes, [9798, 2936, 3411]):
+            atoms = parse_pdb_atoms(self.texts[code])
+            self.assertEqual(len(atoms), n_atoms)
+            self.assertTrue(set(atoms['altloc']) <= {'', 'A'})
+
+    def test_cif_matches_pdb(self):
+        for code in self.test_codes:
+            atoms = parse_pdb_atoms(self.texts[code])
+            cif_atoms = parse_cif_atoms(atoms_to_cif(atoms))
+            for name in atoms.dtype.names:
+                if name == 'xyz':
+                    numpy.testing.assert_allclose(cif_atoms[name], atoms[name])
+                else:
+                    self.assertTrue((cif_atoms[name] == atoms[name]).all())
+
+    def test_first_model(self):
+        text = self.texts['3qy1']
+        model = ''.join(x + '\n' for x in text.splitlines() if x.startswith('ATOM  '))
+        two_models = 'MODEL        1\n{0}ENDMDL\nMODEL        2\n{0}ENDMDL\n'.format(model)
+        self.assertEqual(len(parse_pdb_atoms(two_models)), len(parse_pdb_atoms(text)))
+
+    def test_residues_and_chains(self):
+        cs = CoordinateStructure(parse_pdb_atoms(self.texts['1ek9']), id='1ek9')
+        self.assertEqual(len(cs.chain_starts), 3)
+        self.assertEqual(len(cs), len(set(cs.residues[['chain', 'resnum', 'icode']].tolist())))
+        self.assertEqual(len(cs.residue_index), len(cs.atoms))
+
+    def test_side_chain_centres(self):
+        cs = CoordinateStructure(parse_pdb_atoms(self.texts['1ek9']), id='1ek9')
+        centres = cs.side_chain_centres()
+        for r in range(0, len(cs), 50):
+            atoms = cs.atoms[cs.residue_index == r]
+            side_chain = atoms[~numpy.in1d(atoms['name'], ['N', 'CA', 'C', 'O'])]
+            if len(side_chain) == 0:
+                expected = atoms['xyz'][atoms['name'] == 'CA'][0]
+            else:
+                expected = side_chain['xyz'].mean(axis=0)
+            numpy.testing.assert_allclose(centres[r], expected)
+
+    def test_helices(self):
+        cs = CoordinateStructure(parse_pdb_atoms(self.texts['1ek9']), id='1ek9')
+        helices = cs.helices(min_length=8)
+        self.assertTrue(len(helices) > 0)
+        for h in helices:
+            self.assertTrue(len(h) >= 8)
+            self.assertTrue((cs.secondary_structure[h] == 'H').all())
+            self.assertEqual(len(set(cs.residues['chain'][h])), 1)
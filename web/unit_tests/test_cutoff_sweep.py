@@ -0,0 +1,87 @@
+import itertools
+import random
+import unittest
+from unittest import mock
+from collections import Counter, OrderedDict
+
+import networkx
+
+from isocket.cutoff_sweep import CutoffSweep, UnionFind
+
+
+def filter_kihs(kihs, scut, kcut):
+    """ Reference implementation of KnobGroup.filter_graph, acting on (knob_helix, hole_helix, distance) tuples. """
+    edge_list = [e for e in kihs if e[2] <= scut]
+    if kcut > 0:
+        c = Counter([(e[0], e[1]) for e in edge_list])
+        node_list = set(itertools.chain.from_iterable([k for k, v in c.items() if v > kcut]))
+        edge_list = [e for e in edge_list if (e[0] in node_list) and (e[1] in node_list)]
+    return edge_list
+
+
+def plain_graph(kihs):
+    """ Reference graph_to_plain_graph of the MultiDiGraph of kihs: nodes numbered in order of first appearance.
+    Numbered explicitly, as networkx 1.11 only keeps nodes in insertion order on Python 3.6 and later.
+    """
+    labels = OrderedDict()
+    for e1, e2, _ in kihs:
+        labels.setdefault(e1, len(labels))
+        labels.setdefault(e2, len(labels))
+    h = networkx.Graph()
+    h.add_nodes_from(range(len(labels)))
+    h.add_edges_from((labels[e1], labels[e2]) for e1, e2, _ in kihs)
+    return h
+
+
+def reference_components(kihs, scut, kcut):
+    h = plain_graph(filter_kihs(kihs, scut=scut, kcut=kcut))
+    if h.number_of_nodes() == 0:
+        return []
+    ccs = [h.subgraph(x) for x in networkx.connected_components(h)]
+    return sorted(ccs, key=lambda x: (-len(x.nodes()), min(x.nodes())))
+
+
+class CutoffSweepTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scuts = [7.0, 7.5, 8.0, 8.5, 9.0]
+        self.kcuts = list(range(4))
+        rng = random.Random(0)
+        helices = list(range(3, 15))
+        self.kihs = [(a, b, round(rng.uniform(6.0, 9.0), 2))
+                     for a, b in (rng.sample(helices, 2) for _ in range(80))]
+
+    def assert_same_components(self, ccs, expected):
+        self.assertEqual([sorted(x.nodes()) for x in ccs], [sorted(x.nodes()) for x in expected])
+        self.assertEqual([sorted(tuple(sorted(e)) for e in x.edges()) for x in ccs],
+                         [sorted(tuple(sorted(e)) for e in x.edges()) for x in expected])
+
+    def test_matches_filtering(self):
+        plain_graphs = CutoffSweep.from_kihs(self.kihs).plain_graphs(scuts=self.scuts, kcuts=self.kcuts)
+        for scut, kcut in itertools.product(self.scuts, self.kcuts):
+            self.assert_same_components(plain_graphs[(scut, kcut)],
+                                        reference_components(self.kihs, scut=scut, kcut=kcut))
+
+    def test_matches_filtering_sparse(self):
+        kihs = self.kihs[::5]
+        plain_graphs = CutoffSweep.from_kihs(kihs).plain_graphs(scuts=self.scuts, kcuts=self.kcuts)
+        for scut, kcut in itertools.product(self.scuts, self.kcuts):
+            self.assert_same_components(plain_graphs[(scut, kcut)], reference_components(kihs, scut=scut, kcut=kcut))
+
+    def test_no_kihs(self):
+        plain_graphs = CutoffSweep.from_kihs([]).plain_graphs(scuts=self.scuts, kcuts=self.kcuts)
+        self.assertTrue(all(x == [] for x in plain_graphs.values()))
+
+    def test_graph_names_unset(self):
+        plain_graphs = CutoffSweep.from_kihs(self.kihs).plain_graphs(scuts=self.scuts, kcuts=self.kcuts)
+        self.assertTrue(all(x.graph['name'] is None for ccs in plain_graphs.values() for x in ccs))
+
+    def test_components_merged_incrementally(self):
+        """ Each KIH is added to the union-find structure once per kcut, when scut first reaches it, rather than the
+        components being found again at every scut. """
+        with mock.patch.object(UnionFind, 'union', autospec=True, side_effect=UnionFind.union) as union:
+            CutoffSweep.from_kihs(self.kihs).plain_graphs(scuts=self.scuts, kcuts=self.kcuts)
+        expected = [(e1, e2) for kcut in self.kcuts for e1, e2, _ in filter_kihs(self.kihs, max(self.scuts), kcut)]
+        self.assertEqual(sorted(x[0][1:3] for x in union.call_args_list), sorted(expected))
+        # within each kcut, KIHs are added in order of the scut at which they are kept.
+        distances = [self.kihs[x[1]['edge']][2] for x in union.call_args_list]
+        self.assertEqual(distances[:len(self.kihs)], sorted(distances[:len(self.kihs)]))
@@ -1,16 +1,49 @@
+import datetime
 import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
 
+import pandas
+import sqlalchemy.event
+import sqlalchemy.exc
 from flask_testing import TestCase
 from isocket.extensions import db
 from isocket.factory import create_app
 from isocket.graph_theory import AtlasHandler
 
 from isocket.database_management.models import CutoffDB, AtlasDB, PdbDB, PdbeDB, GraphDB
-from isocket.database_management.update_db import UpdateCodes
-from isocket.database_management.populate_models import populate_cutoff, populate_atlas, remove_pdb_code
+from isocket.database_management import populate_models, update_db
+from isocket.database_management.update_db import UpdateCodes, iter_attempts
+from isocket.database_management.run_journal import RunJournal, INSERTED
+from isocket.database_management.delta_update import plan_delta, run_delta, stamp_revisions
+from isocket.database_management.mirror_manifest import ManifestEntry
+from isocket.database_management.export_graphs import export_graphs, last_exported_id
+from isocket.database_management.populate_models import populate_cutoff, populate_atlas, remove_pdb_code, \
+    add_graphs_to_db, add_graph_to_db, dimension_cache, upsert_id, remove_pdb_codes, set_pdb_revisions, InsertIgnore, \
+    unique_key
+from isocket.structure_sources import DirectorySource, MirrorSource
 
 os.environ['ISOCKET_CONFIG'] = 'testing'
 _mode = 'testing'
+testing_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testing_files')
+
+
+def graph_dicts(names, mmols=(1,), scuts=(7.0,), kcuts=(0,), cc_nums=(0,)):
+    """ Dicts of two node graphs, as taken by add_graphs_to_db, for each combination of the arguments.
+
+    Parameters
+    ----------
+    names: list((str, str))
+        (code, graph name) of each structure.
+    mmols, scuts, kcuts, cc_nums: iterable
+        mmol 1 is the preferred mmol.
+    """
+    return [dict(code=code, mmol=mmol, preferred=(mmol == 1), cc_num=cc_num, name=name, kcut=kcut, scut=scut, nodes=2,
+                 edges=1)
+            for code, name in names for mmol in mmols for scut in scuts for kcut in kcuts for cc_num in cc_nums]
 
 
 class BaseTestCase(TestCase):
@@ -27,6 +60,14 @@ class BaseTestCase(TestCase):
         db.drop_all()
 
 
+class GraphsTestCase(BaseTestCase):
+    """ Database with the cutoffs and the first ten atlas graphs, for tests that add graphs from graph_dicts. """
+    def setUp(self):
+        super().setUp()
+        populate_cutoff()
+        populate_atlas(graph_list=AtlasHandler().atlas_graphs[:10])
+
+
 class CutoffDBTestCase(BaseTestCase):
     def test_cutoff_rows(self):
         populate_cutoff()
@@ -66,6 +107,169 @@ class AtlasDBTestCase(BaseTestCase):
         self.assertEqual(c, len(self.graph_list))
 
 
+class DimensionCacheTestCase(GraphsTestCase):
+    def test_cutoff_ids(self):
+        cutoff_ids = dimension_cache.cutoff_ids(db.session)
+        self.assertEqual(len(cutoff_ids), 20)
+        c = db.session.query(CutoffDB).filter(CutoffDB.id == cutoff_ids[(8.5, 2)]).one()
+        self.assertEqual((float(c.scut), c.kcut), (8.5, 2))
+
+    def test_populate_atlas_invalidates(self):
+        self.assertNotIn('G10', dimension_cache.atlas_ids(db.session))
+        populate_atlas(graph_list=AtlasHandler().atlas_graphs[10:11])
+        self.assertIn('G10', dimension_cache.atlas_ids(db.session))
+
+    def test_recreated_tables_invalidate(self):
+        self.assertIn('G0', dimension_cache.atlas_ids(db.session))
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        populate_cutoff()
+        # G0 now has a different id.
+        populate_atlas(graph_list=AtlasHandler().atlas_graphs[5:10] + AtlasHandler().atlas_graphs[:1])
+        add_graphs_to_db(graph_dicts=graph_dicts([('2ebo', 'G0')]))
+        self.assertEqual(db.session.query(GraphDB).join(AtlasDB).filter(AtlasDB.name == 'G0').count(), 1)
+
+    def test_stale_ids_reloaded_after_integrity_error(self):
+        stale_id = dimension_cache.atlas_ids(db.session)['G0']
+        # another process removes G0 and adds it again with a new id, without this process' cache knowing.
+        table = AtlasDB.__table__
+        db.engine.execute(table.delete().where(table.c.name == 'G0'))
+        db.engine.execute(table.insert().values(name='G0', nodes=1, edges=0))
+        self.assertEqual(dimension_cache.atlas_ids(db.session)['G0'], stale_id)
+        add_graphs_to_db(graph_dicts=graph_dicts([('2ebo', 'G0')]))
+        g = db.session.query(GraphDB).one()
+        self.assertNotEqual(g.atlas_id, stale_id)
+        self.assertEqual(g.atlas.name, 'G0')
+
+
+class AddGraphsTestCase(GraphsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph_dicts = graph_dicts([('2ebo', 'G3'), ('10gs', 'U1')], scuts=[7.0, 8.5], kcuts=[0, 3],
+                                       cc_nums=range(2))
+
+    def test_graphs_added(self):
+        add_graphs_to_db(graph_dicts=self.graph_dicts)
+        self.assertEqual(db.session.query(GraphDB).count(), len(self.graph_dicts))
+        self.assertEqual(db.session.query(PdbDB).count(), 2)
+        self.assertEqual(db.session.query(PdbeDB).count(), 2)
+        self.assertEqual(db.session.query(AtlasDB).filter(AtlasDB.name == 'U1').count(), 1)
+
+    def test_same_as_add_graph_to_db(self):
+        add_graphs_to_db(graph_dicts=self.graph_dicts[::2])
+        for d in self.graph_dicts[1::2]:
+            add_graph_to_db(**d)
+        q = db.session.query(GraphDB).all()
+        observed = sorted((g.pdbe.pdb.pdb, g.atlas.name, float(g.cutoff.scut), g.cutoff.kcut, g.connected_component)
+                          for g in q)
+        expected = sorted((d['code'], d['name'], d['scut'], d['kcut'], d['cc_num']) for d in self.graph_dicts)
+        self.assertEqual(observed, expected)
+
+    def test_run_multiple_times(self):
+        add_graphs_to_db(graph_dicts=self.graph_dicts)
+        add_graphs_to_db(graph_dicts=self.graph_dicts)
+        self.assertEqual(db.session.query(GraphDB).count(), len(self.graph_dicts))
+
+    def test_add_graph_to_db_run_multiple_times(self):
+        for d in self.graph_dicts + self.graph_dicts:
+            add_graph_to_db(**d)
+        self.assertEqual(db.session.query(GraphDB).count(), len(self.graph_dicts))
+        self.assertEqual(db.session.query(PdbeDB).count(), 2)
+
+    def test_renamed_graph_not_added_again(self):
+        add_graphs_to_db(graph_dicts=self.graph_dicts)
+        renamed = [dict(d, name='G4') if d['name'] == 'U1' else d for d in self.graph_dicts]
+        add_graphs_to_db(graph_dicts=renamed)
+        self.assertEqual(db.session.query(GraphDB).count(), len(self.graph_dicts))
+
+
+class UpsertIdTestCase(BaseTestCase):
+    def test_new_and_existing(self):
+        i = upsert_id(db.session, PdbDB.__table__, ['pdb'], pdb='2ebo')
+        j = upsert_id(db.session, PdbDB.__table__, ['pdb'], pdb='10gs')
+        self.assertNotEqual(i, j)
+        self.assertEqual(upsert_id(db.session, PdbDB.__table__, ['pdb'], pdb='2ebo'), i)
+        self.assertEqual(db.session.query(PdbDB).count(), 2)
+
+    def test_existing_row_not_updated(self):
+        pdb_id = upsert_id(db.session, PdbDB.__table__, ['pdb'], pdb='2ebo')
+        i = upsert_id(db.session, PdbeDB.__table__, ['pdb_id', 'mmol'], pdb_id=pdb_id, mmol=1, preferred=True)
+        j = upsert_id(db.session, PdbeDB.__table__, ['pdb_id', 'mmol'], pdb_id=pdb_id, mmol=1, preferred=False)
+        self.assertEqual(i, j)
+        self.assertTrue(db.session.query(PdbeDB.preferred).filter(PdbeDB.id == i).scalar())
+
+    @unittest.skipUnless(populate_models._sqlite_has_returning, 'SQLite before 3.35 has no RETURNING')
+    def test_one_statement(self):
+        upsert_id(db.session, PdbDB.__table__, ['pdb'], pdb='2ebo')
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            upsert_id(db.session, PdbDB.__table__, ['pdb'], pdb='2ebo')
+            upsert_id(db.session, PdbDB.__table__, ['pdb'], pdb='10gs')
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(len(statements), 2)
+
+    def test_older_sqlite(self):
+        with mock.patch.object(populate_models, '_sqlite_has_returning', False):
+            self.test_new_and_existing()
+
+
+class InsertIgnoreTestCase(BaseTestCase):
+    def test_unique_keys(self):
+        self.assertEqual(unique_key(PdbDB.__table__), ['pdb'])
+        self.assertEqual(unique_key(PdbeDB.__table__), ['pdb_id', 'mmol'])
+        self.assertEqual(unique_key(GraphDB.__table__), ['pdbe_id', 'cutoff_id', 'connected_component'])
+
+    def test_duplicates_skipped(self):
+        db.session.execute(InsertIgnore(AtlasDB.__table__), [dict(name='G0', nodes=1, edges=0)] * 2)
+        self.assertEqual(db.session.query(AtlasDB).count(), 1)
+
+    def test_not_null_raises(self):
+        with self.assertRaises(sqlalchemy.exc.IntegrityError):
+            db.session.execute(InsertIgnore(AtlasDB.__table__), [dict(name='G0', nodes=None, edges=0)])
+
+    def test_older_sqlite(self):
+        with mock.patch.object(populate_models, '_sqlite_has_upsert', False):
+            self.test_duplicates_skipped()
+
+
+class ExportGraphsTestCase(GraphsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph_dicts = graph_dicts([('2ebo', 'G3'), ('10gs', 'U1')], scuts=[7.0, 8.5], kcuts=[0, 3],
+                                       cc_nums=range(2))
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'atlas.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        super().tearDown()
+
+    def test_same_as_database(self):
+        add_graphs_to_db(graph_dicts=self.graph_dicts)
+        export_graphs(filename=self.filename, chunk_size=5)
+        df = pandas.read_hdf(self.filename, 'graph_names')
+        observed = sorted(zip(df.pdb, df.gname, df.scut, df.kcut, df.cc_num))
+        expected = sorted((d['code'], d['name'], d['scut'], d['kcut'], d['cc_num']) for d in self.graph_dicts)
+        self.assertEqual(observed, expected)
+
+    def test_append(self):
+        add_graphs_to_db(graph_dicts=self.graph_dicts[:10])
+        self.assertEqual(export_graphs(filename=self.filename), 10)
+        add_graphs_to_db(graph_dicts=self.graph_dicts[10:])
+        self.assertEqual(export_graphs(filename=self.filename, append=True), len(self.graph_dicts) - 10)
+        self.assertEqual(export_graphs(filename=self.filename, append=True), 0)
+        df = pandas.read_hdf(self.filename, 'graph_names')
+        self.assertEqual(len(df), len(self.graph_dicts))
+        self.assertEqual(last_exported_id(self.filename), df.index.max())
+
+
 class CodesToAddTestCase(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -98,6 +302,194 @@ class CodesToAddTestCase(BaseTestCase):
         self.assertEqual(c, 16)
 
 
+class ParallelCodesToAddTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        populate_cutoff()
+        populate_atlas(graph_list=AtlasHandler().atlas_graphs)
+        self.codes = ['2ebo', '10gs', 'not_a_code']
+        self.cta = UpdateCodes(codes=self.codes, store_files=False)
+        self.cta.run_update(mode=_mode, workers=2)
+
+    def test_pdb_added(self):
+        c = db.session.query(PdbDB).count()
+        self.assertEqual(c, 2)
+
+    def test_same_graphs_as_serial(self):
+        serial = [(x.graph['code'], x.graph['scut'], x.graph['kcut'], x.graph['cc_num'], x.graph['name'])
+                  for x in UpdateCodes(codes=self.codes[:2]).knob_graphs]
+        parallel = [(x.graph['code'], x.graph['scut'], x.graph['kcut'], x.graph['cc_num'], x.graph['name'])
+                    for x in self.cta.parallel_knob_graphs(workers=2)]
+        self.assertEqual(serial, parallel)
+
+
+def _timed_records(code, store_files=False, source=None):
+    """ Stands in for update_db.knob_graph_records: no graphs, with the time that code started as its error. """
+    started = time.time()
+    if code == 'slow':
+        time.sleep(2)
+    return [], None, str(started)
+
+
+def _crashing_records(code, store_files=False, source=None):
+    """ Stands in for update_db.knob_graph_records: the worker dies on code 'crash'. """
+    if code == 'crash':
+        os._exit(1)
+    time.sleep(0.05)
+    return [], None, None
+
+
+class SlidingWindowTestCase(unittest.TestCase):
+    def test_slow_code_does_not_hold_back_submission(self):
+        codes = ['slow'] + ['c{}'.format(i) for i in range(12)]
+        with mock.patch.object(update_db, 'knob_graph_records', _timed_records):
+            attempts = list(iter_attempts(codes=codes, workers=2))
+        self.assertEqual([x.code for x in attempts], codes)
+        started = {x.code: float(x.error) for x in attempts}
+        # codes beyond the first window of 4 * workers start while the slow one is still running.
+        self.assertLess(started['c11'], started['slow'] + 2)
+
+    def test_killed_worker_fails_only_its_code(self):
+        codes = ['c{}'.format(i) for i in range(10)] + ['crash'] + ['d{}'.format(i) for i in range(10)]
+        with mock.patch.object(update_db, 'knob_graph_records', _crashing_records):
+            attempts = list(iter_attempts(codes=codes, workers=2))
+        self.assertEqual([x.code for x in attempts], codes)
+        failed = [x for x in attempts if x.error is not None]
+        self.assertEqual([x.code for x in failed], ['crash'])
+        self.assertTrue(failed[0].error.startswith('BrokenProcessPool'))
+
+
+class ChunkedCodesToAddTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        populate_cutoff()
+        populate_atlas(graph_list=AtlasHandler().atlas_graphs)
+        self.codes = ['2ebo', '10gs']
+        self.cta = UpdateCodes(codes=self.codes, store_files=False)
+        self.cta.run_update(mode=_mode, chunk_size=1)
+
+    def test_graphs_added(self):
+        kg_len = sum(len(x) for x in self.cta.iter_knob_graphs())
+        c = db.session.query(GraphDB).count()
+        self.assertEqual(kg_len, c)
+
+
+class JournalledCodesToAddTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        populate_cutoff()
+        populate_atlas(graph_list=AtlasHandler().atlas_graphs)
+        self.codes = ['2ebo', 'not_a_code', '10gs']
+        self.folder = tempfile.mkdtemp()
+        self.journal = RunJournal(os.path.join(self.folder, 'journal.db'))
+        self.cta = UpdateCodes(codes=self.codes, store_files=False)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.folder)
+        super().tearDown()
+
+    def test_resume(self):
+        self.cta.run_update(mode=_mode, journal=self.journal, limit=2)
+        self.assertEqual(self.journal.state('2ebo')['status'], INSERTED)
+        self.assertEqual(self.journal.failures()[0][0], 'not_a_code')
+        self.assertEqual(self.journal.pending(self.codes), ['10gs'])
+        self.cta.run_update(mode=_mode, journal=self.journal)
+        self.assertEqual(self.journal.pending(self.codes), [])
+        kg_len = len(UpdateCodes(codes=['2ebo', '10gs']).knob_graphs)
+        self.assertEqual(db.session.query(GraphDB).count(), kg_len)
+
+
+class DeltaUpdateTestCase(GraphsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph_dicts = graph_dicts([(code, 'G3') for code in ['2ebo', '10gs', '1ek9']])
+        add_graphs_to_db(graph_dicts=self.graph_dicts)
+        self.date = datetime.date(2017, 7, 14)
+        set_pdb_revisions({'2ebo': ('a', self.date), '10gs': ('b', self.date)})
+        self.manifest = {code: ManifestEntry(revision_date=self.date, checksum=checksum, size=1, mtime=1)
+                         for code, checksum in [('2ebo', 'a'), ('10gs', 'c'), ('3qy1', 'd')]}
+
+    def test_plan(self):
+        delta = plan_delta(self.manifest)
+        self.assertEqual(delta.added, ['3qy1'])
+        self.assertEqual(delta.revised, ['10gs'])
+        self.assertEqual(delta.obsolete, ['1ek9'])
+        # 1ek9 has no stored checksum.
+        self.manifest['1ek9'] = ManifestEntry(revision_date=self.date, checksum='e', size=1, mtime=1)
+        self.assertEqual(plan_delta(self.manifest).revised, ['10gs', '1ek9'])
+
+    def test_stamp(self):
+        self.manifest['1ek9'] = ManifestEntry(revision_date=self.date, checksum='e', size=1, mtime=1)
+        self.assertEqual(stamp_revisions(self.manifest), 1)
+        self.assertEqual(plan_delta(self.manifest).revised, ['10gs'])
+        p = db.session.query(PdbDB).filter(PdbDB.pdb == '1ek9').one()
+        self.assertEqual((p.checksum, p.revision_date), ('e', self.date))
+
+    def test_remove_pdb_codes(self):
+        self.assertEqual(remove_pdb_codes(['1ek9', '10gs', 'abcd']), 2)
+        self.assertEqual([x.pdb for x in db.session.query(PdbDB)], ['2ebo'])
+        self.assertEqual(db.session.query(PdbeDB).count(), 1)
+        self.assertEqual(db.session.query(GraphDB).count(), 1)
+
+    def test_up_to_date(self):
+        manifest = {code: self.manifest[code] for code in ['2ebo']}
+        delta = run_delta(manifest, mode=_mode)
+        self.assertEqual(delta.obsolete, ['10gs', '1ek9'])
+        self.assertEqual(plan_delta(manifest), ([], [], []))
+        self.assertEqual(db.session.query(GraphDB).count(), 1)
+
+    def test_etag_changes(self):
+        """ A delta update removing a code with graphs and adding one without changes the graph frequency ETag. """
+        set_pdb_revisions({'1ek9': ('e', self.date)})
+        url = '/api/graphs?scut=7.0&kcut=0'
+        etag = self.client.get(url).headers['ETag']
+        folder = tempfile.mkdtemp()
+        try:
+            # the first four residues of 3qy1, which form no helices and so no graphs.
+            with open(os.path.join(testing_folder, '3qy1.pdb'), 'r') as foo:
+                atoms = [x for x in foo if x.startswith('ATOM')][:30]
+            source = DirectorySource(folder)
+            source.add_mmol('9xyz', 1)
+            source.add_file('9xyz', 1, 'pdb', ''.join(atoms) + 'END\n')
+            # 2ebo, whose graph is not the last added, is obsolete.
+            manifest = {code: ManifestEntry(revision_date=self.date, checksum=checksum, size=1, mtime=1)
+                        for code, checksum in [('10gs', 'b'), ('1ek9', 'e'), ('9xyz', 'f')]}
+            delta = run_delta(manifest, mode=_mode, source=source)
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual((delta.added, delta.revised, delta.obsolete), (['9xyz'], [], ['2ebo']))
+        self.assertEqual(sorted(x.pdb for x in db.session.query(PdbDB)), ['10gs', '1ek9', '9xyz'])
+        self.assertEqual(db.session.query(GraphDB).count(), 2)
+        r = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r.headers['ETag'], etag)
+
+    def test_revised_code_fetched_again(self):
+        folder = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(testing_folder, '3qy1.pdb'), 'r') as foo:
+                atoms = [x for x in foo if x.startswith('ATOM')][:30]
+            with open(os.path.join(testing_folder, '1ek9.pdb'), 'r') as foo:
+                revised_text = foo.read()
+            upstream = DirectorySource(os.path.join(folder, 'upstream'))
+            upstream.add_mmol('10gs', 1)
+            upstream.add_file('10gs', 1, 'pdb', revised_text)
+            # the mirror has the old revision of 10gs, which has no graphs.
+            mirror = MirrorSource(os.path.join(folder, 'mirror'), upstream=upstream)
+            mirror.add_mmol('10gs', 1)
+            mirror.add_file('10gs', 1, 'pdb', ''.join(atoms) + 'END\n')
+            manifest = {code: self.manifest[code] for code in ['2ebo', '10gs']}
+            delta = run_delta(manifest, mode=_mode, source=mirror)
+            self.assertEqual(mirror.get_mmol('10gs', 1), revised_text)
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual(delta.revised, ['10gs'])
+        q = db.session.query(GraphDB).join(PdbeDB).join(PdbDB).filter(PdbDB.pdb == '10gs')
+        self.assertGreater(q.count(), 0)
+        self.assertEqual(db.session.query(PdbDB.checksum).filter(PdbDB.pdb == '10gs').scalar(), 'c')
+
+
 class RemovePdbCodeTestCase(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -2,9 +2,10 @@ import pickle
 import unittest
 import os
 
+import networkx
 from networkx.generators import cycle_graph, complete_graph
 
-from isocket.graph_theory import AtlasHandler, isomorphism_checker
+from isocket.graph_theory import AtlasHandler, AtlasIndex, isomorphism_checker
 from isocket_settings import global_settings
 
 mode = 'testing'
@@ -54,4 +55,34 @@ class IsomorphismCheckerTestCase(unittest.TestCase):
         g = complete_graph(8)
         self.assertIsNone(isomorphism_checker(g))
 
+
+class AtlasIndexTestCase(unittest.TestCase):
+    """Tests for graph_theory.AtlasIndex"""
+    def setUp(self):
+        self.graph_list = AtlasHandler(mode=mode).get_graph_list(cyclics=True, paths=True, max_cyclics=20,
+                                                                 max_paths=20)
+        self.atlas_index = AtlasIndex(self.graph_list)
+
+    def test_len(self):
+        self.assertEqual(len(self.atlas_index), len(self.graph_list))
+
+    def test_same_names_as_linear_scan(self):
+        for g in self.graph_list[::7]:
+            self.assertEqual(isomorphism_checker(g, graph_list=self.atlas_index),
+                             isomorphism_checker(g, graph_list=self.graph_list))
+
+    def test_octomer(self):
+        octamer = cycle_graph(8)
+        self.assertEqual(isomorphism_checker(octamer, graph_list=self.atlas_index), "C8")
+
+    def test_complete_graph(self):
+        g = complete_graph(8)
+        self.assertIsNone(isomorphism_checker(g, graph_list=self.atlas_index))
+
+    def test_unnamed_graphs(self):
+        graph_list = [networkx.Graph(complete_graph(3).edges()), networkx.Graph(cycle_graph(4).edges())]
+        for g in graph_list:
+            g.graph['name'] = None
+        self.assertEqual(isomorphism_checker(cycle_graph(4), graph_list=AtlasIndex(graph_list)), '1')
+
 __author__ = 'Jack W. Heal'
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from flask_testing import TestCase
+
+from isocket.factory import create_app
+from isocket.jobs import JobQueue, QUEUED, RUNNING, FINISHED, FAILED
+from isocket.kih_cache import save_kihs
+from isocket.kih_table import KIHEdgeTable
+from isocket.structure import views
+
+os.environ['ISOCKET_CONFIG'] = 'testing'
+
+
+def add(x, y):
+    return x + y
+
+
+def fail():
+    raise ValueError('bad structure')
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def record(path, seconds):
+    """ Sleep for seconds, then write the start and end times to path """
+    start = time.time()
+    time.sleep(seconds)
+    with open(path, 'w') as foo:
+        json.dump([start, time.time()], foo)
+    return
+
+
+class JobQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.job_queue = JobQueue(folder=self.folder, workers=2, timeout=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_finished(self):
+        job_id = self.job_queue.submit(add, 1, 2)
+        state = self.job_queue.wait(job_id, timeout=10)
+        self.assertEqual(state['status'], FINISHED)
+        self.assertEqual(state['result'], 3)
+
+    def test_failed(self):
+        job_id = self.job_queue.submit(fail)
+        state = self.job_queue.wait(job_id, timeout=10)
+        self.assertEqual(state['status'], FAILED)
+        self.assertEqual(state['error'], 'ValueError: bad structure')
+
+    def test_timeout(self):
+        job_id = self.job_queue.submit(sleep, 5)
+        state = self.job_queue.wait(job_id, timeout=10)
+        self.assertEqual(state['status'], FAILED)
+        self.assertIn('timed out', state['error'])
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.job_queue.status('0' * 32))
+        self.assertIsNone(self.job_queue.status('../config'))
+
+    def test_module_level_functions_only(self):
+        with self.assertRaises(ValueError):
+            self.job_queue.submit(lambda: 1)
+
+    def test_workers_shared_by_queues(self):
+        """ Jobs submitted through two JobQueues on the same folder (as by two web processes) run one at a time. """
+        queues = [JobQueue(folder=self.folder, workers=1, timeout=10) for _ in range(2)]
+        paths = [os.path.join(self.folder, 'record{}.json'.format(i)) for i in range(4)]
+        job_ids = [queues[i % 2].submit(record, path, 0.3) for i, path in enumerate(paths)]
+        for job_id in job_ids:
+            self.assertEqual(queues[0].wait(job_id, timeout=30)['status'], FINISHED)
+        intervals = []
+        for path in paths:
+            with open(path, 'r') as foo:
+                intervals.append(json.load(foo))
+        intervals.sort()
+        self.assertTrue(all(a[1] <= b[0] for a, b in zip(intervals, intervals[1:])))
+
+    def test_interrupted_job(self):
+        """ A running job whose runner process has died is reported as failed. """
+        runner = subprocess.Popen([sys.executable, '-c', 'pass'])
+        runner.wait()
+        job_id = '1' * 32
+        self.job_queue._write(job_id, status=RUNNING, submitted=time.time(), started=time.time(), pid=runner.pid)
+        state = self.job_queue.status(job_id)
+        self.assertEqual(state['status'], FAILED)
+        self.assertIn('interrupted', state['error'])
+        self.job_queue._write(job_id, status=RUNNING, submitted=time.time(), started=time.time() - 3600,
+                              pid=os.getpid())
+        self.assertEqual(self.job_queue.status(job_id)['status'], FAILED)
+
+    def test_expired_job(self):
+        job_queue = JobQueue(folder=self.folder, expiry=60)
+        job_id = '2' * 32
+        job_queue._write(job_id, status=QUEUED, submitted=time.time() - 120)
+        self.assertEqual(job_queue.status(job_id)['status'], FAILED)
+        job_queue._write(job_id, status=QUEUED, submitted=time.time())
+        self.assertEqual(job_queue.status(job_id)['status'], QUEUED)
+
+    def test_clean(self):
+        job_queue = JobQueue(folder=self.folder, expiry=60)
+        old, queued = '3' * 32, '4' * 32
+        job_queue._write(old, status=FINISHED, result=1)
+        job_queue._write(queued, status=QUEUED, submitted=time.time())
+        for job_id in (old, queued):
+            os.utime(job_queue._path(job_id), (time.time() - 120, time.time() - 120))
+        job_queue.clean()
+        self.assertIsNone(job_queue.status(old))
+        self.assertEqual(job_queue.status(queued)['status'], QUEUED)
+
+
+class UploadedFileTestCase(TestCase):
+    def create_app(self):
+        app = create_app()
+        self.folder = tempfile.mkdtemp()
+        app.config['UPLOADED_STRUCTURES_DEST'] = self.folder
+        return app
+
+    def setUp(self):
+        views._kih_cache = None
+        with open(os.path.join(self.folder, 'abc.pdb'), 'w') as foo:
+            foo.write('ATOM')
+        self.job_queue = mock.Mock(spec=JobQueue)
+        self.job_queue.submit.return_value = '0' * 32
+        patcher = mock.patch('isocket.structure.views.get_job_queue', return_value=self.job_queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        views._kih_cache = None
+        shutil.rmtree(self.folder)
+
+    def test_cache_miss_submits_job(self):
+        response = self.client.get('/uploads.abc.pdb.7.0.2')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/jobs/{}'.format('0' * 32), response.location)
+        self.job_queue.submit.assert_called_once_with(views.analyse_upload, os.path.join(self.folder, 'abc.pdb'),
+                                                      self.app.config['KIH_CACHE_CUTOFF'],
+                                                      os.path.join(self.folder, 'abc.pdb.kihs.json'))
+
+    def test_cache_hit_rendered(self):
+        save_kihs(os.path.join(self.folder, 'abc.pdb.kihs.json'), cutoff=9.0,
+                  kihs=KIHEdgeTable.from_kihs([(1, 2, 6.5), (1, 2, 6.6), (1, 2, 6.7), (2, 1, 6.8)]))
+        self.assert200(self.client.get('/uploads.abc.pdb.7.0.2'))
+        self.job_queue.submit.assert_not_called()
+
+    def test_unknown_file(self):
+        self.assert404(self.client.get('/uploads.xyz.pdb.7.0.2'))
+        self.job_queue.submit.assert_not_called()
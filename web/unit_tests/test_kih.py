@@ -0,0 +1,87 @@
+import unittest
+
+import numpy
+
+from isocket.kih import segment_distances, helix_clusters, helix_kihs, pair_kihs
+
+
+def random_helices(rng, n_helices, box=60.0, length=20):
+    """ Side-chain centres and end CA positions of n_helices straight helices at random positions and directions """
+    centres, ends = [], []
+    for _ in range(n_helices):
+        start = rng.uniform(0, box, size=3)
+        direction = rng.normal(size=3)
+        direction /= numpy.linalg.norm(direction)
+        axis = start + 1.5 * numpy.arange(length)[:, None] * direction
+        centres.append(axis + rng.normal(scale=3.0, size=(length, 3)))
+        ends.append([axis[0], axis[-1]])
+    return centres, numpy.array(ends)
+
+
+class SegmentDistancesTestCase(unittest.TestCase):
+    def test_known_distances(self):
+        p0 = numpy.array([[0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0]], dtype=float)
+        p1 = numpy.array([[1, 0, 0], [1, 0, 0], [1, 0, 0], [1, 0, 0]], dtype=float)
+        # crossing above, parallel, end to end, and beyond the end of p.
+        q0 = numpy.array([[0.5, -1, 2], [0, 1, 0], [3, 0, 0], [4, -1, 0]], dtype=float)
+        q1 = numpy.array([[0.5, 1, 2], [1, 1, 0], [5, 0, 0], [4, 1, 0]], dtype=float)
+        numpy.testing.assert_allclose(segment_distances(p0, p1, q0, q1), [2.0, 1.0, 2.0, 3.0])
+
+    def test_sampled_distances(self):
+        rng = numpy.random.RandomState(0)
+        p0, p1, q0, q1 = (rng.uniform(0, 10, size=(50, 3)) for _ in range(4))
+        t = numpy.linspace(0, 1, 501)
+        for k in range(50):
+            p = p0[k] + t[:, None] * (p1[k] - p0[k])
+            q = q0[k] + t[:, None] * (q1[k] - q0[k])
+            sampled = numpy.sqrt(((p[:, None] - q[None]) ** 2).sum(-1)).min()
+            d = segment_distances(p0[k:k + 1], p1[k:k + 1], q0[k:k + 1], q1[k:k + 1])[0]
+            self.assertTrue(d <= sampled + 1e-9)
+            self.assertAlmostEqual(d, sampled, delta=0.05)
+
+
+class HelixKIHsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.RandomState(1)
+
+    def test_clusters_match_single_linkage(self):
+        for n in [2, 10, 40]:
+            _, ends = random_helices(self.rng, n, box=80.0)
+            self.assertEqual(helix_clusters(ends, cluster_distance=19.0, spatial_index=True),
+                             helix_clusters(ends, cluster_distance=19.0, spatial_index=False))
+
+    def test_clusters_mixed_lengths(self):
+        """ Short helices among a few long ones, which are close to helices far from their midpoints. """
+        _, ends = random_helices(self.rng, 40, box=150.0, length=12)
+        _, long_ends = random_helices(self.rng, 3, box=150.0, length=150)
+        ends = numpy.concatenate([ends, long_ends])
+        for cluster_distance in [5.0, 19.0]:
+            self.assertEqual(helix_clusters(ends, cluster_distance=cluster_distance, spatial_index=True),
+                             helix_clusters(ends, cluster_distance=cluster_distance, spatial_index=False))
+
+    def test_kd_tree_matches_pairwise(self):
+        for n, box in [(5, 20.0), (30, 40.0), (60, 120.0)]:
+            centres, ends = random_helices(self.rng, n, box=box)
+            for cutoff in [7.0, 9.0]:
+                kihs = helix_kihs(centres, ends=ends, cutoff=cutoff, spatial_index=True).kihs()
+                self.assertEqual(kihs, helix_kihs(centres, ends=ends, cutoff=cutoff, spatial_index=False).kihs())
+            self.assertTrue(len(kihs) > 0)
+
+    def test_missing_side_chain_centres(self):
+        centres, ends = random_helices(self.rng, 10, box=20.0)
+        centres[3][::2] = numpy.nan
+        self.assertEqual(helix_kihs(centres, ends=ends, cutoff=9.0, spatial_index=True).kihs(),
+                         helix_kihs(centres, ends=ends, cutoff=9.0, spatial_index=False).kihs())
+
+    def test_fewer_than_two_helices(self):
+        centres, ends = random_helices(self.rng, 1)
+        self.assertEqual(helix_kihs(centres, ends=ends).kihs(), [])
+        self.assertEqual(helix_kihs([], ends=numpy.empty((0, 2, 3))).kihs(), [])
+
+    def test_pair_kihs(self):
+        knobs = numpy.array([[0, 0, 0], [20, 0, 0]], dtype=float)
+        holes = numpy.array([[1, 0, 0], [0, 2, 0], [0, 0, 3], [4, 0, 0], [0, 0, 8]], dtype=float)
+        k, d = pair_kihs(knobs, holes, cutoff=7.0)
+        self.assertEqual(k.tolist(), [0])
+        self.assertEqual(d.tolist(), [4.0])
+        self.assertEqual(pair_kihs(knobs, holes[:3], cutoff=7.0)[0].tolist(), [])
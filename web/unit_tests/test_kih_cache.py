@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from isocket.kih_cache import KIHCache, content_hash, save_kihs, load_kihs
+from isocket.kih_table import KIHEdgeTable
+
+
+class KIHCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.kih_cache = KIHCache(maxsize=2)
+        self.kihs = [(1, 2, 6.5), (1, 2, 7.2), (2, 1, 8.8), (1, 3, 7.0), (1, 3, 7.1), (1, 3, 8.9), (3, 4, 6.0)]
+
+    def test_content_hash(self):
+        self.assertEqual(content_hash(b'ATOM'), content_hash(b'ATOM'))
+        self.assertNotEqual(content_hash(b'ATOM'), content_hash(b'HETATM'))
+
+    def test_get_smaller_cutoff(self):
+        self.kih_cache.put('a', cutoff=9.0, kihs=self.kihs)
+        self.assertEqual(self.kih_cache.get('a', cutoff=7.5), self.kihs)
+        self.assertIsNone(self.kih_cache.get('a', cutoff=10.0))
+        self.assertIsNone(self.kih_cache.get('b', cutoff=7.5))
+
+    def test_eviction(self):
+        self.kih_cache.put('a', cutoff=9.0, kihs=[])
+        self.kih_cache.put('b', cutoff=9.0, kihs=[])
+        self.kih_cache.get('a', cutoff=9.0)
+        self.kih_cache.put('c', cutoff=9.0, kihs=[])
+        self.assertEqual(list(self.kih_cache.entries), ['a', 'c'])
+
+    def test_filter_kihs(self):
+        table = KIHEdgeTable.from_kihs(self.kihs)
+        self.assertEqual(table.filter(cutoff=7.0, min_kihs=0).kihs(), [(1, 2, 6.5), (1, 3, 7.0), (3, 4, 6.0)])
+        self.assertEqual(table.filter(cutoff=7.5, min_kihs=1).kihs(),
+                         [(1, 2, 6.5), (1, 2, 7.2), (1, 3, 7.0), (1, 3, 7.1)])
+        self.assertEqual(table.filter(cutoff=9.0, min_kihs=2).kihs(), [(1, 3, 7.0), (1, 3, 7.1), (1, 3, 8.9)])
+
+    def test_save_and_load(self):
+        folder = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(folder, 'a.kihs.json')
+            self.assertIsNone(load_kihs(filename))
+            save_kihs(filename, cutoff=9.0, kihs=KIHEdgeTable.from_kihs(self.kihs))
+            cutoff, table = load_kihs(filename)
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual((cutoff, table.kihs()), (9.0, self.kihs))
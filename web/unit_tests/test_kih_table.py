@@ -0,0 +1,64 @@
+import itertools
+import random
+import unittest
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+
+from isocket.kih_table import KIHEdgeTable
+from unit_tests.test_cutoff_sweep import filter_kihs, plain_graph
+
+
+def graph_edge_order(kihs):
+    """ Reference order of the edges of a MultiDiGraph with insertion-ordered adjacency dicts """
+    adjacency = OrderedDict()
+    for kih in kihs:
+        adjacency.setdefault(kih[0], OrderedDict())
+        adjacency.setdefault(kih[1], OrderedDict())
+        adjacency[kih[0]].setdefault(kih[1], []).append(kih)
+    return [kih for neighbours in adjacency.values() for edges in neighbours.values() for kih in edges]
+
+
+class KIHEdgeTableTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.kihs = [(a, b, round(rng.uniform(6.0, 9.0), 2))
+                     for a, b in (rng.sample(range(3, 15), 2) for _ in range(80))]
+        self.table = KIHEdgeTable.from_kihs(self.kihs)
+
+    def test_kihs(self):
+        self.assertEqual(len(self.table), 80)
+        self.assertEqual(self.table.kihs(), self.kihs)
+        self.assertEqual(KIHEdgeTable.from_kihs([]).kihs(), [])
+
+    def test_knob_counts(self):
+        for cutoff in [None, 7.0, 8.0]:
+            src, dst, counts = self.table.knob_counts(cutoff=cutoff)
+            expected = Counter((e1, e2) for e1, e2, d in self.kihs if cutoff is None or d <= cutoff)
+            self.assertEqual(dict(zip(zip(src.tolist(), dst.tolist()), counts.tolist())), dict(expected))
+
+    def test_filter_matches_filter_graph(self):
+        for scut, kcut in itertools.product([6.0, 7.0, 7.5, 8.0, 9.0], range(4)):
+            self.assertEqual(self.table.filter(cutoff=scut, min_kihs=kcut).kihs(),
+                             filter_kihs(self.kihs, scut=scut, kcut=kcut))
+
+    def test_graph_edge_order(self):
+        table = KIHEdgeTable.from_kihs([(0, 1, 7.0), (1, 0, 8.0), (0, 2, 6.0), (0, 1, 6.5), (2, 1, 7.5)])
+        self.assertEqual(table.graph_edge_order().kihs(),
+                         [(0, 1, 7.0), (0, 1, 6.5), (0, 2, 6.0), (1, 0, 8.0), (2, 1, 7.5)])
+        self.assertEqual(self.table.graph_edge_order().kihs(), graph_edge_order(self.kihs))
+
+    def test_to_plain_graph(self):
+        for scut, kcut in itertools.product([6.0, 7.0, 8.0, 9.0], range(4)):
+            h = self.table.filter(cutoff=scut, min_kihs=kcut).to_plain_graph()
+            expected = plain_graph(filter_kihs(self.kihs, scut=scut, kcut=kcut))
+            self.assertEqual(sorted(h.nodes()), sorted(expected.nodes()))
+            self.assertEqual(sorted(tuple(sorted(e)) for e in h.edges()),
+                             sorted(tuple(sorted(e)) for e in expected.edges()))
+
+    def test_from_knob_group(self):
+        """ KIHs are read from the KnobIntoHoles of a KnobGroup, and put in the order of its graph's edges. """
+        helices = [SimpleNamespace(number=i) for i in range(3)]
+        kihs = [(0, 1, 7.0), (1, 0, 8.0), (0, 2, 6.0), (0, 1, 6.5), (2, 1, 7.5)]
+        kg = SimpleNamespace(get_monomers=lambda: [
+            SimpleNamespace(knob_helix=helices[e1], hole_helix=helices[e2], max_kh_distance=d) for e1, e2, d in kihs])
+        self.assertEqual(KIHEdgeTable.from_knob_group(kg).kihs(), graph_edge_order(kihs))
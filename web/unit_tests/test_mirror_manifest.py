@@ -0,0 +1,66 @@
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from isocket.database_management.mirror_manifest import build_manifest, read_manifest, write_manifest, file_checksum
+
+
+class MirrorManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.mirror = os.path.join(self.folder, 'mirror')
+        self.write('eb/2ebo.cif.gz', b'data_2EBO', mtime=1500000000)
+        self.write('0g/10gs.cif.gz', b'data_10GS', mtime=1400000000)
+        self.write('0g/pdb10gs.ent.gz', b'HEADER 10GS', mtime=1400000000)
+        self.write('ek/pdb1ek9.ent.gz', b'HEADER 1EK9', mtime=1300000000)
+        self.write('ek/README', b'not an entry', mtime=1300000000)
+        self.manifest_file = os.path.join(self.folder, 'manifest.tsv')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, path, data, mtime):
+        path = os.path.join(self.mirror, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, 'wb') as foo:
+            foo.write(data)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_entries(self):
+        manifest = build_manifest(self.mirror)
+        self.assertEqual(sorted(manifest), ['10gs', '1ek9', '2ebo'])
+        self.assertEqual(manifest['2ebo'].revision_date, datetime.date(2017, 7, 14))
+        # mmCIF files are preferred to PDB format files.
+        self.assertEqual(manifest['10gs'].checksum,
+                         file_checksum(os.path.join(self.mirror, '0g/10gs.cif.gz')))
+
+    def test_structure_source_refused(self):
+        source = os.path.join(self.folder, 'source')
+        self.write(os.path.join(source, 'eb/2ebo_1.cif.gz'), b'data_2EBO', mtime=1500000000)
+        with open(os.path.join(source, 'preferred_mmols.tsv'), 'w') as foo:
+            foo.write('2ebo\t1\n')
+        with self.assertRaises(ValueError):
+            build_manifest(source)
+
+    def test_round_trip(self):
+        manifest = build_manifest(self.mirror)
+        write_manifest(manifest, self.manifest_file)
+        self.assertEqual(read_manifest(self.manifest_file), manifest)
+        self.assertEqual(read_manifest(os.path.join(self.folder, 'missing.tsv')), {})
+
+    def test_revised_file(self):
+        previous = build_manifest(self.mirror)
+        self.write('eb/2ebo.cif.gz', b'data_2EBO revised', mtime=1600000000)
+        manifest = build_manifest(self.mirror, previous=previous)
+        self.assertNotEqual(manifest['2ebo'].checksum, previous['2ebo'].checksum)
+        self.assertEqual(manifest['1ek9'], previous['1ek9'])
+
+    def test_unchanged_files_not_read(self):
+        previous = build_manifest(self.mirror)
+        previous['1ek9'] = previous['1ek9']._replace(checksum='kept')
+        manifest = build_manifest(self.mirror, previous=previous)
+        self.assertEqual(manifest['1ek9'].checksum, 'kept')
@@ -0,0 +1,88 @@
+import os
+import random
+import tempfile
+import unittest
+
+import networkx
+from networkx.generators import cycle_graph, complete_graph, path_graph, star_graph
+
+from isocket.graph_theory import AtlasHandler, isomorphism_checker
+from isocket.name_cache import NameCache, CanonicalFormTooExpensive, canonical_form
+
+mode = 'testing'
+
+
+def relabelled(g, seed):
+    nodes = g.nodes()
+    shuffled = list(nodes)
+    random.Random(seed).shuffle(shuffled)
+    return networkx.relabel_nodes(g, dict(zip(nodes, shuffled)))
+
+
+class CanonicalFormTestCase(unittest.TestCase):
+    def test_isomorphic_graphs(self):
+        for g in [cycle_graph(9), path_graph(6), star_graph(5), networkx.petersen_graph()]:
+            self.assertEqual(canonical_form(g), canonical_form(relabelled(g, seed=1)))
+
+    def test_non_isomorphic_graphs(self):
+        for seed in range(50):
+            g = networkx.gnm_random_graph(7, 9, seed=seed)
+            h = networkx.gnm_random_graph(7, 9, seed=seed + 100)
+            self.assertEqual(canonical_form(g) == canonical_form(h), networkx.is_isomorphic(g, h))
+
+    def test_too_expensive(self):
+        with self.assertRaises(CanonicalFormTooExpensive):
+            canonical_form(networkx.circular_ladder_graph(30), max_leaves=5)
+
+
+class NameCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph_list = AtlasHandler(mode=mode).get_graph_index()
+        self.name_cache = NameCache(maxsize=10)
+
+    def test_same_names_as_isomorphism_checker(self):
+        for g in [cycle_graph(4), cycle_graph(8), star_graph(3), complete_graph(8)]:
+            self.assertEqual(self.name_cache.name(g, graph_list=self.graph_list, namespace='atlas'),
+                             isomorphism_checker(g, graph_list=self.graph_list))
+
+    def test_hits_and_misses(self):
+        self.name_cache.name(cycle_graph(5), graph_list=self.graph_list, namespace='atlas')
+        self.name_cache.name(cycle_graph(5), graph_list=self.graph_list, namespace='atlas')
+        name = self.name_cache.name(relabelled(cycle_graph(5), seed=2), graph_list=self.graph_list, namespace='atlas')
+        self.assertEqual(name, 'G38')
+        info = self.name_cache.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
+
+    def test_namespaces(self):
+        self.name_cache.name(cycle_graph(5), graph_list=self.graph_list, namespace='atlas')
+        self.assertIsNone(self.name_cache.name(cycle_graph(5), graph_list=[], namespace='unknowns'))
+        self.name_cache.clear(namespace='unknowns')
+        self.assertTrue(all(key[0] == 'atlas' for key in self.name_cache.entries))
+
+    def test_maxsize(self):
+        for n in range(3, 12):
+            self.name_cache.name(path_graph(n), graph_list=self.graph_list, namespace='atlas')
+        self.assertEqual(len(self.name_cache), 10)
+
+    def test_save_and_load(self):
+        self.name_cache.name(cycle_graph(5), graph_list=self.graph_list, namespace='atlas')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'name_cache.p')
+            self.name_cache.save(filename)
+            name_cache = NameCache()
+            name_cache.load(filename)
+        self.assertEqual(name_cache.name(relabelled(cycle_graph(5), seed=3), graph_list=[], namespace='atlas'), 'G38')
+        self.assertEqual(name_cache.cache_info().hits, 1)
+
+    def test_persisted(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'name_cache.p')
+            with self.name_cache.persisted(filename):
+                self.name_cache.name(cycle_graph(5), graph_list=self.graph_list, namespace='atlas')
+                self.name_cache.name(cycle_graph(5), graph_list=[], namespace='unknowns')
+            name_cache = NameCache()
+            with name_cache.persisted(filename):
+                pass
+        # only the atlas namespace is kept.
+        self.assertTrue(name_cache.entries)
+        self.assertTrue(all(key[0] == 'atlas' for key in name_cache.entries))
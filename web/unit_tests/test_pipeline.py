@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from isocket.extensions import db
+from isocket.graph_theory import AtlasHandler
+
+from isocket.database_management.models import AtlasDB, CutoffDB, GraphDB, PdbDB, PdbeDB
+from isocket.database_management.pipeline import StageStats, PipelineStats, UpdatePipeline, \
+    structure_knob_graph_records
+from isocket.database_management.populate_models import populate_cutoff, populate_atlas
+from isocket.database_management.run_journal import RunJournal
+from isocket.database_management.update_db import UpdateCodes
+from isocket.structure_sources import DirectorySource
+from unit_tests.test_database import BaseTestCase, testing_folder, _mode
+
+
+def _crashing_structure_records(code, mmol, text, cif, source, coordinates=False):
+    """ Stands in for pipeline.structure_knob_graph_records: the worker dies on 9ht0. """
+    if code == '9ht0':
+        os._exit(1)
+    return structure_knob_graph_records(code, mmol, text, cif, source, coordinates=coordinates)
+
+
+class StageStatsTestCase(unittest.TestCase):
+    def test_throughput_and_occupancy(self):
+        stats = StageStats('graph', slots=4)
+        for _ in range(10):
+            stats.add(2.0)
+        self.assertEqual(stats.items, 10)
+        self.assertAlmostEqual(stats.throughput(elapsed=10.0), 1.0)
+        # 20 s of work over 4 slots for 10 s.
+        self.assertAlmostEqual(stats.occupancy(elapsed=10.0), 0.5)
+
+    def test_empty_run(self):
+        stats = StageStats('read', slots=8)
+        self.assertEqual(stats.throughput(elapsed=0.0), 0.0)
+        self.assertEqual(stats.occupancy(elapsed=0.0), 0.0)
+
+    def test_pipeline_stats_report(self):
+        stats = PipelineStats([StageStats('read', 8), StageStats('graph', 2), StageStats('write', 1)])
+        stats['read'].add(1.0, items=5)
+        stats['write'].add(0.5, items=5)
+        stats.elapsed = 2.0
+        self.assertEqual(list(stats), ['read', 'graph', 'write'])
+        report = str(stats).splitlines()
+        self.assertEqual(report[0], '5 codes in 2.0 s')
+        self.assertEqual(len(report), 4)
+
+
+class UpdatePipelineTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        populate_cutoff()
+        populate_atlas(graph_list=AtlasHandler().atlas_graphs)
+        self.folder = tempfile.mkdtemp()
+        self.source = DirectorySource(os.path.join(self.folder, 'structures'))
+        # 1ek9 and 3qy1 have graphs that are not in the testing atlas, so 2ht0 is also stored as a second code.
+        with open(os.path.join(testing_folder, '2ht0.pdb'), 'r') as foo:
+            text = foo.read()
+        for code in ['2ht0', '9ht0']:
+            self.source.add_mmol(code, 1)
+            self.source.add_file(code, 1, 'pdb', text)
+        self.codes = ['2ht0', 'not_a_code', '9ht0']
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        super().tearDown()
+
+    @staticmethod
+    def graph_rows():
+        q = db.session.query(PdbDB.pdb, PdbeDB.mmol, PdbeDB.preferred, CutoffDB.scut, CutoffDB.kcut,
+                             GraphDB.connected_component, AtlasDB.name)
+        q = q.join(PdbeDB).join(GraphDB).join(CutoffDB).join(AtlasDB)
+        return sorted((code, mmol, bool(preferred), float(scut), kcut, cc, name)
+                      for code, mmol, preferred, scut, kcut, cc, name in q.all())
+
+    def run_with_journal(self, run):
+        """ Graph rows and journal states of the codes after run(journal) on an empty graph table """
+        journal = RunJournal(os.path.join(self.folder, 'journal.db'))
+        try:
+            run(journal)
+            states = {code: journal.state(code) for code in self.codes}
+        finally:
+            journal.close()
+            os.remove(os.path.join(self.folder, 'journal.db'))
+        rows = self.graph_rows()
+        for table in [GraphDB, PdbeDB, PdbDB]:
+            db.session.query(table).delete()
+        db.session.commit()
+        return rows, {code: (x['status'], x['error'] is None, x['attempts']) for code, x in states.items()}
+
+    def test_same_as_run_update(self):
+        expected = self.run_with_journal(lambda journal: UpdateCodes(codes=self.codes, source=self.source).run_update(
+            mode=_mode, journal=journal, chunk_size=2))
+        observed = self.run_with_journal(lambda journal: UpdatePipeline(
+            codes=self.codes, source=self.source, workers=2, readers=2, chunk_size=2).run(mode=_mode, journal=journal))
+        self.assertEqual({row[0] for row in expected[0]}, {'2ht0', '9ht0'})
+        self.assertEqual(observed[0], expected[0])
+        self.assertEqual(observed[1], expected[1])
+        self.assertFalse(observed[1]['not_a_code'][1])
+
+    def test_write_error_stops_run(self):
+        """ If writing to the database fails, the run stops with the error rather than waiting on the writer. """
+        pipeline = UpdatePipeline(codes=self.codes * 5, source=self.source, workers=2, readers=2, chunk_size=1,
+                                  queue_size=1)
+        errors = []
+
+        def run():
+            try:
+                pipeline.run(mode=_mode)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        with mock.patch('isocket.database_management.pipeline._write_batch',
+                        side_effect=RuntimeError('database is locked')) as write_batch:
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            thread.join(timeout=120)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, ['database is locked'])
+        self.assertEqual(write_batch.call_count, 1)
+        self.assertLess(pipeline.stats['read'].items, len(self.codes) * 5)
+
+    def test_killed_worker_fails_only_its_code(self):
+        journal = RunJournal(os.path.join(self.folder, 'journal.db'))
+        try:
+            with mock.patch('isocket.database_management.pipeline.structure_knob_graph_records',
+                            _crashing_structure_records):
+                UpdatePipeline(codes=self.codes * 3, source=self.source, workers=2, readers=2, chunk_size=2).run(
+                    mode=_mode, journal=journal)
+            errors = {code: journal.state(code)['error'] for code in self.codes}
+        finally:
+            journal.close()
+        self.assertIsNone(errors['2ht0'])
+        self.assertTrue(errors['9ht0'].startswith('BrokenProcessPool'))
+        self.assertEqual({row[0] for row in self.graph_rows()}, {'2ht0'})
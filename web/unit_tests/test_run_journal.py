@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from isocket.database_management.run_journal import RunJournal, PARSED, GRAPHED, INSERTED, FAILED
+
+
+class RunJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'journal.db')
+        self.journal = RunJournal(self.filename, backoff=10, max_backoff=25, max_attempts=3)
+        self.codes = ['2ebo', '10gs', '1ek9', '3qy1']
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.folder)
+
+    def test_new_codes_pending(self):
+        self.assertEqual(self.journal.pending(self.codes), self.codes)
+        self.assertEqual(self.journal.pending(self.codes, limit=2), self.codes[:2])
+
+    def test_inserted_codes_skipped(self):
+        self.journal.record('10gs', GRAPHED)
+        self.journal.record_many(['2ebo', '1ek9'], INSERTED)
+        self.assertEqual(self.journal.pending(self.codes), ['10gs', '3qy1'])
+        self.assertEqual(self.journal.summary(), {INSERTED: 2, GRAPHED: 1})
+
+    def test_persists(self):
+        self.journal.record_many(self.codes[:3], INSERTED)
+        self.journal.close()
+        self.journal = RunJournal(self.filename)
+        self.assertEqual(self.journal.pending(self.codes), ['3qy1'])
+
+    def test_failure_backoff(self):
+        self.journal.record_failure('10gs', error='ValueError: bad cif', status=PARSED)
+        state = self.journal.state('10gs')
+        self.assertEqual((state['status'], state['error'], state['attempts']), (PARSED, 'ValueError: bad cif', 1))
+        self.assertNotIn('10gs', self.journal.pending(self.codes))
+        self.assertIn('10gs', self.journal.pending(self.codes, now=time.time() + 11))
+        self.journal.record_failure('10gs', error='ValueError: bad cif', status=PARSED)
+        # the wait doubles, up to max_backoff.
+        self.assertNotIn('10gs', self.journal.pending(self.codes, now=time.time() + 11))
+        self.assertIn('10gs', self.journal.pending(self.codes, now=time.time() + 21))
+        self.journal.record_failure('10gs', error='ValueError: bad cif', status=PARSED)
+        self.assertAlmostEqual(self.journal.state('10gs')['retry_after'], time.time() + 25, delta=5)
+        # given up after max_attempts.
+        self.assertNotIn('10gs', self.journal.pending(self.codes, now=time.time() + 100))
+        self.assertEqual(self.journal.failures(), [('10gs', PARSED, 'ValueError: bad cif', 3)])
+        self.assertEqual(self.journal.summary(), {FAILED: 1})
+
+    def test_success_after_failure(self):
+        self.journal.record_failure('10gs', error='OSError: timed out')
+        self.journal.record('10gs', INSERTED)
+        self.assertIsNone(self.journal.state('10gs')['error'])
+        self.assertNotIn('10gs', self.journal.pending(self.codes, now=time.time() + 100))
+        self.assertEqual(self.journal.failures(), [])
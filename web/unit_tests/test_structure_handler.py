@@ -1,8 +1,15 @@
 import os
+import itertools
+import shutil
+import tempfile
 import unittest
 from collections import Counter
 
+import networkx
+
+from isocket.graph_theory import graph_to_plain_graph
 from isocket.structure_handler import StructureHandler
+from isocket.structure_sources import DirectorySource
 
 testing_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testing_files')
 
@@ -24,6 +31,31 @@ class StructureHandlerTestCase(unittest.TestCase):
             sh = StructureHandler.from_file(filename=file)
             self.assertFalse(sh.is_preferred)
 
+    def test_from_code_with_directory_source(self):
+        folder = tempfile.mkdtemp()
+        try:
+            source = DirectorySource(folder)
+            for code, file in zip(self.test_codes, self.test_files):
+                source.add_mmol(code, 1)
+                with open(file, 'r') as foo:
+                    source.add_file(code, 1, 'pdb', foo.read())
+            for code, file in zip(self.test_codes, self.test_files):
+                sh = StructureHandler.from_code(code=code, source=source)
+                self.assertTrue(sh.is_preferred)
+                self.assertEqual((sh.code, sh.mmol), (code, 1))
+                self.assertEqual(len(sh.assembly.get_atoms()),
+                                 len(StructureHandler.from_file(filename=file).assembly.get_atoms()))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_coordinates_kihs_match_knob_group(self):
+        """ KIHs found from the atom arrays of a CoordinateStructure are those found by KnobGroup. """
+        for file in self.test_files:
+            kihs = StructureHandler.from_file(filename=file).get_kih_table(cutoff=9.0).kihs()
+            coordinate_kihs = StructureHandler.from_file(filename=file, coordinates=True).get_kih_table(cutoff=9.0).kihs()
+            self.assertEqual(sorted((e1, e2, round(d, 6)) for e1, e2, d in coordinate_kihs),
+                             sorted((e1, e2, round(d, 6)) for e1, e2, d in kihs))
+
 
 class StructureHandlerGetKnobGraphsTestCase(unittest.TestCase):
 
@@ -55,3 +87,20 @@ class StructureHandlerGetKnobGraphsTestCase(unittest.TestCase):
                      'preferred']
         a = all([Counter(x.graph.keys()) == Counter(key_names) for x in self.kgs])
         self.assertTrue(a)
+
+    def test_matches_filter_graph(self):
+        """ Tests the cutoff sweep gives the same components as filtering the KnobGroup graph at each cutoff. """
+        kg = self.sh.get_knob_group(cutoff=9.0)
+        expected = []
+        for scut, kcut in itertools.product([9.0, 8.5, 8.0, 7.5, 7.0], range(4)):
+            h = graph_to_plain_graph(kg.filter_graph(g=kg.graph, cutoff=scut, min_kihs=kcut))
+            if h.number_of_nodes() == 0:
+                continue
+            ccs = sorted(networkx.connected_component_subgraphs(h, copy=True),
+                         key=lambda x: len(x.nodes()), reverse=True)
+            expected += [(scut, kcut, cc_num, sorted(cc.nodes()), sorted(tuple(sorted(e)) for e in cc.edges()))
+                         for cc_num, cc in enumerate(ccs)]
+        observed = [(x.graph['scut'], x.graph['kcut'], x.graph['cc_num'], sorted(x.nodes()),
+                     sorted(tuple(sorted(e)) for e in x.edges()))
+                    for x in self.kgs]
+        self.assertEqual(observed, expected)
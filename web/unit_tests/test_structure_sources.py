@@ -0,0 +1,136 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from isocket.structure_sources import DirectorySource, MirrorSource, StructureNotFound, prefetch, prefetched
+
+testing_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testing_files')
+
+
+class CountingSource(DirectorySource):
+    """ Stand-in for the PDBe: a DirectorySource that counts the requests made to it. """
+    def __init__(self, folder):
+        super().__init__(folder)
+        self.requests = []
+
+    def preferred_mmol(self, code):
+        self.requests.append(('mmol', code))
+        return super().preferred_mmol(code)
+
+    def get_cif(self, code, mmol):
+        self.requests.append(('cif', code))
+        return super().get_cif(code, mmol)
+
+    def get_mmol(self, code, mmol):
+        self.requests.append(('pdb', code))
+        return super().get_mmol(code, mmol)
+
+
+class FlakySource(CountingSource):
+    """ Stand-in for the PDBe failing to give mmCIF files (e.g. with a 5xx or 429), without saying they do not exist. """
+    def get_cif(self, code, mmol):
+        self.requests.append(('cif', code))
+        raise ValueError('No mmCIF file for {0} mmol {1}.'.format(code, mmol))
+
+
+class StructureSourcesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.codes = ['1ek9', '2ht0', '3qy1']
+        self.upstream = CountingSource(os.path.join(self.folder, 'upstream'))
+        self.texts = {}
+        for code in self.codes:
+            with open(os.path.join(testing_folder, '{}.pdb'.format(code)), 'r') as foo:
+                self.texts[code] = foo.read()
+            self.upstream.add_mmol(code, 1)
+            self.upstream.add_file(code, 1, 'pdb', self.texts[code])
+        self.upstream.add_file('3qy1', 1, 'cif', 'data_3QY1')
+        self.mirror = MirrorSource(os.path.join(self.folder, 'mirror'), upstream=self.upstream)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_directory_source(self):
+        self.assertEqual(self.upstream.preferred_mmol('1ek9'), 1)
+        self.assertEqual(self.upstream.get_mmol('1ek9', 1), self.texts['1ek9'])
+        with self.assertRaises(StructureNotFound):
+            self.upstream.get_cif('1ek9', 1)
+        with self.assertRaises(LookupError):
+            self.upstream.preferred_mmol('2ebo')
+
+    def test_index_read_by_other_instances(self):
+        other = DirectorySource(self.upstream.folder)
+        self.assertEqual(other.cached_mmol('1ek9'), 1)
+        self.upstream.add_mmol('2ebo', 2)
+        self.assertEqual(other.cached_mmol('2ebo'), 2)
+        # a partly written line is not read.
+        with open(os.path.join(self.upstream.folder, 'preferred_mmols.tsv'), 'a') as foo:
+            foo.write('10gs\t')
+        self.assertIsNone(other.cached_mmol('10gs'))
+        with open(os.path.join(self.upstream.folder, 'preferred_mmols.tsv'), 'a') as foo:
+            foo.write('3\n')
+        self.assertEqual(other.cached_mmol('10gs'), 3)
+
+    def test_mirror_fetches_once(self):
+        self.mirror.fetch('1ek9')
+        self.assertEqual(self.upstream.requests, [('mmol', '1ek9'), ('cif', '1ek9'), ('pdb', '1ek9')])
+        # the missing cif file is remembered, and the rest is read from the mirror.
+        mirror = MirrorSource(self.mirror.folder, upstream=self.upstream)
+        self.assertEqual(mirror.preferred_mmol('1ek9'), 1)
+        with self.assertRaises(ValueError):
+            mirror.get_cif('1ek9', 1)
+        self.assertEqual(mirror.get_mmol('1ek9', 1), self.texts['1ek9'])
+        mirror.fetch('1ek9')
+        self.assertEqual(len(self.upstream.requests), 3)
+        self.assertTrue(os.path.exists(os.path.join(self.mirror.folder, 'ek', '1ek9_1.pdb.gz')))
+        self.assertTrue(os.path.exists(os.path.join(self.mirror.folder, 'ek', '1ek9_1.cif.missing')))
+
+    def test_mirror_retries_failed_fetches(self):
+        upstream = FlakySource(self.upstream.folder)
+        mirror = MirrorSource(self.mirror.folder, upstream=upstream)
+        mirror.fetch('3qy1')
+        self.assertEqual(upstream.requests, [('mmol', '3qy1'), ('cif', '3qy1'), ('pdb', '3qy1')])
+        self.assertFalse(os.path.exists(mirror.marker_path('3qy1', 1, 'cif', 'missing')))
+        # not fetched again until the failure is older than retry_after.
+        with self.assertRaises(ValueError):
+            mirror.get_cif('3qy1', 1)
+        self.assertEqual(len(upstream.requests), 3)
+        mirror = MirrorSource(self.mirror.folder, upstream=self.upstream, retry_after=0)
+        self.assertEqual(mirror.get_cif('3qy1', 1), 'data_3QY1')
+        self.assertEqual(self.upstream.requests, [('cif', '3qy1')])
+
+    def test_mirror_prefers_cif(self):
+        self.mirror.fetch('3qy1')
+        self.assertEqual(self.upstream.requests, [('mmol', '3qy1'), ('cif', '3qy1')])
+        self.assertEqual(self.mirror.get_cif('3qy1', 1), 'data_3QY1')
+
+    def test_evict(self):
+        self.mirror.fetch('1ek9')
+        self.upstream.add_mmol('1ek9', 2)
+        self.upstream.add_file('1ek9', 2, 'pdb', self.texts['2ht0'])
+        self.mirror.evict('1ek9')
+        self.assertEqual(os.listdir(os.path.join(self.mirror.folder, 'ek')), [])
+        self.assertIsNone(MirrorSource(self.mirror.folder).cached_mmol('1ek9'))
+        self.assertEqual(self.mirror.preferred_mmol('1ek9'), 2)
+        self.assertEqual(self.mirror.get_mmol('1ek9', 2), self.texts['2ht0'])
+
+    def test_prefetch(self):
+        errors = prefetch(self.codes + ['2ebo'], source=self.mirror, workers=2)
+        self.assertEqual(list(errors), ['2ebo'])
+        offline = DirectorySource(self.mirror.folder)
+        for code in ['1ek9', '2ht0']:
+            self.assertEqual(offline.get_mmol(code, offline.preferred_mmol(code)), self.texts[code])
+        self.assertEqual(offline.get_cif('3qy1', 1), 'data_3QY1')
+
+    def test_prefetched_order(self):
+        codes = self.codes + ['2ebo'] + self.codes
+        self.assertEqual(list(prefetched(codes, source=self.mirror, ahead=2, workers=2)), codes)
+        self.assertEqual(list(prefetched(codes, source=self.upstream)), codes)
+
+    def test_pickle(self):
+        mirror = pickle.loads(pickle.dumps(self.mirror))
+        self.assertEqual((mirror.folder, mirror.upstream.folder, mirror.retry_after),
+                         (self.mirror.folder, self.upstream.folder, self.mirror.retry_after))
+        self.assertEqual(mirror.get_mmol('2ht0', mirror.preferred_mmol('2ht0')), self.texts['2ht0'])